@@ -0,0 +1,277 @@
+# standard libraries
+from asyncio import get_running_loop
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+import time
+
+# dependencies
+from yt_dlp import YoutubeDL
+
+
+
+'''
+Opt-in cache of youtube audio on disk so the songs a server plays over and over don't get streamed from youtube every time.
+Playing a local file starts instantly and can't stall halfway through because of a flaky connection.
+
+It's turned on by creating CONFIG_FILE:
+    {
+        "max_size_mb": 2048,    # the cache never takes up more than this
+        "min_plays": 3          # how many times a song has to be played before it's worth keeping
+    }
+Songs are downloaded in the background, one at a time, after they've been played min_plays times. When the cache is full the songs that were
+played least recently are deleted first.
+'''
+
+
+
+CONFIG_FILE = 'audio_cache.json'
+
+
+
+class AudioCache:
+    '''
+    Attributes:
+        CACHE_DIR (str): where the audio files and the index are saved
+        INDEX_FILE (str): file name of the index inside of the cache dir
+        MAX_TRACKED (int): max amount of songs whose play counts are remembered
+        MAX_FILE_FRACTION (int): songs bigger than max_size / MAX_FILE_FRACTION aren't cached so one long video can't push out everything else
+        STRAY_AGE (int): seconds a file that isn't in the index has to go untouched before it's deleted. a download that's still running keeps writing to its file
+        DOWNLOAD_OPTIONS (dict): options sent to yt-dlp
+        cache_dir (str): CACHE_DIR unless every cluster needs its own
+        index_file (str)
+        enabled (bool): False if CONFIG_FILE doesn't exist. every method is a no-op when disabled
+        loaded (bool): whether self.load() already ran. it only needs to once per process
+        max_size (int): bytes
+        min_plays (int)
+        entries (OrderedDict): the cached songs, least recently played first
+            {
+                webpage_url (str): {
+                    'file': str,        # file name inside of cache_dir
+                    'size': int,        # bytes
+                    'sha256': str,      # hash of the file when it was downloaded
+                    'codec': str        # audio codec, ex. 'opus'
+                }
+            }
+        plays (OrderedDict): how many times songs that aren't cached yet have been played. {webpage_url (str): int}
+        downloading (set(str)): webpage urls that are currently being downloaded
+        executor (concurrent.futures.ThreadPoolExecutor): one thread, so downloads never compete with each other (or much with anything else)
+    '''
+    CACHE_DIR = 'audio_cache/'
+    INDEX_FILE = 'index.json'
+    MAX_TRACKED = 10000
+    MAX_FILE_FRACTION = 10
+    STRAY_AGE = 60 * 60
+    DOWNLOAD_OPTIONS = {'verbose': False, 'quiet': True, 'format': 'bestaudio', 'noplaylist': True, 'cookiefile': 'cookies.txt', 'overwrites': True}
+
+    def __init__(self, config_file: str = CONFIG_FILE, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, self.INDEX_FILE)
+        self.entries = OrderedDict()
+        self.plays = OrderedDict()
+        self.downloading = set()
+        self.executor = None
+        self.loaded = False
+        self.save_lock = Lock()
+        self.logger = logging.getLogger('discord')
+        try:
+            with open(config_file, 'r') as file:
+                config = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.enabled = False
+            return
+        self.enabled = True
+        self.max_size = int(config.get('max_size_mb', 2048)) * 1024 * 1024
+        self.min_plays = int(config.get('min_plays', 3))
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-cache')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+
+    @staticmethod
+    def key(webpage_url: str) -> str:
+        return hashlib.sha1(webpage_url.encode()).hexdigest()
+
+
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+
+    @property
+    def size(self) -> int:
+        return sum(entry['size'] for entry in self.entries.values())
+
+
+
+    def load(self):
+        '''
+        Loads the index and verifies every file against its hash, dropping anything that's missing, truncated, or corrupted.
+        Also deletes stray files that aren't in the index (ex. from a download that was interrupted by a crash) once they're older than STRAY_AGE.
+        This is blocking so it should be run in self.executor.
+        '''
+        try:
+            with open(self.index_file, 'r') as file:
+                entries = OrderedDict(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = OrderedDict()
+        for webpage_url, entry in list(entries.items()):
+            path = os.path.join(self.cache_dir, entry['file'])
+            try:
+                valid = os.path.getsize(path) == entry['size'] and self.hash_file(path) == entry['sha256']
+            except OSError:
+                valid = False
+            if not valid:
+                self.logger.info(f'[AudioCache.load] dropping {webpage_url} because its file is missing or corrupted')
+                del entries[webpage_url]
+        known = {entry['file'] for entry in entries.values()}
+        now = time.time()
+        for path in glob.glob(os.path.join(self.cache_dir, '*')):
+            if os.path.basename(path) in known or path == self.index_file:
+                continue
+            try:
+                if now - os.path.getmtime(path) > self.STRAY_AGE:
+                    os.remove(path)
+            except OSError:
+                pass    # deleted or renamed by whatever was writing it
+        self.entries = entries
+        self.logger.info(f'[AudioCache.load] {len(self.entries)} cached songs using {self.size // (1024*1024)}MB')
+
+
+
+    async def start(self):
+        if self.enabled and not self.loaded:
+            self.loaded = True
+            await get_running_loop().run_in_executor(self.executor, self.load)
+
+
+
+    def get(self, webpage_url: str) -> str:
+        '''
+        Returns:
+            path (str or None): the local copy of a song if there is one
+        '''
+        if not self.enabled or webpage_url not in self.entries:
+            return None
+        entry = self.entries[webpage_url]
+        path = os.path.join(self.cache_dir, entry['file'])
+        try:
+            if os.path.getsize(path) != entry['size']:  # a cheap check. the full hash is only checked in self.load()
+                raise OSError
+        except OSError:
+            del self.entries[webpage_url]
+            return None
+        self.entries.move_to_end(webpage_url)
+        return path
+
+
+
+    def codec(self, webpage_url: str) -> str:
+        '''
+        Returns:
+            codec (str or None): the audio codec of a cached song
+        '''
+        entry = self.entries.get(webpage_url)
+        return entry.get('codec') if entry else None
+
+
+
+    def played(self, webpage_url: str):
+        '''
+        Counts a play of a song, and starts downloading it in the background once it's been played enough
+        '''
+        if not self.enabled or webpage_url in self.entries or webpage_url in self.downloading:
+            return
+        plays = self.plays.pop(webpage_url, 0) + 1
+        if plays < self.min_plays:
+            self.plays[webpage_url] = plays
+            while len(self.plays) > self.MAX_TRACKED:
+                self.plays.popitem(last=False)
+            return
+        self.downloading.add(webpage_url)
+        future = get_running_loop().run_in_executor(self.executor, self.download, webpage_url)
+        future.add_done_callback(lambda future: self.downloaded(webpage_url, future))
+
+
+
+    def download(self, webpage_url: str) -> dict:
+        '''
+        Downloads a song into self.cache_dir. This is blocking so it should be run in self.executor.
+
+        Returns:
+            entry (dict or None): see self.entries. None if the song is too big to cache
+        '''
+        key = self.key(webpage_url)
+        options = {**self.DOWNLOAD_OPTIONS, 'outtmpl': os.path.join(self.cache_dir, f'{key}.tmp.%(ext)s')}
+        with YoutubeDL(options) as ytdl:
+            info = ytdl.extract_info(webpage_url, download=True)
+            temp_path = ytdl.prepare_filename(info)
+        size = os.path.getsize(temp_path)
+        if not size or size > self.max_size // self.MAX_FILE_FRACTION:
+            os.remove(temp_path)
+            return None
+        file_name = f'{key}.{info["ext"]}'
+        os.replace(temp_path, os.path.join(self.cache_dir, file_name))
+        return {'file': file_name, 'size': size, 'sha256': self.hash_file(os.path.join(self.cache_dir, file_name)), 'codec': info.get('acodec')}
+
+
+
+    def downloaded(self, webpage_url: str, future):
+        '''
+        Done callback of self.download(). Adds the song and evicts the least recently played songs until the cache fits again.
+        '''
+        self.downloading.discard(webpage_url)
+        if future.cancelled():
+            return
+        if future.exception():
+            self.logger.info(f'[AudioCache.downloaded] could not download {webpage_url}: {future.exception()}')
+            return
+        entry = future.result()
+        if not entry:
+            return
+        self.entries[webpage_url] = entry
+        evicted = list()
+        size = self.size
+        while size > self.max_size and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            evicted.append(old['file'])
+            size -= old['size']
+        self.logger.info(f'[AudioCache.downloaded] cached {webpage_url} and evicted {len(evicted)} songs. {self.size // (1024*1024)}MB used')
+        self.executor.submit(self.save, evicted, list(self.entries.items()))
+
+
+
+    def save(self, evicted: list, entries: list):
+        '''
+        Deletes evicted files and atomically writes the index. This is blocking so it should be run in self.executor.
+        '''
+        with self.save_lock:
+            for file_name in evicted:
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except FileNotFoundError:
+                    pass
+            temp_file = f'{self.index_file}.tmp'
+            with open(temp_file, 'w') as file:
+                json.dump(entries, file, separators=(',', ':'))
+            os.replace(temp_file, self.index_file)
+
+
+
+    def shutdown(self):
+        '''
+        Drops downloads that haven't started yet. The one that's running finishes on its own.
+        '''
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,620 @@
+# standard libraries
+import asyncio
+import getopt
+import json
+import logging
+import logging.handlers
+import os
+import platform
+from queue import SimpleQueue
+from random import Random
+import subprocess
+import sys
+import tempfile
+from threading import Thread
+import time
+from types import SimpleNamespace
+
+
+
+'''
+Benchmarks the bot's hot paths without connecting to discord or youtube.
+The real cogs are driven with local fakes:
+    * FakeGuild, FakeMember, FakeChannel, FakeMessage, and FakeContext stand in for discord.py's models
+    * FakeVoiceClient consumes audio frames on its own thread and calls the after callback like discord.VoiceClient does
+    * StubExtractor replaces yt-dlp with a fixed delay and made up video info
+    * a synthetic soundboard directory is generated for soundboard scenarios
+
+Every scenario reports throughput, p50/p99 latency, and event loop lag, and the results are printed (or saved) as json so they can be
+compared between versions:
+    py Benchmark.py [-s scenario,scenario] [-o results.json] [-q]
+
+    -s: only run these scenarios (see SCENARIOS)
+    -o: save the results to a file instead of printing them
+    -q: quick mode. scales every scenario down so it finishes in a few seconds
+'''
+
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORDS = ['bruh', 'moment', 'yeet', 'oof', 'airhorn', 'sad', 'violin', 'wow', 'noice', 'bonk', 'vine', 'boom', 'sus', 'among', 'us',
+         'windows', 'xp', 'startup', 'fart', 'reverb', 'emotional', 'damage', 'nope', 'coffin', 'dance', 'mlg', 'hitmarker', 'wasted']
+
+
+
+####################################################################################################################################
+# MEASURING
+####################################################################################################################################
+
+def percentile(samples: list, percent: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1, int(len(ordered) * percent / 100))]
+
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    '''
+    Args:
+        samples (list[float]): latencies in seconds
+        elapsed (float): seconds the whole scenario took
+
+    Returns:
+        summary (dict): throughput is in operations per second and latencies are in milliseconds
+    '''
+    return {
+        'operations': len(samples),
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 4),
+        'p99_ms': round(percentile(samples, 99) * 1000, 4),
+        'max_ms': round(max(samples, default=0) * 1000, 4)
+    }
+
+
+
+class LagProbe:
+    '''
+    Measures event loop lag by repeatedly sleeping for a fixed interval and recording how late it wakes up.
+    Used as an async context manager around whatever is being measured.
+    '''
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = list()
+        self.task = None
+
+    async def probe(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self.probe())
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+
+    def summary(self) -> dict:
+        return {
+            'loop_lag_p50_ms': round(percentile(self.samples, 50) * 1000, 4),
+            'loop_lag_p99_ms': round(percentile(self.samples, 99) * 1000, 4),
+            'loop_lag_max_ms': round(max(self.samples, default=0) * 1000, 4)
+        }
+
+
+
+####################################################################################################################################
+# FAKES
+####################################################################################################################################
+
+class FakeAudio:
+    '''
+    Stands in for an AudioSource. Produces a fixed amount of 20ms opus-sized frames.
+    '''
+    def __init__(self, frames: int):
+        self.frames = frames
+
+    def read(self) -> bytes:
+        if self.frames <= 0:
+            return b''
+        self.frames -= 1
+        return b'\x00' * 160
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.frames = 0
+
+
+
+class FakeVoiceClient:
+    '''
+    Stands in for discord.VoiceClient. play() consumes the source's frames on its own thread (as fast as possible, or every
+    frame_delay seconds) and then calls the after callback from that thread, just like discord.py's AudioPlayer.
+
+    Attributes:
+        transitions (list[float]): shared list that gets the time between a clip finishing and the next one starting
+    '''
+    def __init__(self, channel, frame_delay: float, transitions: list):
+        self.channel = channel
+        self.frame_delay = frame_delay
+        self.transitions = transitions
+        self.connected = True
+        self.playing = False
+        self.stopped = False
+        self.finished_at = None
+        self.source = None
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def is_playing(self) -> bool:
+        return self.playing
+
+    def is_paused(self) -> bool:
+        return False
+
+    def play(self, source, *, after=None, **kwargs):
+        if self.finished_at is not None:
+            self.transitions.append(time.perf_counter() - self.finished_at)
+        self.source = source
+        self.playing = True
+        self.stopped = False
+        def consume():
+            while not self.stopped and source.read():
+                if self.frame_delay:
+                    time.sleep(self.frame_delay)
+            source.cleanup()
+            self.playing = False
+            self.finished_at = time.perf_counter()
+            if after:
+                after(None)
+        Thread(target=consume, daemon=True).start()
+
+    def stop(self):
+        self.stopped = True
+
+    async def disconnect(self, *, force: bool = False):
+        self.connected = False
+
+
+
+class FakeVoiceChannel:
+    def __init__(self, id: int, frame_delay: float, transitions: list):
+        self.id = id
+        self.name = f'voice-{id}'
+        self.frame_delay = frame_delay
+        self.transitions = transitions
+
+    async def connect(self, **kwargs):
+        return FakeVoiceClient(self, self.frame_delay, self.transitions)
+
+    def __str__(self):
+        return self.name
+
+
+
+class FakeMessage:
+    def __init__(self, id: int, author, channel, content: str = '', embed=None):
+        self.id = id
+        self.author = author
+        self.channel = channel
+        self.guild = getattr(channel, 'guild', None)
+        self.content = content
+        self.embed = embed
+        self.mentions = list()
+        self.reactions = list()
+        self.edits = 0
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def delete(self, **kwargs):
+        pass
+
+    async def edit(self, **kwargs):
+        self.edits += 1
+        self.embed = kwargs.get('embed', self.embed)
+        return self
+
+
+
+class FakeChannel:
+    '''
+    Stands in for a text channel. Counts everything that gets sent so scenarios can report how chatty the bot is.
+    '''
+    def __init__(self, id: int, guild=None):
+        self.id = id
+        self.guild = guild
+        self.sent = 0
+        self.history_messages = list()
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(self.sent, None, self, content or '', kwargs.get('embed'))
+
+    async def history(self, limit: int = 100, **kwargs):
+        for message in self.history_messages[-limit:][::-1]:
+            yield message
+
+
+
+class FakeMember:
+    def __init__(self, id: int, guild, voice_channel=None):
+        self.id = id
+        self.guild = guild
+        self.name = f'user{id}'
+        self.display_name = f'User {id}'
+        self.mention = f'<@!{id}>'
+        self.bot = False
+        self.voice = SimpleNamespace(channel=voice_channel) if voice_channel else None
+        self.display_avatar = SimpleNamespace(url=f'https://cdn.example/{id}.png')
+        self.guild_permissions = SimpleNamespace(kick_members=True)
+
+    def __str__(self):
+        return self.name
+
+
+
+class FakeGuild:
+    '''
+    Stands in for discord.Guild. Only some members are put in the member cache so that the slow paths (fetching members) get exercised too.
+    '''
+    def __init__(self, id: int, member_count: int, cached_ratio: float, frame_delay: float, transitions: list):
+        self.id = id
+        self.name = f'guild-{id}'
+        self.emojis = list()
+        self.voice_channel = FakeVoiceChannel(id * 10, frame_delay, transitions)
+        self.text_channel = FakeChannel(id * 10 + 1, self)
+        self.all_members = {id * 100000 + i: FakeMember(id * 100000 + i, self, self.voice_channel) for i in range(member_count)}
+        cached = int(member_count * cached_ratio)
+        self.cache = dict(list(self.all_members.items())[:cached])
+        self.fetches = 0
+        self.queries = 0
+
+    @property
+    def members(self) -> list:
+        return list(self.cache.values())
+
+    @property
+    def me(self):
+        return SimpleNamespace(id=0, guild_permissions=SimpleNamespace(add_reactions=True))
+
+    def get_member(self, user_id: int):
+        return self.cache.get(user_id)
+
+    async def fetch_member(self, user_id):
+        self.fetches += 1
+        await asyncio.sleep(0.001)    # one rest round trip
+        return self.all_members[int(user_id)]
+
+    async def query_members(self, query=None, *, limit=5, user_ids=None, presences=False, cache=True):
+        self.queries += 1
+        await asyncio.sleep(0.001)    # one gateway round trip
+        found = [self.all_members[user_id] for user_id in user_ids or list() if user_id in self.all_members]
+        if cache:
+            self.cache.update({member.id: member for member in found})
+        return found
+
+
+
+class FakeBot:
+    def __init__(self, guilds: list):
+        self.guilds = guilds
+        self.cogs = dict()
+        self.user = SimpleNamespace(id=0, name='GayBot')
+        self.loop = asyncio.get_running_loop()
+
+    def get_cog(self, name: str):
+        return self.cogs.get(name)
+
+    def get_guild(self, guild_id: int):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def is_closed(self) -> bool:
+        return False
+
+
+
+class FakeContext:
+    '''
+    Stands in for discord.ext.commands.Context.
+    '''
+    def __init__(self, bot, guild: FakeGuild, author: FakeMember, cog_name: str, command_name: str, content: str = ''):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+        self.channel = guild.text_channel
+        self.command = SimpleNamespace(module=cog_name, name=command_name, qualified_name=command_name)
+        self.message = FakeMessage(0, author, self.channel, content)
+        self.voice_client = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+
+class StubExtractor:
+    '''
+    Replaces YoutubeExtractor._extract() so searches take a fixed amount of time and never touch the network.
+    Still blocks the worker thread like yt-dlp would.
+    '''
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, search_term: str) -> dict:
+        self.calls += 1
+        time.sleep(self.latency)
+        video_id = abs(hash(search_term)) % 10**11
+        return {
+            'url': f'https://stream.example/{video_id}?expire={int(time.time()) + 6*3600}',
+            'title': f'Video for {search_term}',
+            'duration': 200,
+            'thumbnail': f'https://img.example/{video_id}.jpg',
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'acodec': 'opus'
+        }
+
+
+
+def make_soundboard(directory: str, clips: int, seed: int = 0):
+    '''
+    Fills a directory with empty clip files with made up names
+    '''
+    rng = Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(clips):
+        open(os.path.join(directory, f'{" ".join(rng.sample(WORDS, 3))} {i}.mp3'), 'w').close()
+
+
+
+def make_guilds(amount: int, members: int = 5, cached_ratio: float = 1.0, frame_delay: float = 0.0) -> tuple:
+    '''
+    Returns:
+        guilds (list[FakeGuild])
+        transitions (list[float]): filled in by every guild's FakeVoiceClient
+    '''
+    transitions = list()
+    return [FakeGuild(i + 1, members, cached_ratio, frame_delay, transitions) for i in range(amount)], transitions
+
+
+
+####################################################################################################################################
+# SCENARIOS
+####################################################################################################################################
+
+async def youtube_queue(quick: bool) -> dict:
+    '''
+    Lots of guilds queueing lots of youtube tracks at the same time, then playing through all of them.
+    Measures the play command, how long the whole thing takes, and the dead air between tracks.
+    '''
+    import VoiceCommands
+
+    guild_count, tracks, frames = (50, 5, 10) if quick else (500, 20, 25)
+    guilds, transitions = make_guilds(guild_count, frame_delay=0.01)   # every track plays for frames * 10ms
+    bot = FakeBot(guilds)
+    cog = VoiceCommands.VoiceCommands(bot)
+    bot.cogs['VoiceCommands'] = cog
+    stub = StubExtractor(latency=0.02)
+    cog.extractor._extract = stub
+    cog.INTER_TRACK_GAP = 0
+    if asyncio.iscoroutinefunction(cog.get_audio_object):
+        async def get_audio_object(clip, source, *args):
+            return FakeAudio(frames)
+        cog.get_audio_object = get_audio_object
+    else:
+        cog.get_audio_object = lambda clip, source: FakeAudio(frames)
+    if hasattr(cog, 'init_guilds'):
+        await cog.init_guilds()
+
+    latencies = list()
+    async def queue_tracks(guild):
+        ctx = FakeContext(bot, guild, guild.members[0], 'VoiceCommands', 'play')
+        for i in range(tracks):
+            start = time.perf_counter()
+            await cog.search_youtube.callback(cog, ctx, 'song', str(i % 50))
+            latencies.append(time.perf_counter() - start)
+
+    async with LagProbe() as lag:
+        start = time.perf_counter()
+        await asyncio.gather(*(queue_tracks(guild) for guild in guilds))
+        queued = time.perf_counter() - start
+        players = [instance.player for instance in cog.instances.values() if instance.player]
+        await asyncio.wait_for(asyncio.gather(*players, return_exceptions=True), timeout=600)
+        elapsed = time.perf_counter() - start
+    await cog.cog_unload()
+
+    return {
+        'guilds': guild_count,
+        'tracks_per_guild': tracks,
+        'play_command': summarize(latencies, queued),
+        'playthrough_s': round(elapsed, 4),
+        'track_transition': summarize(transitions, elapsed),
+        'extractions': stub.calls,
+        'messages_sent': sum(guild.text_channel.sent for guild in guilds),
+        **lag.summary()
+    }
+
+
+
+async def soundboard_search(quick: bool) -> dict:
+    '''
+    Searching a huge soundboard, first with searches that haven't been seen before and then with repeated ones.
+    '''
+    import Soundboard
+
+    clips, searches = (2000, 200) if quick else (10000, 1000)
+    make_soundboard('soundboard', clips)
+    catalog = Soundboard.SoundboardCatalog('soundboard/')
+    matcher = Soundboard.SoundboardMatcher(catalog)
+    start = time.perf_counter()
+    matcher.build()
+    build = time.perf_counter() - start
+
+    rng = Random(1)
+    queries = [' '.join(rng.sample(WORDS, rng.randint(1, 3))) + f' {rng.randint(0, clips)}' for _ in range(searches)]
+    results = dict()
+    async with LagProbe() as lag:
+        for label, batch in (('cold', queries), ('memoized', queries)):
+            latencies = list()
+            start = time.perf_counter()
+            for query in batch:
+                begin = time.perf_counter()
+                matcher.match(query)
+                latencies.append(time.perf_counter() - begin)
+                await asyncio.sleep(0)
+            results[label] = summarize(latencies, time.perf_counter() - start)
+
+    return {'clips': clips, 'index_build_ms': round(build * 1000, 4), **results, **lag.summary()}
+
+
+
+async def star_commands(quick: bool) -> dict:
+    '''
+    Concurrent gold star awards followed by leaderboard renders in guilds where only some members are cached.
+    '''
+    import GeneralCommands
+
+    guild_count, members, awards = (5, 50, 200) if quick else (20, 200, 2000)
+    guilds, _ = make_guilds(guild_count, members=members, cached_ratio=0.5)
+    bot = FakeBot(guilds)
+    cog = GeneralCommands.GeneralCommands(bot)
+    bot.cogs['GeneralCommands'] = cog
+
+    rng = Random(2)
+    give_latencies = list()
+    async def give(guild):
+        member = rng.choice(list(guild.all_members.values()))
+        ctx = FakeContext(bot, guild, guild.members[0], 'GeneralCommands', 'give')
+        start = time.perf_counter()
+        await cog.star_give.callback(cog, ctx, member.mention, rng.randint(1, 3))
+        give_latencies.append(time.perf_counter() - start)
+
+    leaderboard_latencies = list()
+    async with LagProbe() as lag:
+        start = time.perf_counter()
+        await asyncio.gather(*(give(rng.choice(guilds)) for _ in range(awards)))
+        gave = time.perf_counter() - start
+        start = time.perf_counter()
+        for guild in guilds:
+            ctx = FakeContext(bot, guild, guild.members[0], 'GeneralCommands', 'leaderboard')
+            begin = time.perf_counter()
+            await cog.star_list.callback(cog, ctx)
+            leaderboard_latencies.append(time.perf_counter() - begin)
+        listed = time.perf_counter() - start
+    await cog.cog_unload()
+
+    return {
+        'star_give': summarize(give_latencies, gave),
+        'star_leaderboard': summarize(leaderboard_latencies, listed),
+        'member_fetches': sum(guild.fetches for guild in guilds),
+        'member_queries': sum(guild.queries for guild in guilds),
+        **lag.summary()
+    }
+
+
+
+async def message_logging(quick: bool) -> dict:
+    '''
+    EventHandler.on_message under a flood of chat, logging through a queue like app.py sets up.
+    '''
+    import EventHandler
+
+    messages = 20000 if quick else 200000
+    guilds, _ = make_guilds(10)
+    logger = logging.getLogger('discord')
+    old_handlers, old_level = logger.handlers, logger.level
+    log_queue = SimpleQueue()
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+
+    latencies = list()
+    try:
+        async with LagProbe() as lag:
+            start = time.perf_counter()
+            for i in range(messages):
+                guild = guilds[i % len(guilds)]
+                message = FakeMessage(i, guild.members[0], guild.text_channel, f'message number {i}')
+                begin = time.perf_counter()
+                await EventHandler.on_message(message)
+                latencies.append(time.perf_counter() - begin)
+                if i % 1000 == 0:
+                    await asyncio.sleep(0)
+            elapsed = time.perf_counter() - start
+    finally:
+        logger.handlers, logger.level = old_handlers, old_level
+
+    return {'on_message': summarize(latencies, elapsed), 'records_logged': log_queue.qsize(), **lag.summary()}
+
+
+
+SCENARIOS = {
+    'youtube_queue': youtube_queue,
+    'soundboard_search': soundboard_search,
+    'star_commands': star_commands,
+    'message_logging': message_logging
+}
+
+
+
+async def run(scenarios: list, quick: bool) -> dict:
+    '''
+    Runs every scenario in its own empty working directory so caches and databases from one run (or the real bot) don't leak into another
+    '''
+    results = dict()
+    for name in scenarios:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            os.makedirs('soundboard', exist_ok=True)
+            try:
+                results[name] = await SCENARIOS[name](quick)
+            finally:
+                os.chdir(REPO_DIR)
+    return results
+
+
+
+def get_version() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+
+if __name__ == '__main__':
+    opts, _ = getopt.getopt(sys.argv[1:], "s:o:q")
+    scenarios = list(SCENARIOS)
+    output_file = None
+    quick = False
+
+    for opt, arg in opts:
+        if opt == '-s':
+            scenarios = arg.split(',')
+        elif opt == '-o':
+            output_file = arg
+        elif opt == '-q':
+            quick = True
+
+    sys.path.insert(0, REPO_DIR)
+    logging.getLogger('discord').addHandler(logging.NullHandler())
+    logging.getLogger('discord').propagate = False
+    report = {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'timestamp': int(time.time()),
+        'scenarios': asyncio.run(run(scenarios, quick))
+    }
+    output = json.dumps(report, indent=4)
+    if output_file:
+        with open(output_file, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
@@ -0,0 +1,357 @@
+# standard libraries
+from asyncio import Queue, create_task, get_running_loop, wait_for
+from asyncio import TimeoutError as AsyncTimeoutError
+from itertools import count
+import logging
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import os
+from threading import Thread
+import time
+
+# local modules
+from Metrics import get_metrics
+
+
+
+'''
+Lets the bot run as several processes ("clusters") that each run an AutoShardedBot for their own slice of the shards.
+Every process has its own GIL and event loop, so gateway traffic, command parsing, and opus encoding get spread across all of the host's cores.
+
+The Supervisor runs in the original process. It starts a process per cluster, restarts any that crash, and relays messages between them.
+Clusters don't share any files they write to. Each one keeps its own logs, metrics, and caches (see cluster_path()).
+Every cluster gets one end of a pipe to the supervisor, wrapped in a ClusterClient (see bot.cluster). Messages are small dicts:
+    cluster -> supervisor:
+        {'op': 'broadcast', 'command': 'reload'}    # runs an owner command on every cluster (including the one that sent it)
+        {'op': 'kill'}                              # shuts every cluster down for good
+        {'op': 'stats', 'request': int}             # asks every cluster for its stats
+        {'op': 'stats_reply', 'request': int, 'stats': dict}
+    supervisor -> cluster:
+        {'op': 'command', 'command': 'reload' or 'kill'}
+        {'op': 'stats', 'request': int}             # answered with a stats_reply
+        {'op': 'stats_result', 'request': int, 'stats': list[dict]}
+'''
+
+
+
+def cluster_path(bot, path: str) -> str:
+    '''
+    Clusters are separate processes, so if they all wrote to the same file they'd overwrite each other's data (and each other's temp files).
+
+    Args:
+        path (str): a file or directory (ending in '/') that the bot writes to
+
+    Returns:
+        path (str): the cluster's own version of path if the bot is running as multiple clusters. ex. 'youtube_cache.json' -> 'youtube_cache-cluster2.json'
+    '''
+    cluster = getattr(bot, 'cluster', None)
+    if cluster is None:
+        return path
+    directory = path.endswith('/')
+    root, extension = os.path.splitext(path.rstrip('/'))
+    return f'{root}-cluster{cluster.cluster_id}{extension}' + ('/' if directory else '')
+
+
+
+class Supervisor:
+    '''
+    Starts and babysits the cluster processes. This is blocking and is meant to be the only thing the main process does.
+
+    Attributes:
+        RESTART_DELAY (int): seconds to wait before restarting a crashed cluster. doubles every time it crashes again soon after starting
+        MAX_RESTART_DELAY (int)
+        STABLE_AFTER (int): seconds a cluster has to stay up for its restart delay to be reset
+        STATS_TIMEOUT (int): seconds to wait for every cluster to answer a stats request
+        target (callable): what each cluster process runs. called with (cluster_id, shard_ids, shard_count, connection, *args)
+        shard_count (int)
+        cluster_count (int)
+        clusters (dict): the running processes
+            {
+                cluster id (int): {
+                    'process': multiprocessing.Process,
+                    'connection': multiprocessing.connection.Connection,
+                    'started': float,
+                    'delay': int,           # how long to wait before restarting it next time
+                    'restart_at': float     # only set while it's waiting to be restarted
+                }
+            }
+        stats_requests (dict): stats requests that are still waiting on some clusters
+            {
+                request id (int): {'from': cluster id (int), 'request': int, 'stats': dict, 'deadline': float}
+            }
+        stopping (bool): set once a cluster asks to kill the bot so that clusters exiting aren't restarted
+    '''
+    RESTART_DELAY = 5
+    MAX_RESTART_DELAY = 5 * 60
+    STABLE_AFTER = 10 * 60
+    STATS_TIMEOUT = 5
+
+    def __init__(self, target, shard_count: int, cluster_count: int, args: tuple = ()):
+        self.target = target
+        self.shard_count = shard_count
+        self.cluster_count = min(cluster_count, shard_count)
+        self.args = args
+        self.clusters = dict()
+        self.stats_requests = dict()
+        self.request_ids = count()
+        self.stopping = False
+        self.logger = logging.getLogger('discord')
+
+
+
+    def shard_ids(self, cluster_id: int) -> list:
+        '''
+        Splits the shards into contiguous, nearly equal chunks
+
+        Returns:
+            shard_ids (list[int]): the shards that a cluster runs
+        '''
+        size, extra = divmod(self.shard_count, self.cluster_count)
+        start = cluster_id * size + min(cluster_id, extra)
+        return list(range(start, start + size + (cluster_id < extra)))
+
+
+
+    def start_cluster(self, cluster_id: int):
+        connection, child_connection = Pipe()
+        shard_ids = self.shard_ids(cluster_id)
+        process = Process(target=self.target, args=(cluster_id, shard_ids, self.shard_count, child_connection, *self.args), name=f'cluster-{cluster_id}')
+        process.start()
+        child_connection.close()    # only the child uses this end. closing it here means the pipe breaks if the child dies
+        previous = self.clusters.get(cluster_id, dict())
+        self.clusters[cluster_id] = {'process': process, 'connection': connection, 'started': time.monotonic(), 'delay': previous.get('delay', self.RESTART_DELAY), 'restart_at': None}
+        self.logger.info(f'[Cluster.start_cluster] started cluster {cluster_id} (pid {process.pid}) with shards {shard_ids[0]}-{shard_ids[-1]} of {self.shard_count}')
+
+
+
+    def send(self, cluster_id: int, message: dict):
+        cluster = self.clusters.get(cluster_id)
+        if not cluster or cluster['restart_at'] is not None:
+            return
+        try:
+            cluster['connection'].send(message)
+        except (BrokenPipeError, OSError):
+            pass    # it died. run() will notice and restart it
+
+
+
+    def run(self):
+        '''
+        Starts every cluster and then handles their messages and restarts until they've all been killed
+        '''
+        for cluster_id in range(self.cluster_count):
+            self.start_cluster(cluster_id)
+
+        try:
+            while self.clusters:
+                alive = {cluster['connection']: cluster_id for cluster_id, cluster in self.clusters.items() if cluster['restart_at'] is None}
+                sentinels = {self.clusters[cluster_id]['process'].sentinel: cluster_id for cluster_id in alive.values()}
+                for ready in wait(list(alive) + list(sentinels), timeout=1):
+                    if ready in alive:
+                        try:
+                            self.handle(alive[ready], ready.recv())
+                        except (EOFError, OSError):
+                            pass    # the process is exiting. its sentinel will be ready too
+                self.check_processes()
+                self.finish_stats_requests()
+        finally:
+            # only matters if the supervisor itself is stopped (ex. ctrl+c). don't leave orphaned clusters connected to discord
+            for cluster in self.clusters.values():
+                if cluster['process'].is_alive():
+                    cluster['process'].terminate()
+
+
+
+    def check_processes(self):
+        now = time.monotonic()
+        for cluster_id, cluster in list(self.clusters.items()):
+            if cluster['restart_at'] is not None:
+                if now >= cluster['restart_at']:
+                    self.start_cluster(cluster_id)
+                continue
+            process = cluster['process']
+            if process.is_alive():
+                continue
+            process.join()
+            cluster['connection'].close()
+            if self.stopping:
+                del self.clusters[cluster_id]
+                continue
+            if now - cluster['started'] > self.STABLE_AFTER:
+                cluster['delay'] = self.RESTART_DELAY
+            self.logger.info(f'[Cluster.check_processes] cluster {cluster_id} exited with code {process.exitcode}. restarting it in {cluster["delay"]}s')
+            cluster['restart_at'] = now + cluster['delay']
+            cluster['delay'] = min(cluster['delay'] * 2, self.MAX_RESTART_DELAY)
+
+
+
+    def handle(self, cluster_id: int, message: dict):
+        op = message.get('op')
+        if op == 'broadcast':
+            self.logger.info(f'[Cluster.handle] cluster {cluster_id} broadcast {message["command"]}')
+            for other in self.clusters:
+                self.send(other, {'op': 'command', 'command': message['command']})
+        elif op == 'kill':
+            self.logger.info(f'[Cluster.handle] cluster {cluster_id} asked to kill the bot')
+            self.stopping = True
+            for other in self.clusters:
+                self.send(other, {'op': 'command', 'command': 'kill'})
+            for other, cluster in list(self.clusters.items()):
+                if cluster['restart_at'] is not None:
+                    del self.clusters[other]
+        elif op == 'stats':
+            request_id = next(self.request_ids)
+            self.stats_requests[request_id] = {'from': cluster_id, 'request': message['request'], 'stats': dict(), 'deadline': time.monotonic() + self.STATS_TIMEOUT}
+            for other in self.clusters:
+                self.send(other, {'op': 'stats', 'request': request_id})
+        elif op == 'stats_reply':
+            request = self.stats_requests.get(message['request'])
+            if request:
+                request['stats'][cluster_id] = message['stats']
+
+
+
+    def finish_stats_requests(self):
+        '''
+        Answers stats requests once every running cluster has replied (or STATS_TIMEOUT has passed)
+        '''
+        now = time.monotonic()
+        running = {cluster_id for cluster_id, cluster in self.clusters.items() if cluster['restart_at'] is None}
+        for request_id, request in list(self.stats_requests.items()):
+            if running <= request['stats'].keys() or now > request['deadline']:
+                del self.stats_requests[request_id]
+                stats = [request['stats'].get(cluster_id, {'cluster': cluster_id, 'down': True}) for cluster_id in sorted(self.clusters)]
+                self.send(request['from'], {'op': 'stats_result', 'request': request['request'], 'stats': stats})
+
+
+
+class ClusterClient:
+    '''
+    A cluster's side of the pipe to the Supervisor. Saved as bot.cluster so commands can reach the other clusters.
+
+    Attributes:
+        cluster_id (int)
+        shard_ids (list[int])
+        connection (multiprocessing.connection.Connection)
+        inbox (asyncio.Queue): messages from the supervisor. connection.recv() blocks, so a daemon thread receives them and hands them to the event loop
+        requests (dict): stats requests that are waiting for the supervisor
+            {
+                request id (int): asyncio.Future
+            }
+        listener (asyncio.Task): self.listen()
+    '''
+    def __init__(self, bot, cluster_id: int, shard_ids: list, connection):
+        self.bot = bot
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.connection = connection
+        self.inbox = Queue()
+        self.requests = dict()
+        self.request_ids = count()
+        self.listener = None
+        self.logger = logging.getLogger('discord')
+
+
+
+    def start(self):
+        '''
+        Starts listening to the supervisor. Safe to call more than once
+        '''
+        if self.listener:
+            return
+        loop = get_running_loop()
+        # a daemon thread (instead of an executor) so that a recv() that's still blocking never stops the process from exiting
+        Thread(target=self.receive, args=(loop,), name='cluster-ipc', daemon=True).start()
+        self.listener = create_task(self.listen())
+
+
+
+    def receive(self, loop):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                message = None
+            loop.call_soon_threadsafe(self.inbox.put_nowait, message)
+            if message is None:
+                return
+
+
+
+    async def listen(self):
+        while True:
+            message = await self.inbox.get()
+            if message is None:
+                # the supervisor is gone, so nothing would restart this cluster or relay owner commands to it anymore
+                self.logger.info('[Cluster.listen] lost connection to the supervisor. shutting down')
+                await self.run_command('kill')
+                return
+            op = message.get('op')
+            if op == 'command':
+                create_task(self.run_command(message['command']))
+            elif op == 'stats':
+                self.connection.send({'op': 'stats_reply', 'request': message['request'], 'stats': self.local_stats()})
+            elif op == 'stats_result':
+                future = self.requests.pop(message['request'], None)
+                if future and not future.done():
+                    future.set_result(message['stats'])
+
+
+
+    async def run_command(self, command: str):
+        '''
+        Runs an owner command that was broadcast by a cluster (possibly this one)
+        '''
+        self.logger.info(f'[Cluster.run_command] cluster {self.cluster_id} running {command}')
+        general = self.bot.get_cog('GeneralCommands')
+        if command == 'reload' and general:
+            await general.reload_extensions()
+        elif command == 'kill':
+            if general:
+                await general.shutdown()
+            else:
+                await self.bot.close()
+
+
+
+    def broadcast(self, command: str):
+        self.connection.send({'op': 'broadcast', 'command': command})
+
+
+
+    def kill(self):
+        self.connection.send({'op': 'kill'})
+
+
+
+    def local_stats(self) -> dict:
+        '''
+        Returns:
+            stats (dict): a short summary of this cluster that can be sent through the pipe
+        '''
+        metrics = get_metrics(self.bot)
+        return {
+            'cluster': self.cluster_id,
+            'shards': f'{self.shard_ids[0]}-{self.shard_ids[-1]}',
+            'guilds': len(self.bot.guilds),
+            'latency_ms': round(self.bot.latency * 1000) if self.bot.latency == self.bot.latency else None,   # latency is nan before the first heartbeat
+            'loop_lag_p99_ms': round(metrics.loop_lag.quantile(0.99) * 1000),
+            'commands': sum(histogram.count for histogram in metrics.commands.values()),
+            'gauges': metrics.gauge_values()
+        }
+
+
+
+    async def stats(self, timeout: float = Supervisor.STATS_TIMEOUT + 2) -> list:
+        '''
+        Returns:
+            stats (list[dict]): self.local_stats() of every cluster. clusters that didn't answer are {'cluster': int, 'down': True}
+        '''
+        request_id = next(self.request_ids)
+        future = self.requests[request_id] = get_running_loop().create_future()
+        self.connection.send({'op': 'stats', 'request': request_id})
+        try:
+            return await wait_for(future, timeout)
+        except AsyncTimeoutError:
+            self.requests.pop(request_id, None)
+            return [self.local_stats()]
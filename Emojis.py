@@ -0,0 +1,82 @@
+# dependencies
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    from fuzzywuzzy import fuzz, process
+
+
+
+'''
+Case insensitive lookup of every guild's custom emojis.
+Each guild's index is built the first time it's used and rebuilt whenever its emojis change (see EventHandler.on_guild_emojis_update()).
+The index is a module level singleton (see emoji_index) instead of living in a cog so that hot reloading doesn't throw it away.
+'''
+
+
+
+class EmojiIndex:
+    '''
+    Attributes:
+        SUGGESTIONS (int): max amount of similar names suggested when an emoji isn't found
+        SUGGESTION_CUTOFF (int): min similarity (out of 100) for a name to be suggested
+        guilds (dict): the indexes
+            {
+                discord.Guild.id (int): (
+                    tuple(discord.Emoji),   # the guild.emojis that the index was built from. used to tell when the index is outdated
+                    dict({lowercase name (str): discord.Emoji})
+                )
+            }
+    '''
+    SUGGESTIONS = 3
+    SUGGESTION_CUTOFF = 60
+
+    def __init__(self):
+        self.guilds = dict()
+
+
+
+    def build(self, guild_id: int, emojis: tuple) -> dict:
+        index = {emoji.name.lower(): emoji for emoji in emojis}
+        self.guilds[guild_id] = (emojis, index)
+        return index
+
+
+
+    def index(self, guild) -> dict:
+        '''
+        Returns:
+            index (dict): {lowercase name (str): discord.Emoji} of a guild. built or rebuilt if it's missing or outdated
+        '''
+        indexed = self.guilds.get(guild.id)
+        if indexed and indexed[0] is guild.emojis:
+            return indexed[1]
+        # discord.py replaces guild.emojis instead of changing it, so this also catches changes that happened while the bot was disconnected
+        return self.build(guild.id, guild.emojis)
+
+
+
+    def get(self, guild, name: str):
+        '''
+        Returns:
+            emoji (discord.Emoji or None)
+        '''
+        return self.index(guild).get(name.lower())
+
+
+
+    def suggest(self, guild, name: str) -> list:
+        '''
+        Returns:
+            names (list[str]): the emoji names most similar to name, best first
+        '''
+        matches = process.extract(name.lower(), list(self.index(guild)), scorer=fuzz.ratio, limit=self.SUGGESTIONS)
+        return [match[0] for match in matches if match[1] >= self.SUGGESTION_CUTOFF]  # rapidfuzz also returns the index as match[2] but fuzzywuzzy doesn't
+
+
+
+    def remove(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+
+
+
+emoji_index = EmojiIndex()
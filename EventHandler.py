@@ -1,41 +1,112 @@
 # standard libraries
+import json
 import logging
+from random import random
 import traceback
 
 # dependencies
 from discord.ext.commands import errors
 
 # local modules
+from Emojis import emoji_index
 from Exceptions import GayBotException
+from MessageCache import last_messages
+from Metrics import get_metrics
+from Outbound import scheduler
 
 
 
 '''
 Handles all the event listeners.
 This is mainly used for good/smart error handling
+
+Message logging can be turned down per server or per channel by putting sampling rates (0 to 1) in LOG_RATES_FILE:
+    {
+        "default": 1.0,
+        "guilds": {"<guild id>": 0.1},
+        "channels": {"<channel id>": 0}
+    }
+Channel rates take priority over server rates. Changes are picked up with 'gay reload'.
 '''
 
 
 
+LOG_RATES_FILE = 'log_rates.json'
+log_rates = {'default': 1.0, 'guilds': dict(), 'channels': dict()}
+
+
+
 async def setup(bot):
     '''
     Used by discord.commands.Bot.load_extension() to load this cog onto the bot.
     This is required to allow hot reloading with GeneralCommands.reload()
     '''
+    load_log_rates()
+    get_metrics(bot).start()
+    get_metrics(bot).gauges.update(scheduler.gauges())
     bot.add_listener(on_message)
+    bot.add_listener(on_raw_message_delete)
+    bot.add_listener(on_guild_emojis_update)
+    bot.add_listener(on_guild_remove)
     bot.add_listener(on_command_error)
     bot.add_listener(on_command_completion)
 
 
 
+def load_log_rates():
+    '''
+    Loads the message logging sampling rates from LOG_RATES_FILE. Missing file means everything gets logged.
+    '''
+    try:
+        with open(LOG_RATES_FILE, 'r') as file:
+            data = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    log_rates['default'] = float(data.get('default', 1.0))
+    log_rates['guilds'] = {int(guild_id): float(rate) for guild_id, rate in data.get('guilds', dict()).items()}
+    log_rates['channels'] = {int(channel_id): float(rate) for channel_id, rate in data.get('channels', dict()).items()}
+
+
+
+def should_log(message) -> bool:
+    '''
+    Decides whether a message gets logged based on the sampling rate of its channel, then its server, then the default
+    '''
+    rate = log_rates['channels'].get(message.channel.id)
+    if rate is None and message.guild:
+        rate = log_rates['guilds'].get(message.guild.id)
+    if rate is None:
+        rate = log_rates['default']
+    return rate >= 1 or random() < rate
+
+
+
 async def on_message(message):
+    last_messages.add(message)
     logger = logging.getLogger('discord')
-    logger.info(f'{message.author.display_name}: {message.content}')
+    if logger.isEnabledFor(logging.INFO) and should_log(message):   # check first so skipped messages don't even get formatted
+        logger.info(f'{message.author.display_name}: {message.content}')
+
+
+
+async def on_raw_message_delete(payload):
+    last_messages.forget(payload.channel_id, payload.message_id)
+
+
+
+async def on_guild_emojis_update(guild, before, after):
+    emoji_index.build(guild.id, after)
+
+
+
+async def on_guild_remove(guild):
+    emoji_index.remove(guild.id)
 
 
 
 async def on_command_error(ctx, error: Exception):
-    await ctx.message.add_reaction('❌')
+    get_metrics(ctx.bot).command_finished(ctx, failed=True)
+    scheduler.react(ctx.message, '❌')
     if isinstance(error, errors.CommandNotFound):
         await ctx.send("That is not a recognized command. Use `gay help` for a list of commands.")
         return
@@ -56,6 +127,7 @@ async def on_command_error(ctx, error: Exception):
 
 
 async def on_command_completion(ctx):
+    get_metrics(ctx.bot).command_finished(ctx)
     logger = logging.getLogger('discord')
     logger.info(f'[{ctx.command.module}.{ctx.command.name}] completed')
-    await ctx.message.add_reaction('☑️')
\ No newline at end of file
+    scheduler.react(ctx.message, '☑️')
\ No newline at end of file
@@ -1,6 +1,9 @@
 # dependencies
 from discord.ext import commands
 
+# local modules
+from Emojis import emoji_index
+
 
 
 ####################################################################################################################################
@@ -9,16 +12,17 @@ from discord.ext import commands
 
 def emoji_exists():
     def predicate(ctx):
-        emoji = ctx.message.content.split(' ')[-1].lower()
-        if emoji not in [ele.name.lower() for ele in ctx.guild.emojis]:
-            raise EmojiNotFound
+        name = ctx.message.content.split(' ')[-1]
+        ctx.emoji = emoji_index.get(ctx.guild, name)   # saved so the command doesn't have to look it up again
+        if not ctx.emoji:
+            raise EmojiNotFound(emoji_index.suggest(ctx.guild, name))
         return True
     return commands.check(predicate)
 
 def is_bot_in_VC():
     def predicate(ctx):
-        voice = ctx.bot.get_cog('VoiceCommands').get_instances()
-        if not voice[ctx.guild.id]['voice'] or not voice[ctx.guild.id]['voice'].is_connected():
+        instance = ctx.bot.get_cog('VoiceCommands').get_instances().get(ctx.guild.id)
+        if not instance or not instance.is_connected():
             raise BotNotInVoiceChannel
         return True
     return commands.check(predicate)
@@ -32,8 +36,8 @@ def is_user_in_VC():
 
 def is_user_in_same_VC():
     def predicate(ctx):
-        voice = ctx.bot.get_cog('VoiceCommands').get_instances()
-        if ctx.author.voice.channel != voice[ctx.guild.id]['voice'].channel:
+        instance = ctx.bot.get_cog('VoiceCommands').get_instances().get(ctx.guild.id)
+        if not instance or not instance.voice or ctx.author.voice.channel != instance.voice.channel:
             raise UserNotInSameVoiceChannel
         return True
     return commands.check(predicate)
@@ -50,8 +54,11 @@ class GayBotException(commands.errors.CommandError):
         self.message = f':no_entry_sign: {message}'
 
 class EmojiNotFound(GayBotException):
-    def __init__(self):
-        super().__init__('Could not find that emoji in this server. Try checking your spelling and don\'t include the colons.')
+    def __init__(self, suggestions: list = ()):
+        if suggestions:
+            super().__init__(f'Could not find that emoji in this server. Did you mean {", ".join(f"`{name}`" for name in suggestions)}?')
+        else:
+            super().__init__('Could not find that emoji in this server. Try checking your spelling and don\'t include the colons.')
 
 class UserNotInVoiceChannel(GayBotException):
     def __init__(self):
@@ -71,4 +78,20 @@ class NotInQueue(GayBotException):
 
 class BotNotInVoiceChannel(GayBotException):
     def __init__(self):
-        super().__init__('You can\'t do that. The bot isn\'t even playing anything.')
\ No newline at end of file
+        super().__init__('You can\'t do that. The bot isn\'t even playing anything.')
+
+class SearchTimedOut(GayBotException):
+    def __init__(self):
+        super().__init__('YouTube took too long to respond. Try again in a bit.')
+
+class SearchCancelled(GayBotException):
+    def __init__(self):
+        super().__init__('You left the voice channel so I stopped looking for that video.')
+
+class SoundboardClipNotFound(GayBotException):
+    def __init__(self):
+        super().__init__('Could not find a soundboard clip like that.')
+
+class PlaylistEmpty(GayBotException):
+    def __init__(self):
+        super().__init__('That playlist doesn\'t have any videos that I can play.')
\ No newline at end of file
@@ -0,0 +1,307 @@
+# standard libraries
+from asyncio import CancelledError, create_task, get_running_loop, sleep
+from collections import OrderedDict, deque
+import logging
+import os
+import shutil
+import time
+
+# dependencies
+from discord import AudioSource
+try:
+    # only used to report how much cpu each ffmpeg process used. everything else works without it
+    import psutil
+except ImportError:
+    psutil = None
+
+
+
+'''
+Finds ffmpeg and keeps every ffmpeg process that plays audio on a budget.
+Without a limit, a spike in voice usage spawns a transcoder per guild until the host runs out of cpu and every stream starts stuttering.
+With one, guilds past the limit wait their turn (in round robin order so one guild can't hog every slot) while the rest keep playing smoothly.
+
+The manager is a module level singleton (see manager) instead of living in a cog so that hot reloading doesn't lose track of running processes.
+'''
+
+
+
+def find_executable(name: str) -> str:
+    '''
+    Looks for ffmpeg (or ffprobe) in this order:
+        1. the FFMPEG (or FFPROBE) environment variable
+        2. PATH
+        3. C:\\ffmpeg\\bin, where it used to be hard coded to
+        4. just the name and hope for the best
+
+    Args:
+        name (str): 'ffmpeg' or 'ffprobe'
+
+    Returns:
+        executable (str)
+    '''
+    configured = os.environ.get(name.upper())
+    if configured:
+        return configured
+    found = shutil.which(name)
+    if found:
+        return found
+    windows = os.path.join('C:\\', 'ffmpeg', 'bin', f'{name}.exe')
+    if os.path.isfile(windows):
+        return windows
+    return name
+
+
+
+FFMPEG = find_executable('ffmpeg')
+FFPROBE = find_executable('ffprobe')
+
+
+
+def find_process(source: AudioSource):
+    '''
+    Returns:
+        process (subprocess.Popen or None): the ffmpeg process behind a discord.FFmpegAudio, even if it's wrapped in a discord.PCMVolumeTransformer
+    '''
+    while source is not None:
+        process = getattr(source, '_process', None)
+        if process:
+            return process
+        source = getattr(source, 'original', None)
+    return None
+
+
+
+class ManagedAudio(AudioSource):
+    '''
+    Wraps an ffmpeg backed AudioSource so the manager knows when it's being read from and when it's done.
+    read() and cleanup() are called from discord.py's audio thread.
+
+    Attributes:
+        guild_id (int)
+        source (discord.AudioSource): the wrapped source
+        process (subprocess.Popen)
+        pid (int)
+        started (float): time.monotonic() of when the process was spawned
+        last_read (float): time.monotonic() of the last time a frame was read
+        done (bool): whether cleanup() was called
+    '''
+    def __init__(self, manager, guild_id: int, source: AudioSource):
+        self.manager = manager
+        self.guild_id = guild_id
+        self.source = source
+        self.process = find_process(source)
+        self.pid = self.process.pid if self.process else None
+        self.started = time.monotonic()
+        self.last_read = self.started
+        self.done = False
+        self.loop = get_running_loop()
+
+
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        self.last_read = time.monotonic()
+        return data
+
+
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+
+
+    def cleanup(self):
+        if self.done:
+            return
+        self.done = True
+        cpu = self.manager.cpu_time(self)  # has to be read before the process is killed
+        self.source.cleanup()
+        exit_code = self.process.poll() if self.process else None
+        if not self.loop.is_closed():   # can happen if this gets garbage collected after the bot shut down
+            self.loop.call_soon_threadsafe(self.manager.release, self, cpu, exit_code)
+
+
+
+class FFmpegManager:
+    '''
+    Attributes:
+        MAX_PROCESSES (int): how many ffmpeg processes can play at the same time across every guild
+        HUNG_TIMEOUT (int): seconds a process can go without being read from before it's considered hung or orphaned and killed
+        CHECK_INTERVAL (int): seconds between checks for hung processes
+        HISTORY (int): how many finished processes are remembered for stats
+        used (int): slots that are taken, including ones that were just granted and haven't spawned their process yet
+        waiting (OrderedDict): guilds waiting for a slot, in the order they get served. a guild goes to the back after being served
+            {
+                discord.Guild.id (int): deque[asyncio.Future]
+            }
+        processes (set(ManagedAudio)): the running processes
+        history (deque[dict]): the last HISTORY processes that finished
+            {
+                'guild_id': int,
+                'pid': int,
+                'runtime': float,   # seconds
+                'cpu': float,       # seconds. None if psutil isn't installed
+                'exit_code': int,   # None if it was still running when it was killed
+                'killed': bool      # whether it was killed for being hung
+            }
+        spawned (int): total processes spawned
+        killed (int): total processes killed for being hung
+        monitor (asyncio.Task): self.run_monitor()
+    '''
+    MAX_PROCESSES = max(4, (os.cpu_count() or 1) * 4)
+    HUNG_TIMEOUT = 20
+    CHECK_INTERVAL = 5
+    HISTORY = 200
+
+    def __init__(self, max_processes: int = MAX_PROCESSES):
+        self.max_processes = max_processes
+        self.used = 0
+        self.waiting = OrderedDict()
+        self.processes = set()
+        self.history = deque(maxlen=self.HISTORY)
+        self.spawned = 0
+        self.killed = 0
+        self.monitor = None
+        self.logger = logging.getLogger('discord')
+
+
+
+    def is_full(self) -> bool:
+        return self.used >= self.max_processes
+
+
+
+    async def acquire(self, guild_id: int):
+        '''
+        Waits for a free slot. Guilds that are waiting are served round robin.
+        '''
+        if not self.is_full() and not self.waiting:
+            self.used += 1
+            return
+        future = get_running_loop().create_future()
+        self.waiting.setdefault(guild_id, deque()).append(future)
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                self.release_slot()    # the slot was granted right as this was cancelled, so hand it to someone else
+            elif future in self.waiting.get(guild_id, ()):
+                self.waiting[guild_id].remove(future)
+                if not self.waiting[guild_id]:
+                    del self.waiting[guild_id]
+            raise
+
+
+
+    def release_slot(self):
+        self.used -= 1
+        while self.waiting and not self.is_full():
+            guild_id, futures = self.waiting.popitem(last=False)
+            future = futures.popleft()
+            if futures:
+                self.waiting[guild_id] = futures    # back of the line
+            if not future.done():
+                self.used += 1
+                future.set_result(None)
+
+
+
+    async def open(self, guild_id: int, factory) -> ManagedAudio:
+        '''
+        Spawns an ffmpeg process once there's room for it
+
+        Args:
+            guild_id (int)
+            factory (callable() -> discord.AudioSource): creates the ffmpeg source. ex. lambda: discord.FFmpegPCMAudio(...)
+
+        Returns:
+            audio (ManagedAudio)
+        '''
+        self.start()
+        await self.acquire(guild_id)
+        try:
+            audio = ManagedAudio(self, guild_id, factory())
+        except Exception:
+            self.release_slot()
+            raise
+        self.processes.add(audio)
+        self.spawned += 1
+        return audio
+
+
+
+    def release(self, audio: ManagedAudio, cpu: float, exit_code: int, killed: bool = False):
+        if audio not in self.processes:
+            return
+        self.processes.discard(audio)
+        self.history.append({
+            'guild_id': audio.guild_id,
+            'pid': audio.pid,
+            'runtime': round(time.monotonic() - audio.started, 1),
+            'cpu': cpu,
+            'exit_code': exit_code,
+            'killed': killed
+        })
+        self.release_slot()
+
+
+
+    @staticmethod
+    def cpu_time(audio: ManagedAudio) -> float:
+        '''
+        Returns:
+            cpu (float or None): seconds of cpu the process has used so far. None if psutil isn't installed or the process is gone
+        '''
+        if not psutil or not audio.pid:
+            return None
+        try:
+            times = psutil.Process(audio.pid).cpu_times()
+            return round(times.user + times.system, 2)
+        except psutil.Error:
+            return None
+
+
+
+    def start(self):
+        if not self.monitor or self.monitor.done():
+            self.monitor = create_task(self.run_monitor())
+
+
+
+    async def run_monitor(self):
+        '''
+        Kills processes that nothing has read from in HUNG_TIMEOUT seconds.
+        That covers ffmpeg getting stuck on a dead stream and sources that were never cleaned up because whatever was playing them went away.
+        Killing the process ends the stream, so discord.py moves on to the next clip like normal.
+        '''
+        while True:
+            await sleep(self.CHECK_INTERVAL)
+            now = time.monotonic()
+            for audio in list(self.processes):
+                if audio.done or now - audio.last_read < self.HUNG_TIMEOUT:
+                    continue
+                self.logger.info(f'[FFmpeg.run_monitor] killing ffmpeg (pid {audio.pid}) for guild {audio.guild_id}. nothing has read from it in {now - audio.last_read:.0f}s')
+                self.killed += 1
+                cpu = self.cpu_time(audio)
+                if audio.process and audio.process.poll() is None:
+                    audio.process.kill()
+                self.release(audio, cpu, None, killed=True)    # if the audio thread calls cleanup() later on, release() ignores it
+
+
+
+    def stats(self) -> dict:
+        finished = list(self.history)
+        return {
+            'running': len(self.processes),
+            'waiting': sum(len(futures) for futures in self.waiting.values()),
+            'limit': self.max_processes,
+            'spawned': self.spawned,
+            'killed': self.killed,
+            'failed': sum(1 for process in finished if process['exit_code'] not in (0, None, -9, -15)),  # killed by discord.py when skipping or finishing doesn't count
+            'cpu': sum(self.cpu_time(audio) or 0 for audio in self.processes) if psutil else None
+        }
+
+
+
+manager = FFmpegManager()
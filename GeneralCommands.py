@@ -1,7 +1,7 @@
 # standard libraries
-import json
 import logging
-from random import randint
+from random import getrandbits
+import time
 
 # dependencies
 from discord import Color, Embed
@@ -9,6 +9,10 @@ from discord.ext import commands
 
 # local modules
 from Exceptions import *
+from FFmpeg import manager as ffmpeg_manager
+from MessageCache import last_messages
+from Metrics import get_metrics
+from StarStore import StarStore
 
 
 
@@ -24,15 +28,35 @@ async def setup(bot):
 class GeneralCommands(commands.Cog):
     '''
     Holds all the general use commands.
+
+    Attributes:
+        LEADERBOARD_PAGE_SIZE (int): how many users are shown per page of the star leaderboard
+        NAME_TTL (int): how many seconds a looked up display name is remembered for
+        stars (StarStore.StarStore): where gold stars are saved
+        display_names (dict): display names of users that weren't in the member cache
+            {
+                (discord.Guild.id, discord.Member.id): (display_name (str), expires (float))
+            }
     '''
-    STAR_FILE = 'gold_stars.json'
+    LEADERBOARD_PAGE_SIZE = 10
+    NAME_TTL = 600
 
     def __init__(self, bot):
         self.bot = bot
+        self.stars = StarStore()
+        self.display_names = dict()
         self.logger = logging.getLogger('discord')
 
 
 
+    async def cog_unload(self):
+        '''
+        Called by discord.py when this cog is removed (including when it's reloaded).
+        '''
+        await self.stars.close()
+
+
+
     @commands.command()
     async def bruh(self, ctx):
         '''
@@ -53,79 +77,154 @@ class GeneralCommands(commands.Cog):
         args:
             emoji_names (str)
         '''
-        emoji_name = emoji_name.lower()
-        server_emojis = {emoji.name.lower(): emoji.url for emoji in ctx.guild.emojis}
+        emoji = ctx.emoji   # looked up by Exceptions.emoji_exists()
         pretty_data = Embed()
         pretty_data.color = Color.green()
-        pretty_data.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar_url)
-        pretty_data.set_image(url=server_emojis[emoji_name])
+        pretty_data.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+        pretty_data.set_image(url=emoji.url)
         await ctx.send(embed=pretty_data)
         await ctx.message.delete()
 
 
 
+    @staticmethod
+    def mock_text(text: str) -> str:
+        '''
+        Randomizes the capitalization of every character. One call to getrandbits() decides every character at once instead of rolling per character.
+        '''
+        bits = f'{getrandbits(len(text)):0{len(text)}b}' if text else ''
+        upper, lower = text.upper(), text.lower()
+        if len(upper) != len(text) or len(lower) != len(text):
+            # some characters change length when their case changes (ex. ß -> SS), so the cases can't be lined up as whole strings
+            upper, lower = [char.upper() for char in text], [char.lower() for char in text]
+        return ''.join([up if bit == '1' else low for up, low, bit in zip(upper, lower, bits)])
+
+
+
     @commands.command()
     async def mock(self, ctx, user):
         '''
-        Mocks a user by randomizing the capitilzation in that user's last message
+        Mocks a user by randomizing the capitilzation in that user's last message in this channel
 
         Args:
             user (str)
         '''
         user = ctx.message.mentions[0]
+        content = last_messages.get(ctx.channel.id, user.id)
+        if content is None:
+            await ctx.send(f"I haven't seen {user.display_name} say anything here recently.")
+            return
+        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] modifying message: {content}')
 
         # pretty output using embed
         pretty_data = Embed()
         pretty_data.color = Color.green()
-        pretty_data.set_author(name=user.display_name, icon_url=user.avatar_url)
+        pretty_data.set_author(name=user.display_name, icon_url=user.display_avatar.url)
         pretty_data.set_image(url='https://i.imgur.com/xQu6gKd.jpg')
-        async for message in ctx.channel.history(limit=50):
-            if message.author == user:
-                self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] modifying message: {message.content}')
-                mocked = ''
-                for char in message.content:
-                    if randint(0, 1) == 1:
-                        mocked += char.upper()
-                    else:
-                        mocked += char.lower()
-                pretty_data.title = mocked
-                break
+        pretty_data.title = self.mock_text(content)
         await ctx.send(embed=pretty_data)
 
 
 
+    def star_members(self, ctx) -> set:
+        '''
+        The first time a guild uses stars, StarStore needs to know who's in the guild to migrate their old stars.
+        After that, skip building the set entirely.
+
+        Returns:
+            member_ids (set(int) or None)
+        '''
+        if self.stars.has_table(ctx.guild.id):
+            return None
+        return {member.id for member in ctx.guild.members}
+
+
+
     @commands.group(name='star', aliases=['goldstar'], case_insensitive=True, invoke_without_command=True)
-    async def star(self, ctx):
+    async def star(self, ctx, page=1):
         '''
         Command group for star command so that commands look like
         gay star leaderboard
         gay star give @user 2
         Defaults to showing the leaderboard
         '''
-        await self.star_list(self, ctx)
+        await self.star_list(ctx, page)
+
+
+
+    async def get_display_names(self, guild, user_ids: list) -> dict:
+        '''
+        Gets the display names of a bunch of users without making a request per user.
+            1. members already in the member cache (filled by the members intent) cost nothing
+            2. recently looked up names are remembered for NAME_TTL seconds
+            3. everyone else is requested all at once over the gateway
+
+        Args:
+            guild (discord.Guild)
+            user_ids (list[int])
+
+        Returns:
+            display_names (dict): {user_id (int): display_name (str)}
+        '''
+        now = time.monotonic()
+        display_names = dict()
+        missing = list()
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            cached = self.display_names.get((guild.id, user_id))
+            if member:
+                display_names[user_id] = member.display_name
+            elif cached and cached[1] > now:
+                display_names[user_id] = cached[0]
+            else:
+                missing.append(user_id)
+
+        if missing:
+            members = await guild.query_members(user_ids=missing, limit=len(missing), cache=True)
+            for member in members:
+                display_names[member.id] = member.display_name
+            for user_id in missing:
+                # users that left the guild are remembered too so they don't get requested again every time
+                display_names.setdefault(user_id, f'Unknown User ({user_id})')
+                self.display_names[(guild.id, user_id)] = (display_names[user_id], now + self.NAME_TTL)
+
+        # forget names that expired so this doesn't grow forever
+        if len(self.display_names) > 10000:
+            self.display_names = {key: value for key, value in self.display_names.items() if value[1] > now}
+        return display_names
 
 
 
     @star.command(name='leaderboard', aliases=['list', 'show'])
-    async def star_list(self, ctx):
+    async def star_list(self, ctx, page=1):
         '''
-        Shows the leaderboard/full list of users with gold stars ordered by gold star count
+        Shows the leaderboard of users with gold stars ordered by gold star count, one page at a time
+
+        Args:
+            page (int, optional): defaults to the first page
 
         Note:
             Is part of a group so is invoked similarly to 'star leaderboard'
         '''
-        with open(self.STAR_FILE, 'r') as file:
-            star_data = json.load(file)
+        try:
+            page = max(1, int(page))
+        except ValueError:
+            raise NotInteger
+        members = self.star_members(ctx)
+        offset = (page-1) * self.LEADERBOARD_PAGE_SIZE
+        records = await self.stars.leaderboard(ctx.guild.id, self.LEADERBOARD_PAGE_SIZE, offset, members)  # already sorted by star count
+        total = await self.stars.count(ctx.guild.id, members)
+        names = await self.get_display_names(ctx.guild, [user_id for user_id, _ in records])
 
         output = ''
-        for record in sorted(star_data.items(), key=lambda data: data[1], reverse=True):    # sort by star count
-            username = await ctx.guild.fetch_member(int(record[0]))
-            output += f'{username}: {record[1]} ⭐\n' # prettify
+        for rank, (user_id, stars) in enumerate(records, start=offset+1):
+            output += f'`#{rank}` {names[user_id]}: {stars} ⭐\n' # prettify
 
         pretty_data = Embed()
         pretty_data.color = Color.green()
         pretty_data.set_author(name='⭐ Star Leaderboard ⭐')
-        pretty_data.description = output
+        pretty_data.description = output or 'There\'s nobody on this page.'
+        pretty_data.set_footer(text=f'Page {page}/{max(1, -(-total // self.LEADERBOARD_PAGE_SIZE))} | To see another page, use "gay star leaderboard <page>"')
         await ctx.send(embed=pretty_data)
 
 
@@ -141,18 +240,13 @@ class GeneralCommands(commands.Cog):
         Note:
             Is part of a group so is invoked similarly to 'star check @user'
         '''
-        with open(self.STAR_FILE, 'r') as file:
-            star_data = json.load(file)
-
         user = await ctx.guild.fetch_member(user[3:-1]) if user else ctx.author # if user arg not given, use author
-        user_id_str = str(user.id)      # this is necessary becuase json format cannot have ints has keys and converts them to strings when using json.dump()
-        if user_id_str not in star_data:
-            star_data[user_id_str] = 0
+        stars = await self.stars.get(ctx.guild.id, user.id, self.star_members(ctx))
 
         pretty_data = Embed()
         pretty_data.color = Color.green()
-        pretty_data.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar_url)
-        pretty_data.description = f'⭐ {star_data[user_id_str]} Gold Stars ⭐'
+        pretty_data.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+        pretty_data.description = f'⭐ {stars} Gold Stars ⭐'
         await ctx.send(embed=pretty_data)
 
 
@@ -170,22 +264,13 @@ class GeneralCommands(commands.Cog):
         Note:
             Is part of a group so is invoked similarly to 'star give @user <amount>'
         '''
-        with open(self.STAR_FILE, 'r') as file:
-            star_data = json.load(file)
-
         user = await ctx.guild.fetch_member(user[3:-1])
-        user_id_str = str(user.id)      # this is necessary becuase json format cannot have ints has keys and converts them to strings when using json.dump()
-        if user_id_str not in star_data:
-            star_data[user_id_str] = 0
-        star_data[user_id_str] += int(amount)
-
-        with open(self.STAR_FILE, 'w') as file:
-            json.dump(star_data, file)
+        stars = await self.stars.add(ctx.guild.id, user.id, int(amount), self.star_members(ctx))
 
         pretty_data = Embed()
         pretty_data.color = Color.green()
-        pretty_data.set_author(name=user.display_name, icon_url=ctx.user.avatar_url)
-        pretty_data.description = f'⭐ Now has {star_data[user_id_str]} Gold Stars ⭐'
+        pretty_data.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+        pretty_data.description = f'⭐ Now has {stars} Gold Stars ⭐'
         await ctx.send(embed=pretty_data)
 
 
@@ -210,18 +295,94 @@ class GeneralCommands(commands.Cog):
 
     @commands.is_owner()
     @commands.command()
-    async def reload(self, ctx):
+    async def stats(self, ctx):
         '''
-        Hot reloads all the command cogs so the bot doesn't need to be shut down to enact changes
+        Shows how long commands are taking, how laggy the event loop is, and how busy voice is.
+        Everything shown here is also written to Metrics.METRICS_FILE in prometheus' format.
 
         Note:
             Can only be used by me.
         '''
-        instances = self.bot.get_cog('VoiceCommands').get_instances()
+        metrics = get_metrics(self.bot)
+        ms = lambda seconds: f'{seconds*1000:.0f}ms'
+
+        pretty_data = Embed()
+        pretty_data.color = Color.green()
+        pretty_data.set_author(name='Stats')
+        lag = metrics.loop_lag
+        pretty_data.description = f'Event loop lag: p50 {ms(lag.quantile(0.5))} | p99 {ms(lag.quantile(0.99))} | max {ms(lag.max)}'
+
+        slowest = sorted(metrics.commands.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:10]
+        commands_text = '\n'.join(
+            f'`{name}` x{histogram.count}: p50 {ms(histogram.quantile(0.5))} | p99 {ms(histogram.quantile(0.99))} | checks {ms(metrics.checks[name].quantile(0.99)) if name in metrics.checks else "-"} | errors {metrics.errors.get(name, 0)}'
+            for name, histogram in slowest
+        )
+        pretty_data.add_field(name='Slowest Commands', value=commands_text or 'Nothing yet.', inline=False)
+
+        busiest = sorted(metrics.guilds.items(), key=lambda item: item[1][1], reverse=True)[:5]
+        guilds_text = '\n'.join(
+            f'{self.bot.get_guild(guild_id).name if self.bot.get_guild(guild_id) else guild_id}: {count} commands, {seconds:.1f}s total'
+            for guild_id, (count, seconds) in busiest
+        )
+        pretty_data.add_field(name='Busiest Servers', value=guilds_text or 'Nothing yet.', inline=False)
+        pretty_data.add_field(name='Gauges', value='\n'.join(f'{name}: {value}' for name, value in metrics.gauge_values().items()) or 'None.', inline=False)
+        ffmpeg = ffmpeg_manager.stats()
+        pretty_data.add_field(name='FFmpeg', value=(
+            f'{ffmpeg["running"]}/{ffmpeg["limit"]} running | {ffmpeg["waiting"]} waiting | {ffmpeg["spawned"]} spawned | {ffmpeg["killed"]} killed for hanging | {ffmpeg["failed"]} failed'
+            + (f' | {ffmpeg["cpu"]:.0f}s cpu' if ffmpeg['cpu'] is not None else '')
+        ), inline=False)
+        if hasattr(self.bot, 'cluster'):
+            clusters = await self.bot.cluster.stats()
+            clusters_text = '\n'.join(
+                f'`#{cluster["cluster"]}` down' if cluster.get('down') else
+                f'`#{cluster["cluster"]}` shards {cluster["shards"]} | {cluster["guilds"]} servers | ping {cluster["latency_ms"]}ms | lag p99 {cluster["loop_lag_p99_ms"]}ms | {cluster["gauges"].get("voice_players", 0)} players'
+                for cluster in clusters
+            )
+            pretty_data.add_field(name='Clusters', value=clusters_text, inline=False)
+        pretty_data.set_footer(text=f'Up for {int(time.time() - metrics.started) // 60} minutes')
+        await ctx.send(embed=pretty_data)
+
+
+
+    async def reload_extensions(self):
+        '''
+        Hot reloads all the command cogs. Every guild's player is kept on the bot, so VoiceCommands picks them back up on its own.
+
+        Note:
+            NOT A COMMAND
+        '''
         await self.bot.reload_extension('GeneralCommands')
         await self.bot.reload_extension('VoiceCommands')
         await self.bot.reload_extension('EventHandler')
-        self.bot.get_cog('VoiceCommands').load_instances(instances)
+
+
+
+    async def shutdown(self):
+        '''
+        Disconnects from voice everywhere and logs out
+
+        Note:
+            NOT A COMMAND
+        '''
+        await self.bot.get_cog('VoiceCommands').kill()
+        await self.bot.close()
+
+
+
+    @commands.is_owner()
+    @commands.command()
+    async def reload(self, ctx):
+        '''
+        Hot reloads all the command cogs so the bot doesn't need to be shut down to enact changes.
+        When running as multiple clusters (see app.py), every cluster reloads.
+
+        Note:
+            Can only be used by me.
+        '''
+        if hasattr(self.bot, 'cluster'):
+            self.bot.cluster.broadcast('reload')
+        else:
+            await self.reload_extensions()
 
 
 
@@ -229,10 +390,12 @@ class GeneralCommands(commands.Cog):
     @commands.command(aliases=['die', 'murder', 'strangle'])
     async def kill(self, ctx):
         '''
-        Gracefully stops the bot
+        Gracefully stops the bot. When running as multiple clusters (see app.py), every cluster is stopped.
 
         Note:
             Can only be used by me.
         '''
-        await self.bot.get_cog('VoiceCommands').kill()
-        await self.bot.close()
\ No newline at end of file
+        if hasattr(self.bot, 'cluster'):
+            self.bot.cluster.kill()
+        else:
+            await self.shutdown()
\ No newline at end of file
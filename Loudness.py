@@ -0,0 +1,161 @@
+# standard libraries
+from asyncio import get_running_loop
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import subprocess
+from threading import Lock
+
+# local modules
+from Soundboard import VOLUME, measure_loudness
+
+
+
+'''
+Measures how loud tracks are once, in the background, so that playing them again only needs a static gain instead of live loudnorm.
+Live loudnorm is single pass, so it has to guess as it goes and ends up pumping the volume. A measured gain is both cheaper and sounds better.
+'''
+
+
+
+class LoudnessAnalyzer:
+    '''
+    Attributes:
+        CACHE_FILE (str): where measurements are saved to
+        MAX_ENTRIES (int): max amount of tracks to remember
+        MAX_DURATION (int): tracks longer than this many seconds aren't measured since it means downloading the whole thing a second time
+        TARGET (float): integrated loudness (LUFS) that everything is brought to. same target that loudnorm used
+        TRUE_PEAK (float): max true peak (dBTP) after the gain is applied. quiet tracks with loud peaks get less gain so they don't clip
+        measurements (OrderedDict): least recently used first
+            {
+                key (str): {    # youtube webpage url, or a soundboard file's hash
+                    'i': float,     # integrated loudness (LUFS)
+                    'tp': float     # true peak (dBTP)
+                }
+            }
+        pending (set(str)): keys that are queued or being measured
+        executor (concurrent.futures.ThreadPoolExecutor): one thread, so only one track is ever being measured at a time
+        closed (bool): whether self.shutdown() has been called. measurements that finish after that are dropped
+    '''
+    CACHE_FILE = 'loudness_cache.json'
+    MAX_ENTRIES = 20000
+    MAX_DURATION = 15 * 60
+    TARGET = -16
+    TRUE_PEAK = -2.5
+
+    def __init__(self, cache_file: str = CACHE_FILE):
+        self.cache_file = cache_file
+        self.measurements = OrderedDict()
+        self.pending = set()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='loudness')
+        self.save_lock = Lock()
+        self.closed = False
+        self.logger = logging.getLogger('discord')
+        self.load()
+
+
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                self.measurements = OrderedDict(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+
+
+    def save(self, measurements: list):
+        '''
+        Atomically writes to self.cache_file. This is blocking so it should be run in self.executor.
+        '''
+        with self.save_lock:
+            temp_file = f'{self.cache_file}.tmp'
+            with open(temp_file, 'w') as file:
+                json.dump(measurements, file, separators=(',', ':'))
+            os.replace(temp_file, self.cache_file)
+
+
+
+    def correction(self, key: str) -> float:
+        '''
+        Returns:
+            gain_db (float or None): how many dB the track is off from TARGET, without VOLUME. None if the track hasn't been measured yet
+        '''
+        measurement = self.measurements.get(key)
+        if not measurement:
+            return None
+        self.measurements.move_to_end(key)
+        return min(self.TARGET - measurement['i'], self.TRUE_PEAK - measurement['tp'])
+
+
+
+    def gain(self, key: str) -> float:
+        '''
+        Returns:
+            gain (float or None): volume multiplier that brings the track to TARGET (and the same overall volume that PCMVolumeTransformer used to give)
+                None if the track hasn't been measured yet
+        '''
+        gain_db = self.correction(key)
+        return None if gain_db is None else 10 ** (gain_db / 20) * VOLUME
+
+
+
+    def analyze(self, key: str, source: str, duration: float = None, before_options: tuple = ()):
+        '''
+        Queues a track to be measured in the background if it hasn't been already. Does nothing if it's already measured or queued.
+
+        Args:
+            key (str): see self.measurements
+            source (str): file or url to measure
+            duration (float, optional): seconds. tracks longer than MAX_DURATION are skipped
+            before_options (tuple[str], optional): extra ffmpeg input options, ex. -reconnect options for urls
+        '''
+        if key is None or key in self.measurements or key in self.pending or (duration and duration > self.MAX_DURATION):
+            return
+        self.pending.add(key)
+        future = get_running_loop().run_in_executor(self.executor, self.measure, source, before_options)
+        future.add_done_callback(lambda future: self.measured(key, future))
+
+
+
+    def measure(self, source: str, before_options: tuple) -> dict:
+        '''
+        This is blocking so it should be run in self.executor
+        '''
+        measured = measure_loudness(source, before_options=before_options)
+        return {'i': float(measured['input_i']), 'tp': float(measured['input_tp'])}
+
+
+
+    def measured(self, key: str, future):
+        '''
+        Done callback of self.measure()
+        '''
+        self.pending.discard(key)
+        if self.closed or future.cancelled():
+            return
+        error = future.exception()
+        if error:
+            if not isinstance(error, (subprocess.CalledProcessError, ValueError, KeyError, OSError)):
+                raise error
+            self.logger.info(f'[Loudness.measured] could not measure {key}: {error}')
+            return
+        measurement = future.result()
+        if measurement['i'] == float('-inf'):
+            return  # silence. there's nothing to normalize
+        self.measurements[key] = measurement
+        while len(self.measurements) > self.MAX_ENTRIES:
+            self.measurements.popitem(last=False)
+        self.logger.info(f'[Loudness.measured] {key} is {measurement["i"]} LUFS')
+        self.executor.submit(self.save, list(self.measurements.items()))
+
+
+
+    def shutdown(self):
+        '''
+        Drops measurements that haven't started yet. The one that's running finishes on its own, but its result is thrown away.
+        '''
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,106 @@
+# standard libraries
+from collections import OrderedDict
+import time
+
+
+
+'''
+Remembers the last thing everyone said in each channel, fed by EventHandler.on_message(), so commands like mock don't have to page through
+channel history over REST to find it.
+
+The cache is a module level singleton (see last_messages) instead of living in a cog so that hot reloading doesn't empty it.
+Memory is bounded three ways: only MAX_CHANNELS channels are kept, only the MAX_AUTHORS most recent authors of each channel are kept,
+and channels that nobody has talked in for IDLE_TIMEOUT seconds are dropped.
+'''
+
+
+
+class LastMessages:
+    '''
+    Attributes:
+        MAX_CHANNELS (int): max amount of channels to remember. the least recently active ones are dropped first
+        MAX_AUTHORS (int): max amount of authors to remember per channel. the ones that talked least recently are dropped first
+        MAX_LENGTH (int): messages are cut down to this many characters. it's as much as fits in an embed title
+        IDLE_TIMEOUT (int): seconds a channel can go without any messages before it's dropped
+        channels (OrderedDict): least recently active first
+            {
+                channel id (int): [
+                    last active (float),    # time.monotonic()
+                    OrderedDict({           # least recently talked first
+                        author id (int): (message id (int), content (str))
+                    })
+                ]
+            }
+    '''
+    MAX_CHANNELS = 5000
+    MAX_AUTHORS = 20
+    MAX_LENGTH = 256
+    IDLE_TIMEOUT = 24 * 60 * 60
+
+    def __init__(self):
+        self.channels = OrderedDict()
+
+
+
+    def add(self, message):
+        '''
+        Remembers a message as its author's last one in its channel. Messages without any text (ex. just an image) are ignored.
+        '''
+        if not message.content:
+            return
+        now = time.monotonic()
+        channel = self.channels.get(message.channel.id)
+        if channel:
+            channel[0] = now
+            self.channels.move_to_end(message.channel.id)
+        else:
+            channel = self.channels[message.channel.id] = [now, OrderedDict()]
+            self.evict(now)
+        authors = channel[1]
+        authors.pop(message.author.id, None)
+        authors[message.author.id] = (message.id, message.content[:self.MAX_LENGTH])
+        if len(authors) > self.MAX_AUTHORS:
+            authors.popitem(last=False)
+
+
+
+    def evict(self, now: float):
+        '''
+        Drops channels past MAX_CHANNELS and ones that have been idle too long. Channels are in order of activity so this stops at the first active one.
+        '''
+        while self.channels:
+            active, _ = next(iter(self.channels.values()))
+            if len(self.channels) <= self.MAX_CHANNELS and now - active < self.IDLE_TIMEOUT:
+                break
+            self.channels.popitem(last=False)
+
+
+
+    def get(self, channel_id: int, author_id: int) -> str:
+        '''
+        Returns:
+            content (str or None): the last thing an author said in a channel, if it's been seen
+        '''
+        channel = self.channels.get(channel_id)
+        if not channel or time.monotonic() - channel[0] >= self.IDLE_TIMEOUT:
+            return None
+        message = channel[1].get(author_id)
+        return message[1] if message else None
+
+
+
+    def forget(self, channel_id: int, message_id: int):
+        '''
+        Forgets a message that was deleted so it can't be brought back up
+        '''
+        channel = self.channels.get(channel_id)
+        if not channel:
+            return
+        for author_id, (cached_id, _) in channel[1].items():
+            if cached_id == message_id:
+                del channel[1][author_id]
+                return
+
+
+
+last_messages = LastMessages()
@@ -0,0 +1,275 @@
+# standard libraries
+from asyncio import create_task, get_running_loop, sleep
+from bisect import bisect_left
+import logging
+import os
+import time
+
+
+
+'''
+Keeps track of how long commands take and how healthy the event loop is.
+Everything is kept on the bot itself (see get_metrics()) instead of inside a cog so that the numbers survive cogs being hot reloaded.
+
+Timeline of a command:
+    bot.check_once check        -> Metrics.command_started()
+    checks and argument parsing
+    bot.before_invoke hook      -> Metrics.command_invoked()
+    the command itself
+    on_command_completion/error -> Metrics.command_finished()
+'''
+
+
+
+def get_metrics(bot):
+    '''
+    Returns:
+        metrics (Metrics): the bot's metrics. created the first time this is called
+    '''
+    if not hasattr(bot, 'metrics'):
+        bot.metrics = Metrics()
+    return bot.metrics
+
+
+
+class Histogram:
+    '''
+    Prometheus style histogram. Only keeps a count per bucket so it never grows no matter how many values are observed.
+
+    Attributes:
+        BUCKETS (tuple[float]): default upper bounds (in seconds) of each bucket
+        bounds (tuple[float])
+        counts (list[int]): how many values fell into each bucket. the last one is for everything bigger than the last bound
+        count (int)
+        sum (float)
+        max (float)
+    '''
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, bounds: tuple = BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+
+    def quantile(self, q: float) -> float:
+        '''
+        Estimates a quantile by interpolating inside the bucket it falls in, the same way prometheus' histogram_quantile() does
+
+        Args:
+            q (float): 0 to 1
+
+        Returns:
+            value (float): 0 if nothing has been observed yet
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index-1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+
+    def cumulative(self):
+        '''
+        Yields:
+            (le (str), count (int)): prometheus' cumulative buckets, ending with +Inf
+        '''
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else f'{bound:g}'), total
+
+
+
+class Metrics:
+    '''
+    Attributes:
+        PROBE_INTERVAL (float): seconds between event loop lag probes
+        WRITE_INTERVAL (int): seconds between writes of METRICS_FILE
+        METRICS_FILE (str): prometheus text format file, meant for node_exporter's textfile collector or just reading by hand
+        started (float): time.time() that these metrics started at
+        commands (dict): how long each command took from being invoked to finishing
+            {
+                qualified command name (str): Histogram
+            }
+        checks (dict): how long each command spent in checks and argument parsing before actually running. same format as self.commands
+        errors (dict): {qualified command name (str): amount of times it failed (int)}
+        guilds (dict): total time spent on each guild's commands, so the busiest guilds can be found
+            {
+                discord.Guild.id (int): [count (int), seconds (float)]
+            }
+        loop_lag (Histogram): how late the event loop was to wake up the lag probe
+        gauges (dict): functions that are called to get a current value when stats are shown. cogs add their own (see VoiceCommands.cog_load())
+            {
+                name (str): callable() -> int or float
+            }
+        timings (dict): commands that are currently running
+            {
+                discord.ext.commands.Context: [started (float), invoked (float or None)]
+            }
+        probe (asyncio.Task): self.run_probe()
+    '''
+    PROBE_INTERVAL = 0.5
+    WRITE_INTERVAL = 15
+    METRICS_FILE = 'metrics.prom'
+    LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+    def __init__(self):
+        self.started = time.time()
+        self.commands = dict()
+        self.checks = dict()
+        self.errors = dict()
+        self.guilds = dict()
+        self.loop_lag = Histogram(self.LAG_BUCKETS)
+        self.gauges = dict()
+        self.timings = dict()
+        self.probe = None
+        self.logger = logging.getLogger('discord')
+
+
+
+    def command_started(self, ctx):
+        self.timings[ctx] = [time.perf_counter(), None]
+
+
+
+    def command_invoked(self, ctx):
+        timing = self.timings.get(ctx)
+        if timing:
+            timing[1] = time.perf_counter()
+            self.checks.setdefault(ctx.command.qualified_name, Histogram()).observe(timing[1] - timing[0])
+
+
+
+    def command_finished(self, ctx, failed: bool = False):
+        '''
+        Records how long a command took. Commands that failed their checks never got invoked so only count as errors.
+        '''
+        timing = self.timings.pop(ctx, None)
+        if not timing or not ctx.command:
+            return
+        name = ctx.command.qualified_name
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        if timing[1] is None:
+            return
+        elapsed = time.perf_counter() - timing[1]
+        self.commands.setdefault(name, Histogram()).observe(elapsed)
+        if ctx.guild:
+            guild = self.guilds.setdefault(ctx.guild.id, [0, 0.0])
+            guild[0] += 1
+            guild[1] += elapsed
+
+
+
+    def gauge_values(self) -> dict:
+        values = dict()
+        for name, gauge in self.gauges.items():
+            try:
+                values[name] = gauge()
+            except Exception as error:
+                self.logger.info(f'[Metrics.gauge_values] could not read {name}: {error}')
+        return values
+
+
+
+    def start(self):
+        '''
+        Starts the lag probe if it isn't already running. Safe to call every time a cog is (re)loaded.
+        '''
+        if not self.probe or self.probe.done():
+            self.probe = create_task(self.run_probe())
+
+
+
+    def stop(self):
+        if self.probe:
+            self.probe.cancel()
+
+
+
+    async def run_probe(self):
+        '''
+        Sleeps for PROBE_INTERVAL over and over. Anything that blocks the event loop makes the sleep wake up late, and how late it was is the lag.
+        Also writes METRICS_FILE every WRITE_INTERVAL seconds.
+        '''
+        loop = get_running_loop()
+        last_write = loop.time()
+        while True:
+            before = loop.time()
+            await sleep(self.PROBE_INTERVAL)
+            now = loop.time()
+            self.loop_lag.observe(max(0.0, now - before - self.PROBE_INTERVAL))
+            if now - last_write >= self.WRITE_INTERVAL:
+                last_write = now
+                text = self.prometheus()
+                try:
+                    await loop.run_in_executor(None, self.write, text)
+                except OSError as error:
+                    self.logger.info(f'[Metrics.run_probe] could not write {self.METRICS_FILE}: {error}')
+
+
+
+    def prometheus(self) -> str:
+        '''
+        Returns:
+            text (str): every metric in prometheus' text exposition format
+        '''
+        lines = list()
+        def histogram(name: str, description: str, histograms: dict, label: str):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, values in histograms.items():
+                labels = f'{label}="{key}",' if label else ''
+                for le, count in values.cumulative():
+                    lines.append(f'{name}_bucket{{{labels}le="{le}"}} {count}')
+                labels = f'{{{label}="{key}"}}' if label else ''
+                lines.append(f'{name}_sum{labels} {values.sum}')
+                lines.append(f'{name}_count{labels} {values.count}')
+
+        histogram('gaybot_command_duration_seconds', 'Time spent running commands after their checks passed.', self.commands, 'command')
+        histogram('gaybot_command_checks_seconds', 'Time spent in checks and argument parsing before commands ran.', self.checks, 'command')
+        histogram('gaybot_event_loop_lag_seconds', 'How late the event loop was to wake up a sleeping task.', {None: self.loop_lag}, None)
+
+        lines.append('# HELP gaybot_command_errors_total Commands that raised an error or failed a check.')
+        lines.append('# TYPE gaybot_command_errors_total counter')
+        lines.extend(f'gaybot_command_errors_total{{command="{name}"}} {count}' for name, count in self.errors.items())
+        lines.append('# HELP gaybot_guild_command_seconds_total Time spent running commands per guild.')
+        lines.append('# TYPE gaybot_guild_command_seconds_total counter')
+        lines.extend(f'gaybot_guild_command_seconds_total{{guild="{guild_id}"}} {seconds}' for guild_id, (_, seconds) in self.guilds.items())
+        for name, value in self.gauge_values().items():
+            lines.append(f'# TYPE gaybot_{name} gauge')
+            lines.append(f'gaybot_{name} {value}')
+        lines.append('# TYPE gaybot_uptime_seconds gauge')
+        lines.append(f'gaybot_uptime_seconds {time.time() - self.started:.0f}')
+        return '\n'.join(lines) + '\n'
+
+
+
+    def write(self, text: str):
+        '''
+        Atomically writes to METRICS_FILE so a scraper never reads half a file. This is blocking so it should be run in an executor.
+        '''
+        temp_file = f'{self.METRICS_FILE}.tmp'
+        with open(temp_file, 'w') as file:
+            file.write(text)
+        os.replace(temp_file, self.METRICS_FILE)
@@ -0,0 +1,345 @@
+# standard libraries
+from asyncio import CancelledError, Event, create_task, get_running_loop, wait_for
+from asyncio import TimeoutError as AsyncTimeoutError
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+import logging
+import re
+
+# dependencies
+from discord.ext import commands
+
+
+
+'''
+Decides what the bot says first when it's busy.
+Everything the bot sends to a channel goes through a per channel priority queue, so command replies always jump ahead of status reactions
+and notices. discord.py already waits out rate limits on its own, but it serves requests first come first served, so a burst of ☑️
+reactions could push a reply back by seconds.
+
+Droppable traffic (notices and reactions) is held back while a channel is close to its rate limit (or was just rate limited) and is
+thrown away if it waits too long. Nobody misses a ☑️ that would've shown up 10 seconds late.
+
+The scheduler is a module level singleton (see scheduler) instead of living in a cog so that hot reloading doesn't lose whatever is queued.
+Command replies are routed through it by ScheduledContext (see app.create_bot()).
+
+Priorities, most important first:
+    REPLY: anything a command sends. never dropped
+    PANEL: Panel.PlayerPanel updates. never dropped, but pending edits of the same panel are coalesced into the newest one
+    NOTICE: informational messages that aren't a direct answer to anything
+    REACTION: ☑️ and ❌ on commands
+'''
+
+
+
+REPLY, PANEL, NOTICE, REACTION = range(4)
+
+
+
+class ChannelQueue:
+    '''
+    Attributes:
+        heap (list[list]): [priority (int), sequence (int), queued (float), factory (callable), future (asyncio.Future), key]
+            factory is None once an entry has been dropped or coalesced away
+        keys (dict): {key: entry} for entries that can be coalesced
+        droppable (int): how many entries of priority NOTICE or lower are queued
+        recent (deque[float]): loop times of recent requests, to estimate how close the channel is to its rate limit
+        blocked_until (float): loop time until which discord said this channel is rate limited
+        wakeup (asyncio.Event): set whenever something is queued, so a worker that's holding back droppable traffic notices replies
+        worker (asyncio.Task): OutboundScheduler.run_channel()
+    '''
+    __slots__ = ('heap', 'keys', 'droppable', 'recent', 'blocked_until', 'wakeup', 'worker')
+
+    def __init__(self, limit: int):
+        self.heap = list()
+        self.keys = dict()
+        self.droppable = 0
+        self.recent = deque(maxlen=limit)
+        self.blocked_until = 0.0
+        self.wakeup = Event()
+        self.worker = None
+
+
+
+class OutboundScheduler:
+    '''
+    Attributes:
+        LIMIT (int): requests per WINDOW that a channel is assumed to allow. discord's real buckets vary, so this is only used to hold back droppable traffic
+        WINDOW (float): seconds
+        RESERVE (int): requests per WINDOW that droppable traffic leaves free for replies
+        STALE_AFTER (float): seconds droppable traffic can wait before it's dropped
+        MAX_DROPPABLE (int): droppable entries a channel can have queued. the oldest is dropped to make room
+        channels (dict): {channel id (int): ChannelQueue}. only channels with something queued
+        global_blocked_until (float): loop time until which discord's global rate limit is in effect
+        sent (int): total requests made
+        dropped (int): total droppable entries that were thrown away
+        coalesced (int): total entries that were replaced by a newer one with the same key
+        rate_limited (int): total 429s discord.py reported
+    '''
+    LIMIT = 5
+    WINDOW = 5
+    RESERVE = 1
+    STALE_AFTER = 10
+    MAX_DROPPABLE = 20
+
+    def __init__(self):
+        self.channels = dict()
+        self.sequence = count()
+        self.global_blocked_until = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.watching = False
+        self.logger = logging.getLogger('discord')
+
+
+
+    def submit(self, channel_id: int, priority: int, factory, key=None):
+        '''
+        Queues a request for a channel
+
+        Args:
+            channel_id (int)
+            priority (int): REPLY, PANEL, NOTICE, or REACTION
+            factory (callable() -> coroutine): makes the actual request. ex. lambda: channel.send('hi')
+            key (hashable, optional): a queued entry with the same key is replaced by this one instead of both being sent
+
+        Returns:
+            future (asyncio.Future): the request's result. resolves to None if it was dropped
+        '''
+        channel = self.channels.get(channel_id)
+        if not channel:
+            channel = self.channels[channel_id] = ChannelQueue(self.LIMIT)
+
+        if key is not None and key in channel.keys:
+            entry = channel.keys[key]
+            entry[3] = factory
+            self.coalesced += 1
+            return entry[4]
+
+        if priority >= NOTICE:
+            if channel.droppable >= self.MAX_DROPPABLE:
+                oldest = min((entry for entry in channel.heap if entry[0] >= NOTICE and entry[3]), key=lambda entry: entry[1])
+                self.drop(channel, oldest)
+            channel.droppable += 1
+
+        loop = get_running_loop()
+        entry = [priority, next(self.sequence), loop.time(), factory, loop.create_future(), key]
+        heappush(channel.heap, entry)
+        if key is not None:
+            channel.keys[key] = entry
+        channel.wakeup.set()
+        if not channel.worker or channel.worker.done():
+            channel.worker = create_task(self.run_channel(channel_id, channel))
+        return entry[4]
+
+
+
+    def react(self, message, emoji: str):
+        '''
+        Adds a status reaction to a message without waiting for it. It can be dropped if the channel is busy.
+        '''
+        future = self.submit(message.channel.id, REACTION, lambda: message.add_reaction(emoji), key=('reaction', message.id, emoji))
+        future.add_done_callback(self.ignore_result)
+
+
+
+    def notify(self, channel, *args, **kwargs):
+        '''
+        Sends an informational message without waiting for it. It can be dropped if the channel is busy.
+        '''
+        future = self.submit(channel.id, NOTICE, lambda: channel.send(*args, **kwargs))
+        future.add_done_callback(self.ignore_result)
+
+
+
+    def ignore_result(self, future):
+        if not future.cancelled() and future.exception():
+            self.logger.info(f'[Outbound.ignore_result] could not send: {future.exception()}')
+
+
+
+    def drop(self, channel: ChannelQueue, entry: list):
+        entry[3] = None     # lazily removed from the heap
+        if entry[5] is not None:
+            channel.keys.pop(entry[5], None)
+        if entry[0] >= NOTICE:
+            channel.droppable -= 1
+        if not entry[4].done():
+            entry[4].set_result(None)
+        self.dropped += 1
+
+
+
+    def free_at(self, channel: ChannelQueue, now: float) -> float:
+        '''
+        Returns:
+            free_at (float): loop time when droppable traffic can go out without eating into the RESERVE. now if it can go right away
+        '''
+        while channel.recent and channel.recent[0] <= now - self.WINDOW:
+            channel.recent.popleft()
+        free_at = max(now, channel.blocked_until, self.global_blocked_until)
+        if len(channel.recent) >= self.LIMIT - self.RESERVE:
+            free_at = max(free_at, channel.recent[len(channel.recent) - (self.LIMIT - self.RESERVE)] + self.WINDOW)
+        return free_at
+
+
+
+    async def run_channel(self, channel_id: int, channel: ChannelQueue):
+        '''
+        Makes a channel's requests one at a time, most important first. Exits once the channel's queue is empty.
+        '''
+        loop = get_running_loop()
+        while channel.heap:
+            entry = channel.heap[0]
+            priority, _, queued, factory, future, key = entry
+            if factory is None:
+                heappop(channel.heap)
+                continue
+            now = loop.time()
+            if priority >= NOTICE:
+                if now - queued > self.STALE_AFTER:
+                    heappop(channel.heap)
+                    self.drop(channel, entry)
+                    continue
+                free_at = self.free_at(channel, now)
+                if free_at > now:
+                    # hold back, but wake up early if something more important gets queued
+                    channel.wakeup.clear()
+                    try:
+                        await wait_for(channel.wakeup.wait(), free_at - now)
+                    except AsyncTimeoutError:
+                        pass
+                    continue
+
+            heappop(channel.heap)
+            if key is not None:
+                channel.keys.pop(key, None)
+            if priority >= NOTICE:
+                channel.droppable -= 1
+            if future.cancelled():
+                continue    # whoever was waiting for it gave up
+            channel.recent.append(now)
+            self.sent += 1
+            try:
+                result = await factory()
+            except CancelledError:
+                future.cancel()
+                raise
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+        if self.channels.get(channel_id) is channel:
+            del self.channels[channel_id]
+
+
+
+    @property
+    def queued(self) -> int:
+        return sum(len(channel.heap) for channel in self.channels.values())
+
+
+
+    def gauges(self) -> dict:
+        '''
+        Returns:
+            gauges (dict): see Metrics.Metrics.gauges
+        '''
+        return {
+            'outbound_queued': lambda: self.queued,
+            'outbound_sent': lambda: self.sent,
+            'outbound_dropped': lambda: self.dropped,
+            'outbound_coalesced': lambda: self.coalesced,
+            'outbound_rate_limited': lambda: self.rate_limited
+        }
+
+
+
+    def watch_rate_limits(self):
+        '''
+        Counts the 429s that discord.py logs and holds back droppable traffic to the channel that got one. Safe to call more than once.
+        '''
+        if not self.watching:
+            logging.getLogger('discord.http').addFilter(RateLimitFilter(self))
+            self.watching = True
+
+
+
+    def rate_limit_hit(self, channel_id: int, retry_after: float):
+        '''
+        Counts a 429 and holds back droppable traffic to the channel that got it
+
+        Args:
+            channel_id (int): None if the route wasn't for a channel
+            retry_after (float): seconds
+        '''
+        self.rate_limited += 1
+        try:
+            blocked_until = get_running_loop().time() + retry_after
+        except RuntimeError:
+            return  # logged from outside of the event loop
+        if channel_id in self.channels:
+            self.channels[channel_id].blocked_until = max(self.channels[channel_id].blocked_until, blocked_until)
+
+
+
+    def global_rate_limit_hit(self, retry_after: float):
+        '''
+        Holds back droppable traffic to every channel. Not counted since the 429 that caused it already was (see rate_limit_hit())
+
+        Args:
+            retry_after (float): seconds
+        '''
+        try:
+            blocked_until = get_running_loop().time() + retry_after
+        except RuntimeError:
+            return  # logged from outside of the event loop
+        self.global_blocked_until = max(self.global_blocked_until, blocked_until)
+
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    discord.py doesn't expose its rate limits, but it logs a warning every time it gets a 429. This reads those without filtering anything out.
+    A global rate limit logs a second warning right after the 429 one, which only says that the 429 was global.
+    '''
+    CHANNEL = re.compile(r'/channels/(\d+)')
+    RETRY = re.compile(r'[Rr]etrying in ([\d.]+)')
+
+    def __init__(self, scheduler: OutboundScheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        if 'responded with 429' in str(record.msg):
+            text = record.getMessage()
+            channel = self.CHANNEL.search(text)
+            retry = self.RETRY.search(text)
+            self.scheduler.rate_limit_hit(int(channel.group(1)) if channel else None, float(retry.group(1)) if retry else 1.0)
+        elif 'Global rate limit' in str(record.msg):
+            retry = self.RETRY.search(record.getMessage())
+            self.scheduler.global_rate_limit_hit(float(retry.group(1)) if retry else 1.0)
+        return True
+
+
+
+class ScheduledContext(commands.Context):
+    '''
+    A Context whose send() goes through the scheduler as a REPLY, so command replies always go out before queued reactions and notices
+    '''
+    async def send(self, *args, **kwargs):
+        return await scheduler.submit(self.channel.id, REPLY, lambda: super(ScheduledContext, self).send(*args, **kwargs))
+
+
+
+scheduler = OutboundScheduler()
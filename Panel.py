@@ -0,0 +1,144 @@
+# standard libraries
+from asyncio import create_task, get_running_loop, sleep
+import logging
+
+# dependencies
+from discord import Color, Embed, HTTPException, NotFound
+
+# local modules
+from Outbound import PANEL, scheduler
+from Player import AudioType
+
+
+
+'''
+One "Now Playing" message per guild that gets edited as the queue changes, instead of a new embed for every track and every enqueue.
+Changes are debounced: refresh() only marks the panel as outdated, and a single task edits it once things have settled down.
+That way skipping through ten tracks or adding a whole playlist costs one or two edits instead of dozens of messages.
+
+Panels are kept on Player.GuildPlayer and render straight from it, so they keep working when VoiceCommands is hot reloaded.
+'''
+
+
+
+class PlayerPanel:
+    '''
+    Attributes:
+        DEBOUNCE (float): seconds to wait for more changes before editing
+        MIN_INTERVAL (float): min seconds between edits, to stay well clear of discord's per channel rate limit
+        UP_NEXT (int): how many upcoming clips are shown
+        ICON (str)
+        instance (Player.GuildPlayer): what's shown
+        channel (discord.abc.Messageable): where the panel lives
+        message (discord.Message): the panel itself. None until it's first sent or after it's been deleted
+        dirty (bool): whether something changed since the last edit
+        updater (asyncio.Task): self.run_updater() while there are changes waiting to be shown
+        last_update (float): loop time of the last edit
+    '''
+    DEBOUNCE = 1
+    MIN_INTERVAL = 3
+    UP_NEXT = 5
+    ICON = 'https://i.imgur.com/8zZGsGQ.png'
+
+    def __init__(self, instance, channel):
+        self.instance = instance
+        self.channel = channel
+        self.message = None
+        self.dirty = False
+        self.updater = None
+        self.last_update = None
+        self.logger = logging.getLogger('discord')
+
+
+
+    def render(self) -> Embed:
+        '''
+        Returns:
+            pretty_data (discord.Embed): the current state of the queue
+        '''
+        pretty_data = Embed()
+        pretty_data.color = Color.green()
+        queue = self.instance.queue
+        if not queue:
+            pretty_data.set_author(name='Nothing Playing', icon_url=self.ICON)
+            pretty_data.description = 'The queue is empty. Use "gay play <video>" or "gay soundboard <clip>" to add something.'
+            return pretty_data
+
+        clip = queue[0]
+        pretty_data.title = clip.title
+        if self.instance.loop_audio:
+            pretty_data.set_author(name='Now Playing on Repeat 🔂', icon_url=self.ICON)
+        else:
+            pretty_data.set_author(name='Now Playing', icon_url=self.ICON)
+        pretty_data.description = f'Length: {clip.length}'
+        if clip.type == AudioType.YOUTUBE:
+            pretty_data.url = clip.video_url
+            pretty_data.set_thumbnail(url=clip.thumbnail_url)
+
+        upcoming = self.instance.upcoming(self.UP_NEXT)
+        if upcoming:
+            up_next = '\n'.join(f'`#{index}:` {clip.link}' for index, clip in enumerate(upcoming, start=1))
+            if len(queue) - 1 > len(upcoming):
+                up_next += f'\n...and {len(queue) - 1 - len(upcoming)} more'
+            pretty_data.add_field(name='Up Next', value=up_next[:1024])
+        else:
+            pretty_data.add_field(name='Up Next', value='This is the last video in the queue')
+        pretty_data.set_footer(text=f'{len(queue)} in queue | To undo an add, use "gay queue remove last" or "gay queue remove <index>"')
+        return pretty_data
+
+
+
+    def refresh(self):
+        '''
+        Marks the panel as outdated. The edit happens in the background once changes stop coming in.
+        '''
+        self.dirty = True
+        if not self.updater or self.updater.done():
+            self.updater = create_task(self.run_updater())
+
+
+
+    async def run_updater(self):
+        '''
+        Waits out DEBOUNCE (and MIN_INTERVAL since the last edit) and then shows every change that happened in the meantime with one edit.
+        Keeps going if more changes came in while it was editing.
+        The very first time it's sent right away so that starting to play something doesn't look laggy.
+        '''
+        while self.dirty:
+            await sleep(self.DEBOUNCE if self.message else 0)
+            if self.last_update is not None:
+                await sleep(max(0, self.last_update + self.MIN_INTERVAL - get_running_loop().time()))
+            await self.update()
+
+
+
+    async def update(self):
+        '''
+        Edits the panel right away, or sends it if there isn't one yet (or it was deleted)
+        '''
+        self.dirty = False
+        pretty_data = self.render()
+        self.last_update = get_running_loop().time()
+        try:
+            if self.message:
+                message = self.message
+                try:
+                    # edits that pile up while the channel is busy are coalesced into the newest one
+                    await scheduler.submit(self.channel.id, PANEL, lambda: message.edit(embed=pretty_data), key=('panel', message.id))
+                    return
+                except NotFound:
+                    self.message = None     # someone deleted it. send a new one
+            self.message = await scheduler.submit(self.channel.id, PANEL, lambda: self.channel.send(embed=pretty_data))
+        except HTTPException as error:
+            self.logger.info(f'[Panel.update] could not update the panel in {self.channel}: {error}')
+
+
+
+    async def close(self):
+        '''
+        Shows the final state right away and lets go of the panel. The next session starts a new one at the bottom of the channel.
+        '''
+        if self.updater and not self.updater.done():
+            self.updater.cancel()
+        if self.message:
+            await self.update()
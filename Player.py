@@ -0,0 +1,291 @@
+# standard libraries
+from collections import deque
+from enum import Enum
+from itertools import islice
+from random import shuffle
+import time
+
+
+
+'''
+Holds the state of a guild's audio player.
+These are plain data classes so they're kept separate from VoiceCommands, which means their state survives VoiceCommands being hot reloaded.
+'''
+
+
+
+class AudioType(Enum):
+    '''
+    Simple Enum to differentiate what type of audio is being added to the queue
+    '''
+    YOUTUBE = 0
+    SOUNDBOARD = 1
+
+
+
+class Clip:
+    '''
+    One item in the queue.
+    Uses __slots__ because queues can get long and there's no need for a whole dict per clip.
+
+    Attributes:
+        type (AudioType)
+        title (str)
+        source (str): dir. only for soundboard clips. youtube stream urls expire so they're resolved right before playing
+        duration (int): seconds. can be None for soundboard clips that haven't been probed yet
+        thumbnail_url (str): youtube only
+        video_url (str): youtube webpage. youtube only
+        codec (str): the audio codec of the source, ex. 'opus'. only known once the clip has been resolved
+        gain (float): volume multiplier that makes the clip the right loudness. None if it isn't known, meaning it has to be normalized live
+    '''
+    __slots__ = ('type', 'title', 'source', 'duration', 'thumbnail_url', 'video_url', 'codec', 'gain')
+
+    def __init__(self, type: AudioType, title: str, source: str = None, duration: int = None, thumbnail_url: str = None, video_url: str = None):
+        self.type = type
+        self.title = title
+        self.source = source
+        self.duration = duration
+        self.thumbnail_url = thumbnail_url
+        self.video_url = video_url
+        self.codec = None
+        self.gain = None
+
+
+
+    def snapshot(self) -> list:
+        '''
+        Returns:
+            snapshot (list): just enough to recreate the clip later. see Sessions.py
+        '''
+        return [self.type.value, self.title, self.source, self.duration, self.thumbnail_url, self.video_url]
+
+
+
+    @classmethod
+    def from_snapshot(cls, snapshot: list):
+        type, title, source, duration, thumbnail_url, video_url = snapshot
+        return cls(AudioType(type), title, source=source, duration=duration, thumbnail_url=thumbnail_url, video_url=video_url)
+
+
+
+    @property
+    def link(self) -> str:
+        '''
+        Returns:
+            link (str): the title as a markdown link if there's something to link to
+        '''
+        return f'[{self.title}]({self.video_url})' if self.video_url else self.title
+
+
+
+    @property
+    def length(self) -> str:
+        '''
+        Returns:
+            length (str): pretty version of self.duration
+        '''
+        if self.duration is None:
+            if self.type == AudioType.YOUTUBE:
+                return 'Unknown'    # playlist videos that haven't been resolved yet
+            return 'This is a soundboard clip so it should be over soon anyways.'
+        return f'{int(self.duration//60)}m {int(self.duration%60)}s'
+
+
+
+class GuildPlayer:
+    '''
+    Everything the bot needs to remember about a guild's audio.
+    The queue is a deque so moving on to the next clip is O(1) instead of list.pop(0)'s O(n).
+
+    Attributes:
+        voice (discord.VoiceClient)
+        queue (deque[Clip]): the first clip is the one currently playing
+        loop_audio (bool)
+        player (asyncio.Task): VoiceCommands.play_queue() while the bot is in voice
+        last_used (float): time.monotonic() of the last time a command touched this guild's player
+        panel (Panel.PlayerPanel): the "Now Playing" message while something is playing
+        text_channel (discord.abc.Messageable): where the session was started from
+        voice_channel_id (int): the voice channel of the current session. None once it's over on purpose, so it won't be resumed after a restart
+        version (int): goes up every time the queue changes. used to tell when it needs to be saved again
+        track_done (asyncio.Event): set when the clip that's playing ends. lives here instead of in play_queue() so a player started after a reload can wait for it
+        generation (int): goes up every time the queue is cleared on purpose (ex. stop or queue clear), so playlists that are still being listed know to stop adding to it
+    '''
+    __slots__ = ('voice', 'queue', 'loop_audio', 'player', 'last_used', 'panel', 'text_channel', 'voice_channel_id', 'version', 'track_done', 'generation')
+
+    def __init__(self):
+        self.voice = None
+        self.queue = deque()
+        self.loop_audio = False
+        self.player = None
+        self.last_used = time.monotonic()
+        self.panel = None
+        self.text_channel = None
+        self.voice_channel_id = None
+        self.version = 0
+        self.track_done = None
+        self.generation = 0
+
+
+
+    def is_connected(self) -> bool:
+        return bool(self.voice and self.voice.is_connected())
+
+
+
+    def is_idle(self, timeout: float) -> bool:
+        '''
+        Returns:
+            is_idle (bool): whether nothing is playing and nobody has used this player for {timeout} seconds, meaning it's safe to throw away
+        '''
+        if self.is_connected() or (self.player and not self.player.done()):
+            return False
+        return time.monotonic() - self.last_used > timeout
+
+
+
+    def add(self, clip: Clip) -> int:
+        '''
+        Returns:
+            index (int): where the clip ended up in the queue
+        '''
+        self.queue.append(clip)
+        self.version += 1
+        return len(self.queue) - 1
+
+
+
+    def advance(self):
+        '''
+        Throws away the clip that just played
+        '''
+        if self.queue:
+            self.queue.popleft()
+            self.version += 1
+
+
+
+    def track_finished(self):
+        '''
+        Called (on the event loop) when the clip that was playing ends. Moves on to the next clip unless looping is on.
+        '''
+        if not self.loop_audio:
+            self.advance()
+        if self.track_done:
+            self.track_done.set()
+
+
+
+    def snapshot(self) -> dict:
+        '''
+        Returns:
+            snapshot (dict): everything needed to resume this session after a restart. see Sessions.py
+        '''
+        return {
+            'voice': self.voice_channel_id,
+            'text': self.text_channel.id if self.text_channel else None,
+            'loop': self.loop_audio,
+            'queue': [clip.snapshot() for clip in self.queue]
+        }
+
+
+
+    def restore(self, snapshot: dict):
+        '''
+        Loads a queue and settings saved by self.snapshot(). The channels are left to VoiceCommands since they need the discord client.
+        '''
+        self.queue = deque(Clip.from_snapshot(clip) for clip in snapshot['queue'])
+        self.loop_audio = snapshot['loop']
+        self.version += 1
+
+
+
+    def upcoming(self, amount: int) -> list:
+        '''
+        Returns:
+            clips (list[Clip]): up to the next {amount} clips after the one currently playing
+        '''
+        return list(islice(self.queue, 1, amount+1))
+
+
+
+    def remove(self, index: int) -> Clip:
+        '''
+        While the bot is in voice index 0 is the clip that's playing, so it can't be removed (skip it instead).
+
+        Args:
+            index (int): can be negative to count from the end
+
+        Raises:
+            IndexError: if there's nothing at that index, or it's the clip that's playing
+        '''
+        if index < 0:
+            index += len(self.queue)
+        if index < (1 if self.is_connected() else 0):
+            raise IndexError(index)
+        clip = self.queue[index]
+        del self.queue[index]
+        self.version += 1
+        return clip
+
+
+
+    def move(self, old_index: int, new_index: int) -> Clip:
+        '''
+        While the bot is in voice index 0 is the clip that's playing, so nothing can be moved from or in front of it.
+        Moving to an index below 1 puts the clip at 1 instead, otherwise the clip that's playing would be thrown away in place of it.
+
+        Args:
+            old_index (int): can be negative to count from the end
+            new_index (int): can be negative to count from the end
+
+        Raises:
+            IndexError: if there's nothing at old_index, or it's the clip that's playing
+        '''
+        clip = self.remove(old_index)
+        if new_index < 0:
+            new_index += len(self.queue) + 1
+        self.queue.insert(max(1 if self.is_connected() else 0, min(new_index, len(self.queue))), clip)
+        self.version += 1
+        return clip
+
+
+
+    def shuffle(self):
+        '''
+        Shuffles everything except for the clip that's currently playing
+        '''
+        if len(self.queue) < 3:
+            return
+        current = self.queue.popleft()
+        upcoming = list(self.queue)
+        shuffle(upcoming)
+        self.queue = deque(upcoming)
+        self.queue.appendleft(current)
+        self.version += 1
+
+
+
+    def clear(self):
+        self.queue.clear()
+        self.version += 1
+        self.generation += 1
+
+
+
+    def page(self, page: int, per_page: int) -> list:
+        '''
+        Only walks as far into the queue as the requested page instead of copying the whole thing
+
+        Args:
+            page (int): starts at 0
+
+        Returns:
+            clips (list[tuple(int, Clip)]): (index, clip)
+        '''
+        start = page * per_page
+        return list(enumerate(islice(self.queue, start, start+per_page), start=start))
+
+
+
+    def page_count(self, per_page: int) -> int:
+        return max(1, -(-len(self.queue) // per_page))
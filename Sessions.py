@@ -0,0 +1,178 @@
+# standard libraries
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import logging
+import os
+import time
+
+
+
+'''
+Saves every guild's listening session (voice channel, queue, and loop setting) to disk so a restart or crash doesn't wipe it out.
+
+Saving is write-behind: queue changes only bump Player.GuildPlayer.version, and VoiceCommands.save_sessions() calls flush() every
+FLUSH_INTERVAL seconds, which writes only the guilds that changed since the last flush. Adding a 500 video playlist or skipping through
+ten songs costs one small write instead of one per change.
+
+Each guild gets its own file in STATE_DIR so clusters never write to the same file and only restore the guilds they actually have:
+    {
+        "voice": int,       # voice channel id
+        "text": int,        # text channel id
+        "loop": bool,
+        "queue": [[type, title, source, duration, thumbnail_url, video_url], ...],  # see Player.Clip.snapshot()
+        "saved": float      # unix timestamp of when the file was last written
+    }
+Sessions that are still going are rewritten every HEARTBEAT seconds even if nothing changed (ex. a long song or a loop), so "saved" always
+says how long ago the session was last alive.
+
+The store is a module level singleton (see session_store) instead of living in a cog so that hot reloading doesn't forget what's saved.
+'''
+
+
+
+class SessionStore:
+    '''
+    Attributes:
+        STATE_DIR (str): where the session files are saved
+        FLUSH_INTERVAL (int): seconds between flushes. also the most that a crash can lose
+        MAX_AGE (int): seconds after which a saved session is too old to resume. nobody wants the bot to barge into voice the next day
+        HEARTBEAT (int): seconds after which a session that's still going is rewritten even if nothing changed, so it doesn't look too old
+        saved (dict): what's on disk right now
+            {
+                discord.Guild.id (int): the key (tuple) of the GuildPlayer when it was saved. see self.key()
+            }
+        written (dict): {discord.Guild.id (int): unix timestamp (float)} of when each saved session was last written
+        restored (bool): whether sessions were already restored since the process started. reloading shouldn't restore them again
+        executor (concurrent.futures.ThreadPoolExecutor): one thread, so writes always land in the order they were made
+    '''
+    STATE_DIR = 'player_state/'
+    FLUSH_INTERVAL = 5
+    MAX_AGE = 60 * 60
+    HEARTBEAT = 5 * 60
+
+    def __init__(self, state_dir: str = STATE_DIR):
+        self.state_dir = state_dir
+        self.saved = dict()
+        self.written = dict()
+        self.restored = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sessions')
+        self.logger = logging.getLogger('discord')
+
+
+
+    def path(self, guild_id: int) -> str:
+        return os.path.join(self.state_dir, f'{guild_id}.json')
+
+
+
+    @staticmethod
+    def key(instance) -> tuple:
+        '''
+        Returns:
+            key (tuple or None): changes whenever anything that's saved changes. None if there's nothing worth saving
+        '''
+        if instance.voice_channel_id is None or not instance.queue:
+            return None
+        return (instance.version, instance.loop_audio, instance.voice_channel_id, instance.text_channel.id if instance.text_channel else None)
+
+
+
+    async def flush(self, instances: dict):
+        '''
+        Writes the sessions that changed since the last flush (or haven't been written in HEARTBEAT seconds) and deletes the ones that ended
+
+        Args:
+            instances (dict): see VoiceCommands.instances
+        '''
+        writes = dict()
+        deletes = list()
+        now = time.time()
+        for guild_id, instance in instances.items():
+            key = self.key(instance)
+            if key == self.saved.get(guild_id) and (key is None or now - self.written.get(guild_id, 0) < self.HEARTBEAT):
+                continue
+            if key is None:
+                deletes.append(guild_id)
+                del self.saved[guild_id]
+                self.written.pop(guild_id, None)
+            else:
+                writes[guild_id] = {**instance.snapshot(), 'saved': now}
+                self.saved[guild_id] = key
+                self.written[guild_id] = now
+        for guild_id in [guild_id for guild_id in self.saved if guild_id not in instances]:
+            # evicted or the bot left the guild
+            deletes.append(guild_id)
+            del self.saved[guild_id]
+            self.written.pop(guild_id, None)
+        if writes or deletes:
+            await get_running_loop().run_in_executor(self.executor, self.write, writes, deletes)
+
+
+
+    def write(self, writes: dict, deletes: list):
+        '''
+        Atomically writes each session file. This is blocking so it should be run in self.executor.
+        '''
+        os.makedirs(self.state_dir, exist_ok=True)
+        for guild_id, snapshot in writes.items():
+            path = self.path(guild_id)
+            try:
+                with open(f'{path}.tmp', 'w') as file:
+                    json.dump(snapshot, file, separators=(',', ':'))
+                os.replace(f'{path}.tmp', path)
+            except OSError as error:
+                self.logger.info(f'[Sessions.write] could not save the session of {guild_id}: {error}')
+        for guild_id in deletes:
+            try:
+                os.remove(self.path(guild_id))
+            except FileNotFoundError:
+                pass
+
+
+
+    async def load(self) -> dict:
+        '''
+        Returns:
+            sessions (dict): {discord.Guild.id (int): snapshot (dict)} of every saved session that isn't too old
+        '''
+        return await get_running_loop().run_in_executor(self.executor, self.read)
+
+
+
+    def read(self) -> dict:
+        '''
+        This is blocking so it should be run in self.executor. Sessions that are too old or corrupted are deleted.
+        '''
+        sessions = dict()
+        now = time.time()
+        for path in glob.glob(os.path.join(self.state_dir, '*.json')):
+            try:
+                guild_id = int(os.path.basename(path)[:-len('.json')])
+                with open(path, 'r') as file:
+                    snapshot = json.load(file)
+                if now - snapshot.get('saved', os.path.getmtime(path)) > self.MAX_AGE:   # files saved before 'saved' existed only have their mtime
+                    raise ValueError('too old')
+                sessions[guild_id] = snapshot
+            except (OSError, ValueError) as error:  # json.JSONDecodeError is a ValueError
+                self.logger.info(f'[Sessions.read] dropping {path}: {error}')
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return sessions
+
+
+
+    def discard(self, guild_id: int):
+        '''
+        Deletes a saved session that isn't going to be resumed
+        '''
+        self.saved.pop(guild_id, None)
+        self.written.pop(guild_id, None)
+        self.executor.submit(self.write, dict(), [guild_id])
+
+
+
+session_store = SessionStore()
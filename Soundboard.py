@@ -0,0 +1,450 @@
+# standard libraries
+from asyncio import get_running_loop
+from collections import Counter, OrderedDict
+import getopt
+import hashlib
+import json
+import logging
+import os
+from random import choice
+import re
+import subprocess
+import sys
+
+# dependencies
+from discord import AudioSource
+from discord.oggparse import OggStream
+try:
+    # rapidfuzz scores whole batches in C. fuzzywuzzy works too but is a lot slower without python-Levenshtein
+    from rapidfuzz import fuzz, process
+except ImportError:
+    from fuzzywuzzy import fuzz, process
+
+# local modules
+from FFmpeg import FFMPEG, FFPROBE
+
+
+
+'''
+Everything to do with the soundboard's files.
+
+Offline preprocessing:
+Normalizing with ffmpeg's loudnorm filter in real time and then having discord.py re-encode the PCM to opus is a lot of work to redo every time
+the same clip is played. Instead, every clip is normalized (properly, with two passes) and encoded to opus once, and the result is cached in
+CACHE_DIR under the hash of the original file's contents. Playing a preprocessed clip then just streams the opus packets straight from the file.
+
+Run this file directly to preprocess the whole soundboard:
+    py Soundboard.py [-d soundboard_dir] [-e ffmpeg_executable]
+
+Catalog:
+SoundboardCatalog keeps an in-memory index of the clips (names, search tokens, and durations) so commands don't have to list the directory.
+
+Searching:
+SoundboardMatcher narrows down which clips could match a search with an inverted index before fuzzy scoring any of them.
+'''
+
+
+
+SOUNDBOARD_DIR = 'soundboard/'
+CACHE_DIR = 'soundboard_cache/'
+MANIFEST_FILE = os.path.join(CACHE_DIR, 'manifest.json')
+LOUDNORM = 'I=-16:LRA=11:TP=-2.5'    # same targets that were used for real time normalization
+VOLUME = 0.3                        # same volume that PCMVolumeTransformer used to apply
+
+logger = logging.getLogger('discord')
+_hashes = dict()    # {(path, mtime, size): sha256} so clips aren't rehashed every time they're played
+
+
+
+def file_hash(path: str) -> str:
+    '''
+    Hashes a file's contents. Memoized on the file's mtime and size so that unchanged files are only ever read once.
+
+    Returns:
+        sha256 (str)
+    '''
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 16), b''):
+                sha.update(block)
+        _hashes[key] = sha.hexdigest()
+    return _hashes[key]
+
+
+
+def cached_path(path: str) -> str:
+    '''
+    Returns:
+        opus_path (str): where the preprocessed version of this clip lives (whether or not it's actually been made yet)
+    '''
+    return os.path.join(CACHE_DIR, f'{file_hash(path)}.opus')
+
+
+
+def get_cached_clip(path: str) -> str:
+    '''
+    Returns:
+        opus_path (str or None): the preprocessed version of this clip. None if it hasn't been preprocessed yet
+    '''
+    try:
+        opus_path = cached_path(path)
+    except OSError:
+        return None
+    return opus_path if os.path.isfile(opus_path) else None
+
+
+
+def measure_loudness(path: str, executable: str = FFMPEG, before_options: tuple = ()) -> dict:
+    '''
+    First loudnorm pass. Only measures the clip without outputting anything.
+
+    Args:
+        path (str): file or url
+        before_options (tuple[str], optional): extra input options, ex. ffmpeg's -reconnect options for urls
+
+    Returns:
+        measurements (dict): loudnorm's json output (input_i, input_lra, input_tp, input_thresh, target_offset, ...)
+    '''
+    args = [executable, '-hide_banner', '-nostats', *before_options, '-i', path, '-vn', '-af', f'loudnorm={LOUDNORM}:print_format=json', '-f', 'null', '-']
+    result = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    stderr = result.stderr.decode(errors='ignore')
+    return json.loads(stderr[stderr.rindex('{'):stderr.rindex('}')+1])    # loudnorm prints its json at the very end of stderr
+
+
+
+def preprocess_clip(path: str, executable: str = FFMPEG) -> str:
+    '''
+    Normalizes a clip using both loudnorm passes and encodes it to an ogg/opus file that discord can play without re-encoding.
+    Skips clips that have already been preprocessed.
+
+    Returns:
+        opus_path (str)
+    '''
+    opus_path = cached_path(path)
+    if os.path.isfile(opus_path):
+        return opus_path
+
+    measured = measure_loudness(path, executable)
+    loudnorm = (f'loudnorm={LOUDNORM}:measured_I={measured["input_i"]}:measured_LRA={measured["input_lra"]}:measured_TP={measured["input_tp"]}'
+                f':measured_thresh={measured["input_thresh"]}:offset={measured["target_offset"]}:linear=true')
+    temp_path = f'{opus_path}.tmp'
+    args = [executable, '-hide_banner', '-nostats', '-loglevel', 'error', '-y', '-i', path, '-vn', '-map_metadata', '-1',
+            '-af', f'{loudnorm},volume={VOLUME}', '-ar', '48000', '-ac', '2',
+            '-c:a', 'libopus', '-b:a', '128k', '-frame_duration', '20', '-f', 'opus', temp_path]
+    subprocess.run(args, stdout=subprocess.DEVNULL, check=True)
+    os.replace(temp_path, opus_path)    # only ever expose fully written files
+    return opus_path
+
+
+
+def preprocess_all(directory: str = SOUNDBOARD_DIR, executable: str = FFMPEG) -> dict:
+    '''
+    Preprocesses every clip in the soundboard and deletes cached files that no longer belong to any clip.
+
+    Returns:
+        results (dict): {clip filename (str): opus_path (str or None if it failed)}
+    '''
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    results = dict()
+    for filename in sorted(os.listdir(directory)):
+        try:
+            results[filename] = preprocess_clip(os.path.join(directory, filename), executable)
+            logger.info(f'[Soundboard.preprocess_all] {filename} -> {results[filename]}')
+        except (subprocess.CalledProcessError, ValueError, KeyError, OSError) as error:
+            results[filename] = None
+            logger.info(f'[Soundboard.preprocess_all] failed to preprocess {filename}: {error}')
+
+    keep = {os.path.basename(path) for path in results.values() if path}
+    for filename in os.listdir(CACHE_DIR):
+        if filename.endswith(('.opus', '.tmp')) and filename not in keep:
+            os.remove(os.path.join(CACHE_DIR, filename))
+    return results
+
+
+
+class OpusFileAudio(AudioSource):
+    '''
+    Plays a preprocessed ogg/opus file by handing its packets straight to discord.
+    No ffmpeg process, no filters, and no opus encoding.
+    '''
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.packets = OggStream(self.file).iter_packets()
+
+    def read(self) -> bytes:
+        return next(self.packets, b'')
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.file.close()
+
+
+
+def probe_duration(path: str, executable: str = FFPROBE) -> float:
+    '''
+    Returns:
+        duration (float): length of the clip in seconds
+    '''
+    args = [executable, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', path]
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return float(result.stdout)
+
+
+
+class SoundboardCatalog:
+    '''
+    In-memory index of every clip in the soundboard so commands never have to touch the filesystem.
+    Built once when created and rebuilt in the background by self.refresh() whenever the soundboard directory's mtime changes.
+    Clip durations are probed in the background with ffprobe and saved to MANIFEST_FILE so they only ever get probed once.
+
+    Attributes:
+        directory (str)
+        manifest_file (str): MANIFEST_FILE unless every cluster needs its own
+        mtime (int): the directory's mtime when it was last scanned
+        clips (dict): following this format
+            {
+                filename (str): {
+                    'filename': str,
+                    'name': str,            # filename without the extension
+                    'path': str,
+                    'tokens': set(str),     # lowercase words in the name used for searching
+                    'size': int,
+                    'mtime': int,
+                    'duration': float       # seconds. None if it hasn't been probed yet
+                }
+            }
+        names (list[str]): sorted clip names for listing
+    '''
+    def __init__(self, directory: str = SOUNDBOARD_DIR, manifest_file: str = MANIFEST_FILE):
+        self.directory = directory
+        self.manifest_file = manifest_file
+        self.mtime = None
+        self.clips = dict()
+        self.names = list()
+        self.refresh()
+
+
+
+    @staticmethod
+    def tokenize(name: str) -> set:
+        return set(re.findall(r'[a-z0-9]+', name.lower()))
+
+
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_file, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+
+
+    def save_manifest(self):
+        '''
+        Saves every probed duration along with the size and mtime of the file it belongs to, so changed files get probed again.
+        '''
+        manifest = {clip['filename']: {'size': clip['size'], 'mtime': clip['mtime'], 'duration': clip['duration']}
+                    for clip in self.clips.values() if clip['duration'] is not None}
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp_file = f'{self.manifest_file}.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temp_file, self.manifest_file)
+
+
+
+    def refresh(self) -> bool:
+        '''
+        Rescans the soundboard directory if it changed since the last scan.
+        Unchanged clips keep their existing entries, and durations are taken from the manifest when possible.
+        The new index is built on the side and swapped in all at once so this can safely run in another thread.
+
+        Returns:
+            changed (bool)
+        '''
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            self.clips, self.names = dict(), list()
+            return False
+        if mtime == self.mtime:
+            return False
+
+        manifest = self.load_manifest() if self.mtime is None else dict()
+        clips = dict()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            old = self.clips.get(entry.name) or manifest.get(entry.name)
+            duration = old['duration'] if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime_ns else None
+            name = os.path.splitext(entry.name)[0]
+            clips[entry.name] = {
+                'filename': entry.name,
+                'name': name,
+                'path': os.path.join(self.directory, entry.name),
+                'tokens': self.tokenize(name),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'duration': duration
+            }
+        self.clips = clips
+        self.names = sorted(clip['name'] for clip in clips.values())
+        self.mtime = mtime
+        logger.info(f'[Soundboard.refresh] indexed {len(clips)} soundboard clips')
+        return True
+
+
+
+    async def probe_durations(self, executable: str = FFPROBE):
+        '''
+        Probes the duration of every clip that doesn't have one yet without blocking the event loop, then saves the manifest.
+        '''
+        loop = get_running_loop()
+        probed = False
+        for clip in list(self.clips.values()):
+            if clip['duration'] is not None:
+                continue
+            try:
+                clip['duration'] = await loop.run_in_executor(None, probe_duration, clip['path'], executable)
+                probed = True
+            except (subprocess.CalledProcessError, ValueError, OSError) as error:
+                logger.info(f'[Soundboard.probe_durations] could not probe {clip["filename"]}: {error}')
+        if probed:
+            await loop.run_in_executor(None, self.save_manifest)
+
+
+
+    def get(self, filename: str) -> dict:
+        return self.clips.get(filename)
+
+
+
+    def random(self) -> dict:
+        '''
+        Returns:
+            clip (dict or None): a random clip. None if the soundboard is empty
+        '''
+        return self.clips[choice(list(self.clips))] if self.clips else None
+
+
+
+class SoundboardMatcher:
+    '''
+    Fuzzy search over a SoundboardCatalog.
+    Scoring every clip with fuzz.token_set_ratio one at a time gets slow as the soundboard grows, so instead:
+        1. an inverted index of words and character trigrams narrows the clips down to the ones that share the most with the search
+        2. only those candidates get scored, all in one batch
+        3. results are memoized per search until the catalog changes
+
+    Attributes:
+        MAX_CANDIDATES (int): max amount of clips that get fuzzy scored per search
+        MEMO_SIZE (int): max amount of searches to remember
+        catalog (SoundboardCatalog)
+        indexed (dict): the catalog.clips that the index was built from. used to tell when the index is outdated
+        choices (dict): {filename (str): normalized clip name (str)}
+        index (dict): {word or trigram (str): set(filename)}
+        memo (OrderedDict): {(normalized search (str), k (int)): results (list)}
+    '''
+    MAX_CANDIDATES = 50
+    MEMO_SIZE = 1024
+
+    def __init__(self, catalog: SoundboardCatalog):
+        self.catalog = catalog
+        self.indexed = None
+        self.choices = dict()
+        self.index = dict()
+        self.memo = OrderedDict()
+
+
+
+    @staticmethod
+    def grams(text: str) -> set:
+        '''
+        Returns:
+            grams (set(str)): every word in text and every trigram of those words (padded so short words still get trigrams)
+        '''
+        grams = set()
+        for word in re.findall(r'[a-z0-9]+', text.lower()):
+            grams.add(word)
+            padded = f' {word} '
+            grams.update(padded[i:i+3] for i in range(len(padded) - 2))
+        return grams
+
+
+
+    def build(self):
+        '''
+        Rebuilds the index from the catalog's current clips
+        '''
+        clips = self.catalog.clips
+        self.choices = {filename: ' '.join(re.findall(r'[a-z0-9]+', clip['name'].lower())) for filename, clip in clips.items()}
+        self.index = dict()
+        for filename, name in self.choices.items():
+            for gram in self.grams(name):
+                self.index.setdefault(gram, set()).add(filename)
+        self.memo.clear()
+        self.indexed = clips
+
+
+
+    def match(self, search_term: str, k: int = 5) -> list:
+        '''
+        Finds the clips that best match the search terms
+
+        Args:
+            search_term (str)
+            k (int): max amount of results
+
+        Returns:
+            results (list[tuple(dict, int)]): (clip, score out of 100) ordered from best to worst match. clips that scored 0 aren't included
+        '''
+        if self.catalog.clips is not self.indexed:
+            self.build()
+        query = ' '.join(re.findall(r'[a-z0-9]+', search_term.lower()))
+        key = (query, k)
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            return self.memo[key]
+
+        # count how many words/trigrams each clip shares with the search and only keep the best ones
+        overlap = Counter()
+        for gram in self.grams(query):
+            overlap.update(self.index.get(gram, ()))
+        candidates = [filename for filename, _ in overlap.most_common(self.MAX_CANDIDATES)] or list(self.choices)
+
+        scored = process.extract(query, {filename: self.choices[filename] for filename in candidates}, scorer=fuzz.token_set_ratio, limit=k)
+        # with no overlap every clip is a candidate, so without this any search would "match" something
+        results = [(self.catalog.clips[filename], int(score)) for _, score, filename in scored if int(score) > 0]
+
+        self.memo[key] = results
+        if len(self.memo) > self.MEMO_SIZE:
+            self.memo.popitem(last=False)
+        return results
+
+
+
+if __name__ == '__main__':
+    opts, _ = getopt.getopt(sys.argv[1:], "d:e:")
+    directory = SOUNDBOARD_DIR
+    executable = FFMPEG
+
+    for opt, arg in opts:
+        if opt == '-d':
+            directory = arg
+        elif opt == '-e':
+            executable = arg
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+    results = preprocess_all(directory, executable)
+    failed = [filename for filename, path in results.items() if not path]
+    logger.info(f'preprocessed {len(results) - len(failed)}/{len(results)} clips')
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,235 @@
+# standard libraries
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import sqlite3
+
+
+
+class StarStore:
+    '''
+    SQLite storage for gold stars.
+    Every guild gets its own table, indexed on star count so the leaderboard can be read in order without sorting everything.
+    All database work happens on a single worker thread which:
+        1. keeps the event loop from blocking on disk
+        2. means the one connection is only ever used by one thread
+        3. serializes every write so concurrent awards can't lose updates
+
+    Attributes:
+        DB_FILE (str): where the database is saved to
+        LEGACY_FILE (str): the old json file that stars used to be saved in. only read to migrate it
+        TOP_K (int): how many of each guild's top users are kept in memory
+        executor (concurrent.futures.ThreadPoolExecutor)
+        connection (sqlite3.Connection): only ever touched from inside self.executor
+        tables (set(int)): guild ids whose tables are known to exist
+        top (dict): each guild's top users, kept up to date as stars are given so the first leaderboard pages never hit the database
+            {
+                discord.Guild.id (int): list[tuple(user_id (int), stars (int))]   # ordered by most stars
+            }
+        counts (dict): how many users are in each guild's table, counted once when the table is first used and kept up to date after that
+            {
+                discord.Guild.id (int): int
+            }
+    '''
+    DB_FILE = 'gold_stars.db'
+    LEGACY_FILE = 'gold_stars.json'
+    TOP_K = 50
+
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stars')
+        self.connection = None
+        self.tables = set()
+        self.top = dict()
+        self.counts = dict()
+        self.logger = logging.getLogger('discord')
+
+
+
+    async def _run(self, func, *args):
+        return await get_running_loop().run_in_executor(self.executor, func, *args)
+
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self.connection:
+            self.connection = sqlite3.connect(self.db_file, check_same_thread=False)    # safe because only self.executor's one thread uses it
+            self.connection.execute('PRAGMA journal_mode=WAL')      # readers don't block the writer and commits don't rewrite the whole file
+            self.connection.execute('PRAGMA synchronous=NORMAL')    # still crash safe in WAL mode, just skips some fsyncs
+        return self.connection
+
+
+
+    @staticmethod
+    def _table(guild_id: int) -> str:
+        return f'stars_{int(guild_id)}'   # int() so nothing but a number can ever end up in the sql
+
+
+
+    def _ensure_table(self, guild_id: int, member_ids: set = None):
+        '''
+        Creates a guild's table if it doesn't exist yet.
+        Brand new tables are seeded with whatever is in LEGACY_FILE, which was shared between every guild, so only the users that are actually
+        members of the guild get migrated. This only ever happens once per guild since the table will exist next time.
+
+        Args:
+            guild_id (int)
+            member_ids (set(int), optional): the guild's members. if not given, every user in LEGACY_FILE is migrated
+        '''
+        if guild_id in self.tables:
+            return
+        connection = self._connect()
+        table = self._table(guild_id)
+        exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if not exists:
+            with connection:
+                connection.execute(f'CREATE TABLE {table} (user_id INTEGER PRIMARY KEY, stars INTEGER NOT NULL DEFAULT 0)')
+                connection.execute(f'CREATE INDEX {table}_stars ON {table} (stars DESC)')
+                legacy = self._load_legacy()
+                rows = [(int(user_id), stars) for user_id, stars in legacy.items() if member_ids is None or int(user_id) in member_ids]
+                connection.executemany(f'INSERT INTO {table} (user_id, stars) VALUES (?, ?)', rows)
+            self.logger.info(f'[StarStore.ensure_table] created {table} and migrated {len(rows)} users from {self.LEGACY_FILE}')
+            self.counts[guild_id] = len(rows)
+        else:
+            self.counts[guild_id] = connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        self.tables.add(guild_id)
+
+
+
+    def has_table(self, guild_id: int) -> bool:
+        '''
+        Returns:
+            has_table (bool): whether the guild's table is known to exist (and so has already been migrated)
+        '''
+        return guild_id in self.tables
+
+
+
+    def _load_legacy(self) -> dict:
+        try:
+            with open(self.LEGACY_FILE, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+
+
+    def _get(self, guild_id: int, user_id: int, member_ids: set) -> int:
+        self._ensure_table(guild_id, member_ids)
+        row = self._connect().execute(f'SELECT stars FROM {self._table(guild_id)} WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+
+
+    def _add(self, guild_id: int, user_id: int, amount: int, member_ids: set) -> int:
+        self._ensure_table(guild_id, member_ids)
+        connection = self._connect()
+        table = self._table(guild_id)
+        with connection:
+            # the increment happens inside sqlite, so there's no read-modify-write window for concurrent awards to step on
+            updated = connection.execute(f'UPDATE {table} SET stars = stars + ? WHERE user_id = ?', (amount, user_id)).rowcount
+            if not updated:
+                connection.execute(f'INSERT INTO {table} (user_id, stars) VALUES (?, ?)', (user_id, amount))
+            stars = connection.execute(f'SELECT stars FROM {table} WHERE user_id = ?', (user_id,)).fetchone()[0]
+        if not updated:
+            self.counts[guild_id] += 1
+        self._update_top(guild_id, user_id, stars, amount)
+        return stars
+
+
+
+    def _update_top(self, guild_id: int, user_id: int, stars: int, amount: int):
+        '''
+        Updates a guild's cached top users after someone's stars change.
+        Gaining stars can only ever move someone up, so that's handled in memory. Losing stars could let someone outside of the cached top users
+        into it, and only the database knows who that is, so the cache is just dropped and gets reloaded next time it's needed.
+        '''
+        top = self.top.get(guild_id)
+        if top is None:
+            return
+        if amount < 0:
+            del self.top[guild_id]
+            return
+        top = [row for row in top if row[0] != user_id]
+        if len(top) < self.TOP_K or stars > top[-1][1]:
+            top.append((user_id, stars))
+            top.sort(key=lambda row: row[1], reverse=True)
+        self.top[guild_id] = top[:self.TOP_K]
+
+
+
+    def _leaderboard(self, guild_id: int, limit: int, offset: int, member_ids: set) -> list:
+        self._ensure_table(guild_id, member_ids)
+        query = f'SELECT user_id, stars FROM {self._table(guild_id)} ORDER BY stars DESC LIMIT ? OFFSET ?'
+        if guild_id not in self.top:
+            self.top[guild_id] = self._connect().execute(query, (self.TOP_K, 0)).fetchall()
+        if 0 <= limit and offset + limit <= self.TOP_K:
+            return self.top[guild_id][offset:offset+limit]
+        return self._connect().execute(query, (limit, offset)).fetchall()
+
+
+
+    def _count(self, guild_id: int, member_ids: set) -> int:
+        self._ensure_table(guild_id, member_ids)
+        return self.counts[guild_id]
+
+
+
+    async def get(self, guild_id: int, user_id: int, member_ids: set = None) -> int:
+        '''
+        Returns:
+            stars (int): how many gold stars the user has. 0 if they've never gotten any
+        '''
+        return await self._run(self._get, guild_id, user_id, member_ids)
+
+
+
+    async def add(self, guild_id: int, user_id: int, amount: int, member_ids: set = None) -> int:
+        '''
+        Atomically gives (or takes away if amount is negative) gold stars
+
+        Returns:
+            stars (int): how many gold stars the user has now
+        '''
+        return await self._run(self._add, guild_id, user_id, amount, member_ids)
+
+
+
+    async def leaderboard(self, guild_id: int, limit: int = -1, offset: int = 0, member_ids: set = None) -> list:
+        '''
+        Args:
+            limit (int, optional): max amount of rows. defaults to all of them
+            offset (int, optional): how many rows to skip
+
+        Returns:
+            rows (list[tuple(int, int)]): (user_id, stars) ordered by most stars
+        '''
+        return await self._run(self._leaderboard, guild_id, limit, offset, member_ids)
+
+
+
+    async def count(self, guild_id: int, member_ids: set = None) -> int:
+        '''
+        Returns:
+            count (int): how many users are on the leaderboard
+        '''
+        if guild_id in self.counts:
+            return self.counts[guild_id]    # no need to wait behind whatever else is queued for the database
+        return await self._run(self._count, guild_id, member_ids)
+
+
+
+    def _close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+
+
+    async def close(self):
+        '''
+        Closes the database once everything that's already queued has finished
+        '''
+        await self._run(self._close)
+        self.executor.shutdown(wait=False)
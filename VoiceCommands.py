@@ -1,18 +1,25 @@
 # standard libraries
-from asyncio import sleep
-from enum import Enum
+from asyncio import CancelledError, Event, create_task, get_running_loop, sleep
 import logging
-from os import listdir
-from random import choice
+import time
 
 # dependencies
-from discord import Color, Embed, FFmpegPCMAudio, PCMVolumeTransformer
-from discord.ext import commands
-from fuzzywuzzy import fuzz
-from yt_dlp import YoutubeDL
+from discord import AudioSource, Color, Embed, FFmpegOpusAudio
+from discord.ext import commands, tasks
 
 # local modules
+from AudioCache import AudioCache
+from Cluster import cluster_path
 from Exceptions import *
+from FFmpeg import FFMPEG, ManagedAudio, manager as ffmpeg_manager
+from Loudness import LoudnessAnalyzer
+from Metrics import get_metrics
+from Outbound import scheduler
+from Panel import PlayerPanel
+from Player import AudioType, Clip, GuildPlayer
+from Sessions import SessionStore, session_store
+from Soundboard import LOUDNORM, MANIFEST_FILE, VOLUME, OpusFileAudio, SoundboardCatalog, SoundboardMatcher, file_hash, get_cached_clip
+from Youtube import SearchCache, YoutubeExtractor
 
 
 
@@ -25,70 +32,264 @@ async def setup(bot):
 
 
 
-class AudioType(Enum):
-    '''
-    Simple Enum to differentiate what type of audio is being added to the queue
-    '''
-    YOUTUBE = 0
-    SOUNDBOARD = 1
-
-
-
 class VoiceCommands(commands.Cog):
     '''
     Holds all the voice-channel related commands
     Things like playing youtube videos or soundboard
 
     Attributes:
-        FFMPEG_OPTIONS (dict): options sent to ffmpeg
-        instances (dict): following this format
+        LOOKAHEAD (int): how many clips after the currently playing one get prepared in the background
+        INTER_TRACK_GAP (float): seconds of silence between clips so they don't play back to back. can be 0
+        SOUNDBOARD_REFRESH (int): how often (in seconds) the soundboard directory is checked for changes
+        SOUNDBOARD_CONFIDENT (int): soundboard searches that score lower than this (out of 100) also show other possible matches
+        SOUNDBOARD_SUGGESTIONS (int): max amount of other possible matches to show
+        QUEUE_PAGE_SIZE (int): how many clips are shown per page of 'gay queue'
+        PASSTHROUGH_TOLERANCE (float): how many dB off TARGET an opus source can be for its stream to just be copied instead of re-encoded
+        IDLE_TIMEOUT (int): seconds a guild's player can go unused while not in voice before it's thrown away
+        instances (dict): only has guilds that have used voice recently. use self.get_instance() instead of accessing this directly
+            {
+                discord.Guild.id (int): Player.GuildPlayer
+            }
+            kept on the bot (as bot.voice_instances) so that reloading this cog doesn't lose anyone's player
+        extractor (Youtube.YoutubeExtractor): runs yt-dlp off of the event loop
+        search_cache (Youtube.SearchCache): the extractor's cache of youtube lookups
+            kept on the bot (see bot.search_cache) so reloading doesn't read it back from disk before the old cog's last save has landed
+        audio_cache (AudioCache.AudioCache): local copies of frequently played songs. does nothing unless it's been turned on
+            kept on the bot (see bot.audio_cache) so reloading doesn't verify every file again or lose track of the download that's running
+        loudness (Loudness.LoudnessAnalyzer): measured loudness of clips that have been played before
+            kept on the bot (see bot.loudness) so a measurement that finishes during a reload is still saved
+        soundboard_catalog (Soundboard.SoundboardCatalog): in-memory index of the soundboard clips
+        soundboard_matcher (Soundboard.SoundboardMatcher): fuzzy search over self.soundboard_catalog
+        pending_searches (dict): youtube searches that haven't finished yet so they can be cancelled if the user leaves
             {
-                discord.Guild.id (int): {
-                    'voice': discord.VoiceClient,
-                    'queue': [{
-                            'type': AudioType,
-                            'source': str,          # url or dir
-                            'title': str,
-                            'duration': int,        # seconds
-                            'thumbnail_url': str,
-                            'video_url': str]       # youtube webpage
-                        }],
-                    'loop_audio': bool
-                }
+                (discord.Guild.id, discord.Member.id): set(asyncio.Task)
             }
+        killed (bool): set by self.kill() so that sessions aren't saved again after the audio is stopped
 
     '''
+    LOOKAHEAD = 2
+    INTER_TRACK_GAP = 1
+    SOUNDBOARD_REFRESH = 10
+    SOUNDBOARD_CONFIDENT = 90
+    SOUNDBOARD_SUGGESTIONS = 3
+    QUEUE_PAGE_SIZE = 10
+    IDLE_TIMEOUT = 30 * 60
+    PASSTHROUGH_TOLERANCE = 1
+
     def __init__(self, bot):
         self.bot = bot
-        self.instances = dict()
+        if not hasattr(bot, 'voice_instances'):
+            bot.voice_instances = dict()
+        self.instances = bot.voice_instances
+        # clusters can't share the files these write to. see Cluster.cluster_path()
+        if not hasattr(bot, 'search_cache'):
+            bot.search_cache = SearchCache(cluster_path(bot, SearchCache.CACHE_FILE))
+        self.search_cache = bot.search_cache
+        self.extractor = YoutubeExtractor(cache=self.search_cache)
+        if not hasattr(bot, 'audio_cache'):
+            bot.audio_cache = AudioCache(cache_dir=cluster_path(bot, AudioCache.CACHE_DIR))
+        self.audio_cache = bot.audio_cache
+        if not hasattr(bot, 'loudness'):
+            bot.loudness = LoudnessAnalyzer(cluster_path(bot, LoudnessAnalyzer.CACHE_FILE))
+        self.loudness = bot.loudness
+        self.pending_searches = dict()
+        self.killed = False
+        self.soundboard_catalog = SoundboardCatalog(manifest_file=cluster_path(bot, MANIFEST_FILE))
+        self.soundboard_matcher = SoundboardMatcher(self.soundboard_catalog)
         self.logger = logging.getLogger('discord')
 
 
 
-    async def init_guilds(self):
+    async def cog_load(self):
+        '''
+        Called by discord.py when this cog is added to the bot.
+        '''
+        self.watch_soundboard.start()
+        self.evict_idle.start()
+        self.save_sessions.start()
+        self.save_search_cache.start()
+        self.resume_players()
+        if not session_store.restored:
+            session_store.restored = True
+            create_task(self.restore_sessions())
+        create_task(self.audio_cache.start())   # verifying the cached files can take a bit so it shouldn't hold up loading the cog. only done once per process
+        get_metrics(self.bot).gauges.update({
+            'voice_players': lambda: sum(instance.is_connected() for instance in self.instances.values()),
+            'voice_queue_depth': lambda: sum(len(instance.queue) for instance in self.instances.values()),
+            'ffmpeg_processes': lambda: len(ffmpeg_manager.processes),
+            'ffmpeg_waiting': lambda: sum(len(futures) for futures in ffmpeg_manager.waiting.values()),
+            'ffmpeg_killed': lambda: ffmpeg_manager.killed
+        })
+
+
+
+    async def cog_unload(self):
+        '''
+        Called by discord.py when this cog is removed (including when it's reloaded).
+        '''
+        self.watch_soundboard.cancel()
+        self.evict_idle.cancel()
+        self.save_sessions.cancel()
+        self.save_search_cache.cancel()
+        for instance in self.instances.values():
+            if instance.player:
+                # they'd keep running this (soon to be old) cog's code with its extractor and caches shut down. the reloaded cog restarts them
+                instance.player.cancel()
+        if not self.killed:
+            await session_store.flush(self.instances)   # self.kill() already saved everything before it stopped the audio
+        for gauge in ['voice_players', 'voice_queue_depth', 'ffmpeg_processes', 'ffmpeg_waiting', 'ffmpeg_killed']:
+            get_metrics(self.bot).gauges.pop(gauge, None)
+        for pending in self.pending_searches.values():
+            for task in pending:
+                task.cancel()
+        self.extractor.shutdown()
+        if self.killed:
+            # otherwise the reloaded cog keeps using them
+            self.search_cache.shutdown()
+            self.audio_cache.shutdown()
+            self.loudness.shutdown()
+        else:
+            await self.search_cache.flush()
+
+
+
+    def get_instance(self, guild_id: int) -> GuildPlayer:
         '''
-        Inits self.instances with all the guilds that the bot is a part of.
-        This is done here instead of in self.__init__() because an instance of this class is created before the bot connects to discord and has knowledge of which guilds it is a part of.
-        So this is called after the bot is ready and has this knowledge (see GayBot.py's on_ready())
+        Gets a guild's player, creating it the first time the guild uses anything voice related.
+        This way guilds that never use voice (or that the bot joins later) don't need anything set up ahead of time.
 
-        Note:
-            This is only fetched once at the beginning of the bot's life. If the bot joins other servers during runtime, a KeyError will be thrown whenever
-            someone tries to ues voice functionalities.
-        '''
-        for guild in self.bot.guilds:
-            self.instances[guild.id] = {
-                'voice': None,
-                'queue': list(),
-                'loop_audio': False
-            }
+        Returns:
+            instance (Player.GuildPlayer)
+        '''
+        instance = self.instances.get(guild_id)
+        if not instance:
+            instance = self.instances[guild_id] = GuildPlayer()
+        instance.last_used = time.monotonic()
+        return instance
 
 
 
-    # used to preserve the bot's current state when reloading the extension
     def get_instances(self) -> dict:
         return self.instances
-    def load_instances(self, instances):
-        self.instances = instances
+
+
+
+    @tasks.loop(seconds=SOUNDBOARD_REFRESH)
+    async def watch_soundboard(self):
+        '''
+        Keeps self.soundboard_catalog up to date in the background and probes the durations of any new clips.
+        The first run also probes clips from before the bot started that aren't in the manifest yet.
+        '''
+        changed = await get_running_loop().run_in_executor(None, self.soundboard_catalog.refresh)
+        if changed or self.watch_soundboard.current_loop == 0:
+            self.soundboard_matcher.build()    # rebuild here so the next search doesn't have to
+            await self.soundboard_catalog.probe_durations()
+
+
+
+    @tasks.loop(seconds=IDLE_TIMEOUT/2)
+    async def evict_idle(self):
+        '''
+        Throws away the players of guilds that haven't used voice in a while so memory only grows with the amount of active voice sessions
+        '''
+        idle = [guild_id for guild_id, instance in self.instances.items() if instance.is_idle(self.IDLE_TIMEOUT)]
+        for guild_id in idle:
+            del self.instances[guild_id]
+        if idle:
+            self.logger.info(f'[VoiceCommands.evict_idle] evicted {len(idle)} idle guild players. {len(self.instances)} left')
+
+
+
+    @tasks.loop(seconds=SessionStore.FLUSH_INTERVAL)
+    async def save_sessions(self):
+        '''
+        Saves the sessions that changed since the last time (see Sessions.py)
+        '''
+        await session_store.flush(self.instances)
+
+
+
+    @tasks.loop(seconds=SearchCache.FLUSH_INTERVAL)
+    async def save_search_cache(self):
+        '''
+        Saves the youtube lookups that were added since the last time
+        '''
+        await self.search_cache.flush()
+
+
+
+    def resume_players(self):
+        '''
+        Restarts the players of guilds that were in voice when this cog was reloaded. Their old players were cancelled in cog_unload().
+        '''
+        for guild_id, instance in self.instances.items():
+            if instance.is_connected():
+                instance.player = create_task(self.play_queue(guild_id))
+
+
+
+    async def restore_sessions(self):
+        '''
+        Resumes the listening sessions that were going on when the bot last stopped or crashed (see Sessions.py).
+        Runs in the background after startup, one guild at a time. Sessions whose voice channel is empty now are thrown away.
+        '''
+        await self.bot.wait_until_ready()
+        sessions = await session_store.load()
+        for guild_id, snapshot in sessions.items():
+            guild = self.bot.get_guild(guild_id)
+            if not guild:
+                continue    # belongs to another cluster. if the bot left the guild, it gets cleaned up once it's older than SessionStore.MAX_AGE
+            voice_channel = guild.get_channel(snapshot['voice'])
+            text_channel = guild.get_channel(snapshot['text'])
+            instance = self.instances.get(guild_id)
+            listeners = [member for member in voice_channel.members if not member.bot] if voice_channel else []
+            if not listeners or not text_channel or (instance and (instance.is_connected() or instance.queue)):
+                session_store.discard(guild_id)
+                continue
+
+            instance = self.get_instance(guild_id)
+            instance.restore(snapshot)
+            instance.text_channel = text_channel
+            instance.voice_channel_id = voice_channel.id
+            session_store.saved[guild_id] = session_store.key(instance)    # it's already on disk
+            try:
+                instance.voice = await voice_channel.connect()
+            except Exception as error:
+                self.logger.info(f'[VoiceCommands.restore_sessions] could not rejoin {voice_channel} in {guild}: {error}')
+                instance.clear()
+                instance.voice_channel_id = None
+                continue
+            instance.player = create_task(self.play_queue(guild_id))
+            self.logger.info(f'[VoiceCommands.restore_sessions] resumed {len(instance.queue)} clips in {guild}')
+            scheduler.notify(text_channel, f':arrows_counterclockwise: I was restarted, so I\'m picking up where I left off with **{len(instance.queue)}** things in the queue.')
+
+
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        '''
+        Stops playing and forgets everything about a guild when the bot is kicked from it (or the guild is deleted)
+        '''
+        instance = self.instances.pop(guild.id, None)
+        if not instance:
+            return
+        if instance.player:
+            instance.player.cancel()
+        if instance.voice:
+            instance.voice.stop()
+            await instance.voice.disconnect(force=True)
+
+
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        '''
+        Cancels any youtube searches a user started if they leave voice before the search finishes.
+        There's no point in finishing the search because join_and_play() would reject them anyways.
+        '''
+        if before.channel and not after.channel:
+            for task in self.pending_searches.pop((member.guild.id, member.id), set()):
+                task.cancel()
 
 
 
@@ -96,88 +297,197 @@ class VoiceCommands(commands.Cog):
 # GENERIC FUNCTIONS
 ####################################################################################################################################
 
-    def get_audio_object(self, clip_data: dict) -> FFmpegPCMAudio:
+    async def resolve_source(self, clip: Clip) -> str:
         '''
-        Converts the clip link/dir to be played into an discord.FFMpegPCMAudio object used for playing audio.
+        Gets the link/dir that ffmpeg should actually play for a clip.
+        Youtube clips only store their webpage url in the queue because stream urls expire, so this gets a fresh one.
+        This is almost always instant since self.prepare_upcoming() should have already cached it.
+        Songs that are in self.audio_cache are played from disk instead.
 
         Args:
-            clip_data (dict): see self.instances[discord.Guild.id]['queue'][0]
+            clip (Player.Clip)
 
         Returns:
-            audio_clip (discord.FFmpegPCMAudio)
+            source (str): stream url or dir
         '''
-        if clip_data['type'] == AudioType.YOUTUBE:
-            ffmpeg_options = {
-                'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5', # this prevents the bot from prematurely disconnecting if it loses connection for a short period of time
-                'options': '-vn -af loudnorm=I=-16:LRA=11:TP=-2.5'  # this normalizes the volume so things aren't overly loud or quiet
-            }
-            audio_clip = FFmpegPCMAudio(clip_data['source'], executable=r'C:\ffmpeg\bin\ffmpeg.exe', **ffmpeg_options)
-            audio_clip = PCMVolumeTransformer(audio_clip, volume=0.3)
-            return audio_clip
+        if clip.type == AudioType.YOUTUBE:
+            local = self.audio_cache.get(clip.video_url)
+            if local:
+                clip.codec = self.audio_cache.codec(clip.video_url)
+                return local
+            info = await self.extractor.search(clip.video_url)
+            if clip.duration is None:
+                clip.duration = info.get('duration')    # playlist videos only get their full info once they're resolved
+            clip.codec = info.get('acodec')
+            return info['url']
+        return clip.source
 
-        if clip_data['type'] == AudioType.SOUNDBOARD:
-            ffmpeg_options = {'options': '-af loudnorm=I=-16:LRA=11:TP=-2.5'}   # this normalizes the volume so things aren't overly loud or quiet
-            audio_clip = FFmpegPCMAudio(clip_data['source'], executable=r'C:\ffmpeg\bin\ffmpeg.exe', **ffmpeg_options)
-            audio_clip = PCMVolumeTransformer(audio_clip, volume=0.3)
-            return audio_clip
 
 
+    def loudness_key(self, clip: Clip, source: str) -> str:
+        '''
+        Returns:
+            key (str or None): what a clip's loudness is saved under. see Loudness.LoudnessAnalyzer.measurements
+        '''
+        if clip.type == AudioType.YOUTUBE:
+            return clip.video_url
+        try:
+            return file_hash(source)
+        except OSError:
+            return None
 
-    async def play_next(self, ctx):
+
+
+    async def prepare_upcoming(self, guild_id: int):
         '''
-        A recursive function that plays all the audio clips in the queue
-        If there are no more audio clips in the queue, it disconnects
+        Makes sure the next few youtube clips in the queue have fresh stream urls cached so that moving on to them doesn't wait on yt-dlp.
+        Meant to be run in the background while the current clip plays.
 
         Note:
             NOT A COMMAND
         '''
-        if self.instances[ctx.guild.id]['queue']:
-            clip_data = self.instances[ctx.guild.id]['queue'][0]
+        instance = self.instances.get(guild_id)
+        if not instance:
+            return
+        for clip in instance.upcoming(self.LOOKAHEAD):
+            if clip.type != AudioType.YOUTUBE or self.audio_cache.get(clip.video_url):
+                continue
+            try:
+                await self.extractor.search(clip.video_url)
+            except Exception as error:
+                # not a big deal. play_queue() will try again and skip it if it really is broken
+                self.logger.info(f'[VoiceCommands.prepare_upcoming] could not prepare {clip.video_url}: {error}')
 
-            # pretty output using embed
-            pretty_data = Embed()
-            pretty_data.title = clip_data['title']
-            pretty_data.color = Color.green()
-            if self.instances[ctx.guild.id]['loop_audio']:
-                pretty_data.set_author(name='Now Playing on Repeat 🔂', icon_url='https://i.imgur.com/8zZGsGQ.png')
-            else:
-                pretty_data.set_author(name='Now Playing', icon_url='https://i.imgur.com/8zZGsGQ.png')
-            if clip_data['type'] == AudioType.YOUTUBE:
-                pretty_data.url = clip_data['video_url']
-                pretty_data.description = f'Length: {int(clip_data["duration"]/60)}m {int(clip_data["duration"]%60)}s'
-                pretty_data.set_thumbnail(url=clip_data['thumbnail_url'])
-            else:
-                # if this is a soundboard clip
-                pretty_data.description = 'Length: This is a soundboard clip and I\'m too lazy to code in the length. It should be over soon anyways.'
-
-            # still pretty output stuff
-            if len(self.instances[ctx.guild.id]['queue']) > 1:
-                next_clip = self.instances[ctx.guild.id]['queue'][1]
-                val = f'[{next_clip["title"]}]({next_clip["video_url"]})' if next_clip['type'] == AudioType.YOUTUBE else next_clip['title']
-                pretty_data.add_field(name='Up Next', value=val)
-            else:
-                pretty_data.add_field(name='Up Next', value='This is the last video in the queue')
-            await ctx.send(embed=pretty_data)
-
-            # actually play audio
-            self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] playing {clip_data["title"]}...')
-            self.instances[ctx.guild.id]['voice'].play(self.get_audio_object(clip_data))
-            # waits 3 seconds between clips so it doesn't just play back to back
-            while self.instances[ctx.guild.id]['voice'].is_playing(): # this while loop is needed like this because discord.VoiceClient.play is not asynchronous for some reason
-                await sleep(0.5)
-            await sleep(3)
-
-            # don't pop from queue unless the 'loop' feature is on
-            if not self.instances[ctx.guild.id]['loop_audio']:
-                if self.instances[ctx.guild.id]['queue']:
-                    self.instances[ctx.guild.id]['queue'].pop(0)
-            await self.play_next(ctx)
+
+
+    async def get_audio_object(self, clip: Clip, source: str, guild_id: int) -> AudioSource:
+        '''
+        Converts the clip link/dir to be played into an discord.AudioSource object used for playing audio.
+        Everything is handed to discord.py as opus so it never has to decode, scale, and re-encode every 20ms frame in python:
+            1. soundboard clips that were preprocessed by Soundboard.py are played straight from their opus file
+            2. opus sources that are already within PASSTHROUGH_TOLERANCE of Loudness.LoudnessAnalyzer.TARGET are copied as is. no decoding or encoding at all.
+               these skip VOLUME too since copying can't change the volume, so they play at TARGET itself
+            3. clips with a known gain only need ffmpeg's cheap volume filter
+            4. everything else is normalized live with loudnorm like before
+        Everything except 1 needs an ffmpeg process, which might have to wait for a free slot (see FFmpeg.FFmpegManager).
+
+        Args:
+            clip (Player.Clip)
+            source (str): see self.resolve_source()
+            guild_id (int): who the ffmpeg process is for
+
+        Returns:
+            audio_clip (FFmpeg.ManagedAudio or Soundboard.OpusFileAudio)
+        '''
+        if clip.type == AudioType.SOUNDBOARD:
+            preprocessed = get_cached_clip(source)
+            if preprocessed:
+                return OpusFileAudio(preprocessed)  # already normalized and at the right volume
+
+        key = self.loudness_key(clip, source)
+        correction = self.loudness.correction(key)
+        clip.gain = self.loudness.gain(key)
+
+        before_options = None
+        if clip.type == AudioType.YOUTUBE and source.startswith('http'):
+            before_options = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'   # this prevents the bot from prematurely disconnecting if it loses connection for a short period of time
+
+        codec = None
+        if clip.gain is None:
+            options = f'-vn -af loudnorm={LOUDNORM},volume={VOLUME}'   # this normalizes the volume so things aren't overly loud or quiet
+        elif clip.codec == 'opus' and abs(correction) <= self.PASSTHROUGH_TOLERANCE:
+            options = '-vn'
+            codec = 'copy'
         else:
-            await self.instances[ctx.guild.id]['voice'].disconnect()
+            options = f'-vn -af volume={clip.gain:.4f}'
 
+        return await ffmpeg_manager.open(guild_id, lambda: FFmpegOpusAudio(source, codec=codec, executable=FFMPEG, before_options=before_options, options=options))
 
 
-    async def join_and_play(self, ctx, clip_data):
+
+    async def play_queue(self, guild_id: int):
+        '''
+        The per-guild player. Plays all the audio clips in the queue one after another.
+        If there are no more audio clips in the queue, it disconnects.
+        Runs as its own task (see self.join_and_play()) and is woken up by discord.VoiceClient.play()'s after callback
+        instead of polling, so it doesn't wake up at all while a clip is playing.
+        If it was started by a reload while a clip is still playing, it waits for that clip to finish first.
+
+        Note:
+            NOT A COMMAND
+        '''
+        instance = self.get_instance(guild_id)
+        channel = instance.text_channel
+        loop = get_running_loop()
+        if instance.track_done and not instance.track_done.is_set() and instance.is_connected() and instance.voice.is_playing():
+            await instance.track_done.wait()
+            if self.INTER_TRACK_GAP:
+                await sleep(self.INTER_TRACK_GAP)
+
+        while True:
+            while instance.queue and instance.is_connected():
+                clip = instance.queue[0]
+                try:
+                    source = await self.resolve_source(clip)
+                except Exception as error:
+                    # the video was probably taken down or youtube is having issues. skip it even if looping is on
+                    self.logger.info(f'[VoiceCommands.play_queue] could not load {clip.title}: {error}')
+                    scheduler.notify(channel, f':no_entry_sign: Could not load **{clip.title}**. Skipping it.')
+                    if instance.queue and instance.queue[0] is clip:
+                        instance.advance()
+                    continue
+
+                self.refresh_panel(instance, channel)
+
+                # actually play audio
+                # the after callback is called from discord.py's audio thread, so it has to hand the event back to the event loop thread-safely
+                # GuildPlayer.track_finished() moves the queue along (unless looping is on), so it still happens if this player is cancelled by a reload
+                self.logger.info(f'[VoiceCommands.play_queue] playing {clip.title}...')
+                if clip.type == AudioType.YOUTUBE:
+                    self.audio_cache.played(clip.video_url)
+                if ffmpeg_manager.is_full():
+                    scheduler.notify(channel, ':hourglass: Lots of people are listening to stuff right now. Your audio will start in a sec.')
+                audio = None
+                try:
+                    audio = await self.get_audio_object(clip, source, guild_id)
+                    if not instance.is_connected():
+                        audio.cleanup()     # left voice while waiting for ffmpeg
+                        break
+                    instance.track_done = Event()
+                    instance.voice.play(audio, after=lambda error: loop.call_soon_threadsafe(instance.track_finished))
+                except Exception as error:
+                    # ex. ffmpeg couldn't be started or discord.py refused the audio. skip it instead of leaving the bot stuck in voice doing nothing
+                    self.logger.info(f'[VoiceCommands.play_queue] could not play {clip.title}: {error}')
+                    if audio:
+                        audio.cleanup()
+                    scheduler.notify(channel, f':no_entry_sign: Could not play **{clip.title}**. Skipping it.')
+                    if instance.queue and instance.queue[0] is clip:
+                        instance.advance()
+                    continue
+                if clip.gain is None and isinstance(audio, ManagedAudio):
+                    # measure it in the background so it won't need live loudnorm next time
+                    before_options = ('-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5') if source.startswith('http') else ()
+                    self.loudness.analyze(self.loudness_key(clip, source), source, clip.duration, before_options)
+                create_task(self.prepare_upcoming(guild_id))
+                await instance.track_done.wait()
+                if self.INTER_TRACK_GAP:
+                    await sleep(self.INTER_TRACK_GAP)
+
+            if instance.panel:
+                await instance.panel.close()
+                instance.panel = None
+            if not (instance.queue and instance.is_connected()):
+                break
+            # something was queued while the panel was being closed. this player still looked alive so join_and_play() left it for this one to play
+
+        if not self.bot.is_closed():
+            instance.voice_channel_id = None    # the session is over, so there's nothing to resume after a restart
+        if instance.is_connected():
+            await instance.voice.disconnect()
+
+
+
+    async def join_and_play(self, ctx, clip: Clip):
         '''
         Does all the preparations needed to start playing audio.
         1. Determines if the bot should even play audio (ie. if the command is legal)
@@ -187,45 +497,56 @@ class VoiceCommands(commands.Cog):
             the invoker is in the same voice channel)
         2. Joins a voice channel if the bot isn't already in one
         3. Adds a clip to the queue
-        4. Displays confirmation message to chat if adding to queue (ie. not the first video to be played)
-        5. Starts playing clips if the bot isn't already doing so
+        4. Updates the "Now Playing" panel if adding to queue (ie. not the first video to be played)
+        5. Starts the player task if the bot isn't already playing (or if it stopped without leaving)
 
         Args:
-            clip_data (dict): see self.instances for dict format
+            clip (Player.Clip)
 
         Note:
             NOT A COMMAND
         '''
-        voice = self.instances[ctx.guild.id]['voice']
-        if voice and voice.is_connected():
-            if voice.channel == ctx.message.author.voice.channel:
-                # if the bot is already playing audio and the user invoking the command is in the same voice channel, add to queue but don't call self.play_next()
+        instance = self.get_instance(ctx.guild.id)
+        if instance.is_connected():
+            if instance.voice.channel == ctx.message.author.voice.channel:
+                # if the bot is already playing audio and the user invoking the command is in the same voice channel, add to queue and let the running player get to it
                 self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] bot is already in the voice channel')
-                self.instances[ctx.guild.id]['queue'].append(clip_data)
-
-                # pretty output using embed
-                pretty_data = Embed()
-                pretty_data.title = clip_data['title']
-                pretty_data.color = Color.green()
-                pretty_data.set_author(name='Added to Queue', icon_url='https://i.imgur.com/zRn90U1.png')
-                pretty_data.set_footer(text=f'To undo, use "gay queue remove last" or "gay queue remove {len(self.instances[ctx.guild.id]["queue"])-1}"')
-                if clip_data['type'] == AudioType.YOUTUBE:
-                    pretty_data.url = clip_data['video_url']
-                    pretty_data.description = f'Length: {clip_data["duration"]//60}m {clip_data["duration"]%60}s'
-                    pretty_data.set_thumbnail(url=clip_data['thumbnail_url'])
-                else:
-                    # if this is a soundboard clip
-                    pretty_data.description = 'Length: This is a soundboard clip and I\'m too lazy to code in the length. It should be over soon anyways.'
-                await ctx.send(embed=pretty_data)
+                instance.add(clip)
+                if not instance.player or instance.player.done():
+                    # the player died (ex. an error nobody saw coming) while the bot stayed in voice. without this nothing would ever play again
+                    instance.player = create_task(self.play_queue(ctx.guild.id))
+                create_task(self.prepare_upcoming(ctx.guild.id))
+                self.refresh_panel(instance)
             else:
                 # if the bot is already playing audio and the user invoking the command is NOT in the same voice channel, throw and error
                 raise UserNotInSameVoiceChannel
         else:
             # if the bot isn't playing audio and the user invoking the command is in any voice channel, join the channel and start playing
             self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] joining channel {ctx.message.author.voice.channel}')
-            self.instances[ctx.guild.id]['queue'].append(clip_data)
-            self.instances[ctx.guild.id]['voice'] = await ctx.message.author.voice.channel.connect()
-            await self.play_next(ctx)
+            instance.add(clip)
+            instance.text_channel = ctx.channel
+            instance.voice_channel_id = ctx.message.author.voice.channel.id
+            instance.voice = await ctx.message.author.voice.channel.connect()
+            instance.player = create_task(self.play_queue(ctx.guild.id))
+
+
+
+    def refresh_panel(self, instance: GuildPlayer, channel=None):
+        '''
+        Updates a guild's "Now Playing" panel in the background (see Panel.PlayerPanel), creating it if something just started playing.
+        Queue changes while nothing is playing don't create one.
+
+        Args:
+            channel (discord.abc.Messageable, optional): where the panel goes if it has to be created
+
+        Note:
+            NOT A COMMAND
+        '''
+        if not instance.panel:
+            if channel is None:
+                return
+            instance.panel = PlayerPanel(instance, channel)
+        instance.panel.refresh()
 
 
 
@@ -237,9 +558,10 @@ class VoiceCommands(commands.Cog):
         '''
         Skips the currently playing audio clip if there is one
         '''
-        self.instances[ctx.guild.id]['voice'].stop()
-        if self.instances[ctx.guild.id]['loop_audio']:
-            self.instances[ctx.guild.id]['queue'].pop(0)
+        instance = self.get_instance(ctx.guild.id)
+        instance.voice.stop()
+        if instance.loop_audio:
+            instance.advance()
 
 
 
@@ -251,19 +573,21 @@ class VoiceCommands(commands.Cog):
         Note:
             You can still use commands like skip to move on to the next clip while keeping loop enabled.
         '''
-        if self.instances[ctx.guild.id]['voice'] and self.instances[ctx.guild.id]['voice'].is_connected(): # if the bot is in a voice channel
+        instance = self.get_instance(ctx.guild.id)
+        if instance.is_connected(): # if the bot is in a voice channel
             if not ctx.message.author.voice:
                 raise UserNotInVoiceChannel
 
-            if ctx.message.author.voice.channel != self.instances[ctx.guild.id]['voice'].channel:
+            if ctx.message.author.voice.channel != instance.voice.channel:
                 raise UserNotInSameVoiceChannel
 
-        if not self.instances[ctx.guild.id]['loop_audio']:
+        if not instance.loop_audio:
             await ctx.send(':repeat_one: Looping is now enabled :repeat_one:')
-            self.instances[ctx.guild.id]['loop_audio'] = True
+            instance.loop_audio = True
         else:
             await ctx.send('Looping is now **disabled**')
-            self.instances[ctx.guild.id]['loop_audio'] = False
+            instance.loop_audio = False
+        self.refresh_panel(instance)
 
 
 
@@ -272,7 +596,7 @@ class VoiceCommands(commands.Cog):
         '''
         Shows whether or not audio looping is enabled
         '''
-        if self.instances[ctx.guild.id]['loop_audio']:
+        if self.get_instance(ctx.guild.id).loop_audio:
             await ctx.send(':repeat_one: Looping is enabled :repeat_one:')
         else:
             await ctx.send('Looping is **disabled**')
@@ -280,35 +604,42 @@ class VoiceCommands(commands.Cog):
 
 
     @commands.group(name='queue', aliases=['q'], case_insensitive=True, invoke_without_command=True)
-    async def queue(self, ctx):
+    async def queue(self, ctx, page=1):
         '''
         Really just a command group so self.check_queue and self.clear_queue are more intuitive in their invocations
         In the event that this is called, default to self.check_queue
         '''
-        await self.check_queue(ctx)
+        await self.check_queue(ctx, page)
 
 
 
     @queue.command(name='check', aliases=['list', 'ls', 'show'])
-    async def check_queue(self, ctx):
+    async def check_queue(self, ctx, page=1):
         '''
-        Shows all items in the clip queue
+        Shows the items in the clip queue, one page at a time so that long queues still fit in an embed
+
+        Args:
+            page (int, optional): defaults to the first page
 
         Note:
             Is part of a group so is invoked similarly to 'queue check'
         '''
+        instance = self.get_instance(ctx.guild.id)
+        try:
+            page = int(page)
+        except ValueError:
+            raise NotInteger
+        page_count = instance.page_count(self.QUEUE_PAGE_SIZE)
+        page = max(1, min(page, page_count))
+
         # pretty output using embed
-        queue_list = list()
         pretty_data = Embed()
         pretty_data.color = Color.green()
         pretty_data.set_author(name='Queue', icon_url='https://i.imgur.com/1P4LiHx.png')
-        for clip_data in self.instances[ctx.guild.id]['queue']:
-            title = f'[{clip_data["title"]}]({clip_data["video_url"]})' if clip_data['type'] == AudioType.YOUTUBE else clip_data["title"]
-            line = f'`#{self.instances[ctx.guild.id]["queue"].index(clip_data)}:` {title}'
-            queue_list.append(line)
+        queue_list = [f'`#{index}:` {clip.link}' for index, clip in instance.page(page-1, self.QUEUE_PAGE_SIZE)]
         if queue_list:
             pretty_data.description = '\n'.join(queue_list)
-            pretty_data.set_footer(text=f'To remove something, use "gay queue remove <index>"')
+            pretty_data.set_footer(text=f'Page {page}/{page_count} ({len(instance.queue)} items) | To remove something, use "gay queue remove <index>"')
         else:
             pretty_data.description = 'There are no items in the queue.'
             pretty_data.set_footer(text='To add something to the queue, use "gay play <video>" or "gay soundboard <clip>"')
@@ -327,7 +658,30 @@ class VoiceCommands(commands.Cog):
         Note:
             Is part of a group so is invoked similarly to 'queue clear'
         '''
-        self.instances[ctx.guild.id]['queue'] = list()
+        instance = self.get_instance(ctx.guild.id)
+        instance.clear()
+        self.refresh_panel(instance)
+
+
+
+    def parse_index(self, index: str) -> int:
+        '''
+        Converts a user given queue index to an int
+
+        Args:
+            index (str): a number or 'first', 'next', 'last', or 'end'. 'first' and 'next' mean the clip after the one that's playing
+
+        Raises:
+            NotInteger
+        '''
+        if index.lower() in ['first', 'next']:
+            return 1
+        elif index.lower() in ['last', 'end']:
+            return -1
+        try:
+            return int(index)
+        except ValueError:
+            raise NotInteger
 
 
 
@@ -346,17 +700,56 @@ class VoiceCommands(commands.Cog):
         Note:
             Is part of a group so is invoked similarly to 'queue remove'
         '''
-        if index.lower() in ['first', 'next']:
-            index = 0
-        elif index.lower() in ['last', 'end']:
-            index = -1
+        instance = self.get_instance(ctx.guild.id)
         try:
-            index = int(index)
-            self.instances[ctx.guild.id]['queue'].pop(index)
-        except ValueError:
-            raise NotInteger
+            instance.remove(self.parse_index(index))
         except IndexError:
             raise NotInQueue
+        self.refresh_panel(instance)
+
+
+
+    @is_user_in_same_VC()
+    @is_bot_in_VC()
+    @is_user_in_VC()
+    @queue.command(name='move', aliases=['mv'])
+    async def move_in_queue(self, ctx, old_index, new_index):
+        '''
+        Moves one item in the clip queue to a different spot
+
+        Args:
+            old_index (int or str): the index of the clip to be moved
+            new_index (int or str): where it should end up
+                both can also be 'first', 'next', 'last', or 'end'
+
+        Note:
+            Is part of a group so is invoked similarly to 'queue move 5 1'
+        '''
+        instance = self.get_instance(ctx.guild.id)
+        try:
+            clip = instance.move(self.parse_index(old_index), self.parse_index(new_index))
+        except IndexError:
+            raise NotInQueue
+        self.refresh_panel(instance)
+        await ctx.send(f'Moved **{clip.title}**')
+
+
+
+    @is_user_in_same_VC()
+    @is_bot_in_VC()
+    @is_user_in_VC()
+    @queue.command(name='shuffle', aliases=['mix'])
+    async def shuffle_queue(self, ctx):
+        '''
+        Shuffles everything in the clip queue except for what's currently playing
+
+        Note:
+            Is part of a group so is invoked similarly to 'queue shuffle'
+        '''
+        instance = self.get_instance(ctx.guild.id)
+        instance.shuffle()
+        self.refresh_panel(instance)
+        await ctx.send(':twisted_rightwards_arrows: Shuffled the queue :twisted_rightwards_arrows:')
 
 
 
@@ -368,9 +761,10 @@ class VoiceCommands(commands.Cog):
         '''
         Stops playing audio and disconnects from the voice channel
         '''
-        self.instances[ctx.guild.id]['voice'].stop()
-        self.instances[ctx.guild.id]['queue'] = list()
-        await self.instances[ctx.guild.id]['voice'].disconnect()
+        instance = self.get_instance(ctx.guild.id)
+        instance.voice.stop()
+        instance.clear()
+        await instance.voice.disconnect()
 
 
 
@@ -381,11 +775,18 @@ class VoiceCommands(commands.Cog):
         Note:
             NOT A COMMAND
         '''
-        for guild in self.instances:
-            voice = self.instances[guild]['voice']
-            if voice:
-                voice.stop()
-                await voice.disconnect()
+        for instance in self.instances.values():
+            if instance.player:
+                instance.player.cancel()
+        # saved before disconnecting so every session gets resumed once the bot is back up.
+        # no more saving after this since stopping the audio below moves every queue along as if its clip had finished
+        self.save_sessions.cancel()
+        await session_store.flush(self.instances)
+        self.killed = True
+        for instance in self.instances.values():
+            if instance.voice:
+                instance.voice.stop()
+                await instance.voice.disconnect()
 
 
 
@@ -393,6 +794,20 @@ class VoiceCommands(commands.Cog):
 # SOUNDBOARD FUNCTIONS
 ####################################################################################################################################
 
+    def soundboard_clip(self, clip: dict) -> Clip:
+        '''
+        Converts a soundboard catalog entry into a queue item
+
+        Args:
+            clip (dict): see Soundboard.SoundboardCatalog.clips
+
+        Returns:
+            clip (Player.Clip)
+        '''
+        return Clip(AudioType.SOUNDBOARD, f'{clip["name"]} (soundboard)', source=clip['path'], duration=clip['duration'])
+
+
+
     @is_user_in_VC()
     @commands.group(aliases=['sb', 'clip'], case_insensitive=True, invoke_without_command=True)
     async def soundboard(self, ctx, *search_term):
@@ -404,23 +819,18 @@ class VoiceCommands(commands.Cog):
         '''
         search_term = ' '.join(search_term)
 
-        # using fuzzywuzzy, choose the soundboard clip that best matches the search terms
-        best_clip = ''
-        best_confidence = 0
-        for clip in listdir('soundboard/'):
-            fixed_clip = clip[:-4]
-            confidence = fuzz.token_set_ratio(search_term, fixed_clip)
-            if confidence > best_confidence:
-                best_confidence = confidence
-                best_clip = clip
+        # choose the soundboard clip that best matches the search terms
+        matches = self.soundboard_matcher.match(search_term, k=self.SOUNDBOARD_SUGGESTIONS+1)
+        if not matches:
+            raise SoundboardClipNotFound
+        best_clip, best_confidence = matches[0]
+        if best_confidence < self.SOUNDBOARD_CONFIDENT and len(matches) > 1:
+            suggestions = ', '.join(f'`{clip["name"]}`' for clip, _ in matches[1:])
+            await ctx.send(f'Playing `{best_clip["name"]}`. Did you mean: {suggestions}?')
 
-        data = {
-            'type': AudioType.SOUNDBOARD,
-            'source': f'soundboard/{best_clip}',
-            'title': f'{best_clip[:-4]} (soundboard)'
-        }
-        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] got soundboard clip: {data["title"]}')
-        await self.join_and_play(ctx, data)
+        clip = self.soundboard_clip(best_clip)
+        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] got soundboard clip: {clip.title}')
+        await self.join_and_play(ctx, clip)
 
 
 
@@ -433,15 +843,37 @@ class VoiceCommands(commands.Cog):
         Note:
             Is part of a group so is invoked similarly to 'gay soundboard random'
         '''
-        all_clips = listdir('soundboard/')
-        filename = choice(all_clips)
-        data = {
-            'type': AudioType.SOUNDBOARD,
-            'source': f'soundboard/{filename}',
-            'title': f'{filename[:-4]} (soundboard)'
-        }
-        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] got soundboard clip: {data["title"]}')
-        await self.join_and_play(ctx, data)
+        random_clip = self.soundboard_catalog.random()
+        if not random_clip:
+            raise SoundboardClipNotFound
+        clip = self.soundboard_clip(random_clip)
+        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] got soundboard clip: {clip.title}')
+        await self.join_and_play(ctx, clip)
+
+
+
+    @soundboard.command(name='search', aliases=['find', 'lookup'])
+    async def search_soundboard(self, ctx, *search_term):
+        '''
+        Shows the soundboard clips that best match the search terms without playing anything
+
+        Args:
+            search_term (tuple[str])
+
+        Note:
+            Is part of a group so is invoked similarly to 'gay soundboard search <clip>'
+        '''
+        matches = self.soundboard_matcher.match(' '.join(search_term), k=10)
+        if not matches:
+            raise SoundboardClipNotFound
+
+        # pretty output using embed
+        pretty_data = Embed()
+        pretty_data.color = Color.green()
+        pretty_data.set_author(name='Soundboard Search', icon_url='https://i.imgur.com/1P4LiHx.png')
+        pretty_data.description = '\n'.join(f'`{score}%` {clip["name"]}' for clip, score in matches)
+        pretty_data.set_footer(text=f'To play a soundboard clip, use "gay soundboard <clip>"')
+        await ctx.send(embed=pretty_data)
 
 
 
@@ -457,8 +889,7 @@ class VoiceCommands(commands.Cog):
         pretty_data = Embed()
         pretty_data.color = Color.green()
         pretty_data.set_author(name=':information_source: Soundboard Clips', icon_url='https://i.imgur.com/1P4LiHx.png')
-        clip_list = listdir('soundboard/')
-        pretty_data.description = '\n'.join(clip_list)
+        pretty_data.description = '\n'.join(self.soundboard_catalog.names)
         pretty_data.set_footer(text=f'To play a soundboard clip, use "gay soundboard <clip>"')
         await ctx.send(embed=pretty_data)
 
@@ -472,7 +903,8 @@ class VoiceCommands(commands.Cog):
     @commands.command(name='play', aliases=['yt', 'youtube', 'music'])
     async def search_youtube(self, ctx, *search_term):
         '''
-        Searches youtube and selects the top-most video to play
+        Searches youtube and selects the top-most video to play.
+        Playlist links add the whole playlist (up to Youtube.YoutubeExtractor.MAX_PLAYLIST videos).
 
         Args:
             search_term (tuple[str])
@@ -481,20 +913,94 @@ class VoiceCommands(commands.Cog):
             A cookiefile saved as 'cookies.txt' is required to play sensitive videos
         '''
         search_term = ' '.join(search_term)
-        yt_options = {'verbose': 'False', 'format': 'bestaudio', 'noplaylist': 'True', 'cookiefile': 'cookies.txt'}
-        with YoutubeDL(yt_options) as ytdl:
-            if search_term.startswith('http'):
-                info = ytdl.extract_info(search_term, download=False)
-            else:
-                info = ytdl.extract_info(f'ytsearch:{search_term}', download=False)['entries'][0]
-        url = info['url']
-        data = {
-            'type': AudioType.YOUTUBE,
-            'source': url,
-            'title': info['title'],
-            'duration': info['duration'],           # in seconds
-            'thumbnail_url': info['thumbnail'],
-            'video_url': info['webpage_url']        # youtube webpage
-        }
-        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] got youtube audio: {data["title"]} | {data["video_url"]}')
-        await self.join_and_play(ctx, data)
\ No newline at end of file
+        if self.extractor.is_playlist(search_term):
+            await self.track_search(ctx, self.queue_playlist(ctx, search_term))
+            return
+        info = await self.track_search(ctx, self.extractor.search(search_term))
+        clip = self.youtube_clip(info)
+        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] got youtube audio: {clip.title} | {clip.video_url}')
+        await self.join_and_play(ctx, clip)
+
+
+
+    async def track_search(self, ctx, search):
+        '''
+        Runs a search as its own task that gets cancelled if the user leaves voice (see self.on_voice_state_update())
+
+        Args:
+            search (coroutine)
+
+        Raises:
+            SearchCancelled: if the user left voice before it finished
+
+        Note:
+            NOT A COMMAND
+        '''
+        key = (ctx.guild.id, ctx.author.id)
+        search = create_task(search)
+        self.pending_searches.setdefault(key, set()).add(search)
+        try:
+            return await search
+        except CancelledError:
+            if not search.cancelled():
+                raise   # the command itself was cancelled, not just the search
+            raise SearchCancelled
+        finally:
+            self.pending_searches.get(key, set()).discard(search)
+            if not self.pending_searches.get(key, True):
+                del self.pending_searches[key]
+
+
+
+    def youtube_clip(self, info: dict) -> Clip:
+        '''
+        Converts the result of a youtube search (or one playlist entry) into a queue item
+
+        Args:
+            info (dict): see Youtube.YoutubeExtractor.search() and Youtube.YoutubeExtractor.flat_entry()
+
+        Returns:
+            clip (Player.Clip)
+        '''
+        return Clip(AudioType.YOUTUBE, info['title'], duration=info['duration'], thumbnail_url=info['thumbnail'], video_url=info['webpage_url'])
+
+
+
+    async def queue_playlist(self, ctx, url: str):
+        '''
+        Adds a whole playlist to the queue as it's being listed, so the first video starts playing as soon as it's found instead of after the whole playlist.
+        Only titles and links are known at this point. Each video is resolved by self.prepare_upcoming() once it gets close to the front of the queue.
+        Listing stops early if the session it was started for ends (ex. stop, queue clear, or the bot left voice) so it can't refill the queue or rejoin on its own.
+
+        Args:
+            url (str): see Youtube.YoutubeExtractor.is_playlist()
+
+        Note:
+            NOT A COMMAND
+        '''
+        playlist_title = None
+        added = 0
+        instance = self.get_instance(ctx.guild.id)
+        generation = instance.generation
+        batches = self.extractor.playlist(url)
+        try:
+            async for playlist_title, entries in batches:
+                if instance.generation != generation or self.instances.get(ctx.guild.id) is not instance or (added and not instance.is_connected()):
+                    self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] stopped listing playlist {playlist_title} after {added} videos since its session ended | {url}')
+                    await ctx.send(f'Stopped adding videos from **{playlist_title}** after **{added}**')
+                    return
+                clips = [self.youtube_clip(entry) for entry in entries]
+                if not (instance.player and not instance.player.done()):
+                    # either this is the first video or the player already got through everything before the rest of the playlist showed up
+                    await self.join_and_play(ctx, clips.pop(0))
+                for clip in clips:
+                    instance.add(clip)
+                added += len(entries)
+                create_task(self.prepare_upcoming(ctx.guild.id))
+                self.refresh_panel(instance)
+        finally:
+            await batches.aclose()  # right away instead of whenever it's garbage collected, so the listing thread stops paging
+        if not added:
+            raise PlaylistEmpty
+        self.logger.info(f'[{ctx.command.module}.{ctx.command.name}] queued {added} videos from playlist {playlist_title} | {url}')
+        await ctx.send(f'Added **{added}** videos from **{playlist_title}** to the queue')
\ No newline at end of file
@@ -0,0 +1,494 @@
+# standard libraries
+from asyncio import Queue, Semaphore, TimeoutError, create_task, get_running_loop, shield, wait_for
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+from threading import Event
+import time
+from urllib.parse import parse_qs, urlparse
+
+# dependencies
+from yt_dlp import YoutubeDL
+
+# local modules
+from Exceptions import SearchTimedOut
+
+
+
+class SearchCache:
+    '''
+    LRU cache of youtube lookups that persists across restarts.
+    Metadata (title, duration, etc.) basically never changes, so it's kept until it gets evicted.
+    Stream urls are signed by youtube and stop working after their 'expire' time, so they're kept separately and thrown out once stale.
+    Saving is write-behind: lookups only mark the cache as dirty, and VoiceCommands.save_search_cache() calls self.flush() every FLUSH_INTERVAL seconds.
+
+    Attributes:
+        CACHE_FILE (str): where the cache is saved to
+        FLUSH_INTERVAL (int): seconds between saves. also the most that a crash can lose
+        MAX_ENTRIES (int): max amount of videos (and separately, search terms) to remember
+        EXPIRY_MARGIN (int): seconds before a stream url's real expiry time that it's treated as stale
+            gives the stream enough time to actually be played before youtube stops honoring it
+        searches (OrderedDict): search terms or pasted urls mapped to their video's webpage url
+            {
+                search_term (str): webpage_url (str)
+            }
+        videos (OrderedDict): video metadata
+            {
+                webpage_url (str): {
+                    'title': str,
+                    'duration': int,        # seconds
+                    'thumbnail': str,
+                    'webpage_url': str
+                }
+            }
+        streams (dict): signed stream urls
+            {
+                webpage_url (str): {
+                    'url': str,
+                    'expire': int,          # unix timestamp
+                    'acodec': str           # the stream's audio codec, ex. 'opus'
+                }
+            }
+        hits (int): lookups that didn't need youtube at all
+        partial_hits (int): lookups where only the stream url needed refreshing
+        misses (int): lookups that needed a full search
+        dirty (bool): whether anything was added since the last save
+        executor (concurrent.futures.ThreadPoolExecutor): one thread, so saves always land in the order they were made and never hold up an extraction
+    '''
+    CACHE_FILE = 'youtube_cache.json'
+    FLUSH_INTERVAL = 60
+    MAX_ENTRIES = 5000
+    EXPIRY_MARGIN = 30 * 60
+    METADATA_KEYS = ('title', 'duration', 'thumbnail', 'webpage_url')
+
+    def __init__(self, cache_file: str = CACHE_FILE, max_entries: int = MAX_ENTRIES):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.searches = OrderedDict()
+        self.videos = OrderedDict()
+        self.streams = dict()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='youtube-cache')
+        self.logger = logging.getLogger('discord')
+        self.load()
+
+
+
+    @staticmethod
+    def normalize(search_term: str) -> str:
+        '''
+        Folds case and whitespace of search terms so 'Never  gonna' and 'never gonna' share a cache entry.
+        Urls are only stripped since youtube's video and playlist ids are case sensitive.
+        '''
+        if search_term.strip().startswith('http'):
+            return search_term.strip()
+        return ' '.join(search_term.lower().split())
+
+
+
+    @staticmethod
+    def get_expiry(stream_url: str) -> int:
+        '''
+        Youtube embeds the expiry time of signed urls in the 'expire' query parameter.
+        If it's not there, assume the url is only good for the next hour or so.
+        '''
+        try:
+            return int(parse_qs(urlparse(stream_url).query)['expire'][0])
+        except (KeyError, IndexError, ValueError):
+            return int(time.time()) + 3600
+
+
+
+    def _touch(self, cache: OrderedDict, key, value=None):
+        '''
+        Moves a key to the front of the LRU order (inserting it if a value is given) and evicts the oldest entries if needed.
+        An evicted video takes its stream url with it. Evicted search terms don't since streams are keyed by webpage url.
+        '''
+        if value is not None:
+            cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_entries:
+            evicted, _ = cache.popitem(last=False)
+            if cache is self.videos:
+                self.streams.pop(evicted, None)
+
+
+
+    def get_video(self, search_term: str) -> dict:
+        '''
+        Returns:
+            metadata (dict or None): see self.videos
+        '''
+        webpage_url = self.searches.get(self.normalize(search_term))
+        if webpage_url not in self.videos:
+            return None
+        self._touch(self.searches, self.normalize(search_term))
+        self._touch(self.videos, webpage_url)
+        return self.videos[webpage_url]
+
+
+
+    def get_stream(self, webpage_url: str) -> dict:
+        '''
+        Returns:
+            stream (dict or None): see self.streams. None if it isn't cached or is about to expire
+        '''
+        stream = self.streams.get(webpage_url)
+        if not stream:
+            return None
+        if stream['expire'] - self.EXPIRY_MARGIN < time.time():
+            del self.streams[webpage_url]
+            return None
+        return stream
+
+
+
+    def add(self, search_term: str, info: dict):
+        '''
+        Remembers a fresh yt-dlp extraction
+
+        Args:
+            search_term (str): what the user searched for
+            info (dict): yt-dlp's info dict
+        '''
+        webpage_url = info['webpage_url']
+        self._touch(self.videos, webpage_url, {key: info.get(key) for key in self.METADATA_KEYS})
+        self._touch(self.searches, self.normalize(search_term), webpage_url)
+        self._touch(self.searches, self.normalize(webpage_url), webpage_url)
+        self.streams[webpage_url] = {'url': info['url'], 'expire': self.get_expiry(info['url']), 'acodec': info.get('acodec')}
+        self.dirty = True
+
+
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'partial_hits': self.partial_hits,
+            'misses': self.misses,
+            'videos': len(self.videos),
+            'searches': len(self.searches),
+            'streams': len(self.streams)
+        }
+
+
+
+    def load(self):
+        '''
+        Loads the cache from self.cache_file, dropping any stream urls that expired while the bot was off
+        '''
+        try:
+            with open(self.cache_file, 'r') as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self.searches = OrderedDict(data.get('searches', []))
+        self.videos = OrderedDict(data.get('videos', []))
+        self.streams = {url: stream for url, stream in data.get('streams', {}).items() if stream['expire'] - self.EXPIRY_MARGIN > time.time()}
+        self.logger.info(f'[Youtube.load] loaded {len(self.videos)} cached videos and {len(self.streams)} stream urls')
+
+
+
+    def snapshot(self) -> dict:
+        '''
+        Copies the cache so it can be saved from another thread while the event loop keeps changing it
+        '''
+        return {
+            'searches': list(self.searches.items()),
+            'videos': list(self.videos.items()),
+            'streams': dict(self.streams)
+        }
+
+
+
+    async def flush(self):
+        '''
+        Saves the cache if anything was added since the last save
+        '''
+        if self.dirty:
+            self.dirty = False
+            await get_running_loop().run_in_executor(self.executor, self.save, self.snapshot())
+
+
+
+    def save(self, snapshot: dict):
+        '''
+        Atomically writes a snapshot to self.cache_file so a crash mid-write can't corrupt it.
+        This is blocking so it should be run in self.executor.
+        '''
+        temp_file = f'{self.cache_file}.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump(snapshot, file, separators=(',', ':'))
+        os.replace(temp_file, self.cache_file)
+
+
+
+    def shutdown(self):
+        '''
+        Saves whatever hasn't been saved yet. The write happens after any save that's already queued, without blocking the event loop.
+        '''
+        if self.dirty:
+            self.dirty = False
+            self.executor.submit(self.save, self.snapshot())
+        self.executor.shutdown(wait=False)
+
+
+
+class YoutubeExtractor:
+    '''
+    Runs yt-dlp extractions on a bounded thread pool.
+    YoutubeDL.extract_info() is a blocking call that can take several seconds, so running it directly inside a command
+    freezes the event loop (and with it every other guild, the gateway heartbeat, and all the other commands).
+
+    Attributes:
+        MAX_WORKERS (int): default amount of extractions that can run at the same time
+        TIMEOUT (int): default amount of seconds an extraction is allowed to take before giving up
+        MAX_PLAYLIST (int): max amount of videos that are taken from a playlist
+        MAX_LISTINGS (int): amount of playlists that can be listed at the same time. more wait their turn
+        PLAYLIST_BATCH (int): how many playlist entries are handed over at a time
+        YT_OPTIONS (dict): options sent to yt-dlp
+        PLAYLIST_OPTIONS (dict): options sent to yt-dlp when listing a playlist
+        executor (concurrent.futures.ThreadPoolExecutor): the worker pool that extractions run on
+        playlist_executor (concurrent.futures.ThreadPoolExecutor): where playlists are listed. paging through one can take minutes,
+            so listings get their own threads instead of starving searches and the look-ahead resolver
+        listings (asyncio.Semaphore): a free thread in self.playlist_executor
+        timeout (int)
+        cache (SearchCache): not shut down along with the extractor since it can outlive it (see VoiceCommands.search_cache)
+        in_flight (dict): lookups that are currently running so that the same lookup isn't run twice at the same time
+            {
+                normalized search term (str): asyncio.Task
+            }
+    '''
+    MAX_WORKERS = 4
+    TIMEOUT = 30
+    MAX_PLAYLIST = 1000
+    MAX_LISTINGS = 2
+    PLAYLIST_BATCH = 25
+    YT_OPTIONS = {'verbose': False, 'quiet': True, 'format': 'bestaudio', 'noplaylist': True, 'cookiefile': 'cookies.txt'}
+    PLAYLIST_OPTIONS = {**YT_OPTIONS, 'noplaylist': False, 'extract_flat': 'in_playlist'}
+
+    def __init__(self, max_workers: int = MAX_WORKERS, timeout: int = TIMEOUT, cache: SearchCache = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='yt-dlp')
+        self.playlist_executor = ThreadPoolExecutor(max_workers=self.MAX_LISTINGS, thread_name_prefix='yt-dlp-playlist')
+        self.listings = Semaphore(self.MAX_LISTINGS)
+        self.timeout = timeout
+        self.cache = cache or SearchCache()
+        self.in_flight = dict()
+        self.logger = logging.getLogger('discord')
+
+
+
+    def _extract(self, search_term: str) -> dict:
+        '''
+        The actual blocking extraction. Only ever called from inside self.executor
+
+        Args:
+            search_term (str): either a url or search terms
+
+        Returns:
+            info (dict): yt-dlp's info dict for the top-most result
+        '''
+        with YoutubeDL(self.YT_OPTIONS) as ytdl:
+            if search_term.startswith('http'):
+                return ytdl.extract_info(search_term, download=False)
+            return ytdl.extract_info(f'ytsearch:{search_term}', download=False)['entries'][0]
+
+
+
+    async def _run(self, search_term: str) -> dict:
+        '''
+        Runs self._extract() in self.executor without blocking the event loop
+
+        Raises:
+            SearchTimedOut: if the extraction took longer than self.timeout
+
+        Note:
+            Cancelling the awaiting task stops waiting immediately, but the worker thread still runs the extraction to completion
+            since threads can't be interrupted. The result is just thrown away.
+        '''
+        future = get_running_loop().run_in_executor(self.executor, self._extract, search_term)
+        try:
+            return await wait_for(future, self.timeout)
+        except TimeoutError:
+            self.logger.info(f'[Youtube.search] extraction timed out for: {search_term}')
+            raise SearchTimedOut
+
+
+
+    async def search(self, search_term: str) -> dict:
+        '''
+        Finds a video's info. If the same lookup is already running (ex. the look-ahead resolver is preparing the clip that's about to play),
+        this waits on that one instead of starting another.
+
+        Args:
+            search_term (str): either a url or search terms
+
+        Returns:
+            info (dict): see self._search()
+        '''
+        key = self.cache.normalize(search_term)
+        if key not in self.in_flight:
+            task = create_task(self._search(search_term))
+            task.add_done_callback(lambda task: self._forget(key, task))
+            self.in_flight[key] = task
+        return await shield(self.in_flight[key])    # shielded so that one caller being cancelled doesn't cancel it for everyone else
+
+
+
+    def _forget(self, key: str, task):
+        self.in_flight.pop(key, None)
+        if not task.cancelled():
+            task.exception()    # marks the exception as retrieved in case every caller was cancelled
+
+
+
+    async def _search(self, search_term: str) -> dict:
+        '''
+        Finds a video's info, going to youtube only for whatever isn't already cached
+            1. metadata and a fresh stream url are cached: no network at all
+            2. only the metadata is cached: re-extract just that video to get a new stream url (skips the ytsearch)
+            3. nothing is cached: full search
+
+        Args:
+            search_term (str): either a url or search terms
+
+        Returns:
+            info (dict): has at least 'url', 'acodec', 'title', 'duration', 'thumbnail', and 'webpage_url'
+        '''
+        video = self.cache.get_video(search_term)
+        if video:
+            stream = self.cache.get_stream(video['webpage_url'])
+            if stream:
+                self.cache.hits += 1
+                self.logger.info(f'[Youtube.search] cache hit for: {search_term} | {self.cache.stats()}')
+                return {**video, 'url': stream['url'], 'acodec': stream.get('acodec')}
+            self.cache.partial_hits += 1
+            info = await self._run(video['webpage_url'])
+        else:
+            self.cache.misses += 1
+            info = await self._run(search_term)
+        self.cache.add(search_term, info)
+        self.logger.info(f'[Youtube.search] cache miss for: {search_term} | {self.cache.stats()}')
+        return info
+
+
+
+    @staticmethod
+    def is_playlist(search_term: str) -> bool:
+        '''
+        Playlist links are either youtube.com/playlist?list=... or a bare list without a specific video.
+        Links to a video inside of a playlist (watch?v=...&list=...) only play that video, same as before.
+        '''
+        if not search_term.startswith('http'):
+            return False
+        url = urlparse(search_term)
+        query = parse_qs(url.query)
+        return 'list' in query and (url.path.rstrip('/') == '/playlist' or 'v' not in query)
+
+
+
+    @staticmethod
+    def flat_entry(entry: dict) -> dict:
+        '''
+        Converts one of yt-dlp's flat playlist entries to the same shape that self.search() returns, minus the stream url.
+
+        Returns:
+            metadata (dict or None): None if the entry isn't a playable video (ex. private or deleted videos)
+        '''
+        video_id = entry.get('id')
+        title = entry.get('title') or ''
+        if not video_id or title in ('[Private video]', '[Deleted video]'):
+            return None
+        url = entry.get('url') or ''
+        return {
+            'title': title or video_id,
+            'duration': entry.get('duration'),
+            'thumbnail': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg',
+            'webpage_url': url if url.startswith('http') else f'https://www.youtube.com/watch?v={video_id}'
+        }
+
+
+
+    def _list_playlist(self, url: str, put, stop: Event):
+        '''
+        Lists a playlist without resolving any of its videos. Only ever called from inside self.playlist_executor.
+        process=False makes yt-dlp hand back entries as a generator that fetches the next page of the playlist only when it's needed,
+        so entries are handed over as each page arrives instead of after the whole playlist has been listed.
+
+        Args:
+            put (callable): called with (playlist title (str), list[dict]) for every batch, and then with None when finished or with an Exception
+            stop (threading.Event): set to stop listing early
+        '''
+        try:
+            with YoutubeDL(self.PLAYLIST_OPTIONS) as ytdl:
+                info = ytdl.extract_info(url, download=False, process=False)
+                title = info.get('title') or 'playlist'
+                batch = list()
+                taken = 0
+                for entry in info.get('entries') or []:
+                    if stop.is_set() or taken >= self.MAX_PLAYLIST:
+                        break
+                    entry = self.flat_entry(entry)
+                    if not entry:
+                        continue
+                    batch.append(entry)
+                    taken += 1
+                    if len(batch) >= self.PLAYLIST_BATCH or taken == 1:    # the first entry goes out alone so it can start playing right away
+                        put((title, batch))
+                        batch = list()
+                if batch:
+                    put((title, batch))
+            put(None)
+        except Exception as error:
+            put(error)
+
+
+
+    async def playlist(self, url: str):
+        '''
+        Lists a playlist in the background and yields its videos as they're found.
+        Nothing is resolved here. Each video gets its stream url from self.search() once it's close to being played.
+
+        Args:
+            url (str): see self.is_playlist()
+
+        Yields:
+            (title (str), entries (list[dict])): the playlist's title and the next few videos. see self.flat_entry()
+
+        Raises:
+            SearchTimedOut: if youtube took longer than self.timeout to send the next part of the playlist
+        '''
+        loop = get_running_loop()
+        batches = Queue()
+        stop = Event()
+        await self.listings.acquire()    # waits for other playlists here so the time spent waiting doesn't count towards self.timeout
+        listing = loop.run_in_executor(self.playlist_executor, self._list_playlist, url, lambda item: loop.call_soon_threadsafe(batches.put_nowait, item), stop)
+        listing.add_done_callback(lambda _: self.listings.release())    # once the thread is actually free, not when this stops waiting on it
+        try:
+            while True:
+                try:
+                    item = await wait_for(batches.get(), self.timeout)
+                except TimeoutError:
+                    self.logger.info(f'[Youtube.playlist] listing timed out for: {url}')
+                    raise SearchTimedOut
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()    # lets the worker thread stop paging through the playlist if this was cancelled or stopped early
+
+
+
+    def shutdown(self):
+        '''
+        Stops accepting new extractions and drops the ones that haven't started yet.
+        Used when the cog is unloaded so reloads don't leak thread pools. The cache is left alone.
+        '''
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.playlist_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,28 +1,83 @@
 # standard libraries
 import getopt
+import gzip
 import logging
 import logging.handlers
+import os
+from queue import SimpleQueue
+import shutil
 import sys
+from threading import Thread
 
 # dependencies
 from discord import Game
 from discord import Intents
 from discord.ext import commands
 
+# local modules
+from Cluster import ClusterClient, Supervisor, cluster_path
+from Metrics import get_metrics
+from Outbound import ScheduledContext, scheduler
 
 
-if __name__ == '__main__':
+
+def compress_log(source: str, dest: str):
     '''
-    essentially a main.py file
+    Used as TimedRotatingFileHandler.rotator so rotated logs get gzipped.
+    The rename is instant so logging can carry on right away. The actual compressing happens on its own thread.
     '''
-    # allow the user to input their own login file with cmdline
-    opts, _ = getopt.getopt(sys.argv[1:], "i:")
-    token_file = 'login.token'
+    temp = f'{dest}.tmp'
+    os.replace(source, temp)
+    def compress():
+        with open(temp, 'rb') as uncompressed, gzip.open(dest, 'wb') as compressed:
+            shutil.copyfileobj(uncompressed, compressed)
+        os.remove(temp)
+    Thread(target=compress, name='log-compressor', daemon=True).start()
 
-    for opt, arg in opts:
-        if opt == '-i':
-            token_file = arg
 
+
+def setup_logging(log_file: str = 'discord.log') -> logging.handlers.QueueListener:
+    '''
+    The bot only ever puts records in a queue. Formatting and disk/terminal writes happen on the listener's background thread
+    so that logging every message never blocks the event loop.
+
+    Args:
+        log_file (str, optional): file name inside the logs folder. every cluster gets its own so they don't fight over rotating it
+
+    Returns:
+        log_listener (logging.handlers.QueueListener): already started. stop it before exiting to flush whatever is still in the queue
+    '''
+    logger = logging.getLogger('discord')
+    logger.handlers.clear()    # forked clusters inherit the supervisor's handler, whose queue nothing would ever read from
+    logger.setLevel(logging.INFO)
+    logging.getLogger('discord.http').setLevel(logging.INFO)
+    logging.getLogger('discord.gateway').setLevel(logging.INFO)
+    file_formatter = logging.Formatter('[{asctime}] [{levelname:<8}] {name:<20}: {message}', '%Y-%m-%d %H:%M:%S', style='{')
+    os.makedirs('logs', exist_ok=True)
+    file_handler = logging.handlers.TimedRotatingFileHandler(filename=os.path.join('logs', log_file), when='midnight', delay=True)
+    file_handler.setFormatter(file_formatter)
+    file_handler.namer = lambda name: f'{name}.gz'
+    file_handler.rotator = compress_log
+    stream_formatter = logging.Formatter('[\u001B[38;5;240m{asctime}\u001B[0m] [\u001B[38;5;184m{levelname:<8}\u001B[0m] \u001B[38;5;123m{name:<20}\u001B[0m: {message}\u001B[0m', '%Y-%m-%d %H:%M:%S', style='{') # this one just has colors added to it, but the format should be the same
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(stream_formatter)
+    log_queue = SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    log_listener.start()
+    return log_listener
+
+
+
+def create_bot(bot_class=commands.Bot, **kwargs) -> commands.Bot:
+    '''
+    Args:
+        bot_class (type, optional): commands.Bot or commands.AutoShardedBot
+        **kwargs: passed to bot_class. used for shard_ids and shard_count
+
+    Returns:
+        bot (commands.Bot)
+    '''
     # permissions
     intents = Intents.default()
     intents.emojis = True
@@ -33,36 +88,100 @@ if __name__ == '__main__':
     intents.reactions = True
     intents.voice_states = True
 
-    # logging
     logger = logging.getLogger('discord')
-    logger.setLevel(logging.INFO)
-    logging.getLogger('discord.http').setLevel(logging.INFO)
-    logging.getLogger('discord.gateway').setLevel(logging.INFO)
-    file_formatter = logging.Formatter('[{asctime}] [{levelname:<8}] {name:<20}: {message}', '%Y-%m-%d %H:%M:%S', style='{')
-    file_handler = logging.handlers.TimedRotatingFileHandler(filename='logs\discord.log', when='midnight')
-    file_handler.setFormatter(file_formatter)
-    stream_formatter = logging.Formatter('[\u001B[38;5;240m{asctime}\u001B[0m] [\u001B[38;5;184m{levelname:<8}\u001B[0m] \u001B[38;5;123m{name:<20}\u001B[0m: {message}\u001B[0m', '%Y-%m-%d %H:%M:%S', style='{') # this one just has colors added to it, but the format should be the same
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(stream_formatter)
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    bot = bot_class(command_prefix='gay ', activity=Game(name='gay help'), intents=intents, **kwargs)
+    scheduler.watch_rate_limits()
 
-    # discord bot
-    bot = commands.Bot(command_prefix='gay ', activity=Game(name='gay help'), intents=intents)
+    async def get_context(origin, *, cls=ScheduledContext):
+        return await bot_class.get_context(bot, origin, cls=cls)  # replies go through Outbound.scheduler so they're sent before status reactions
+    bot.get_context = get_context
 
     @bot.event
     async def on_ready():
         await bot.load_extension('GeneralCommands')
         await bot.load_extension('VoiceCommands')
         await bot.load_extension('EventHandler')
+        if hasattr(bot, 'cluster'):
+            bot.cluster.start()
         logger.info(f'logged in as {bot.user.name}')
-        await bot.get_cog('VoiceCommands').init_guilds()
 
 
+    @bot.check_once
+    def start_timer(ctx):
+        get_metrics(bot).command_started(ctx)  # global checks are the first thing to run after a command is parsed out of a message
+        return True
+
     @bot.before_invoke
     async def on_command(ctx):
+        get_metrics(bot).command_invoked(ctx)  # checks and argument parsing are done by the time this is called
         logger.info(f'[{ctx.command.module}.{ctx.command.name}] executing...')
 
+    return bot
+
+
+
+def run_cluster(cluster_id: int, shard_ids: list, shard_count: int, connection, token: str):
+    '''
+    What every cluster process runs (see Cluster.Supervisor)
+
+    Args:
+        cluster_id (int)
+        shard_ids (list[int]): the shards this cluster is responsible for
+        shard_count (int): the total amount of shards across every cluster
+        connection (multiprocessing.connection.Connection): this cluster's end of the pipe to the supervisor
+        token (str)
+    '''
+    log_listener = setup_logging(f'discord-cluster{cluster_id}.log')
+    bot = create_bot(commands.AutoShardedBot, shard_ids=shard_ids, shard_count=shard_count)
+    bot.cluster = ClusterClient(bot, cluster_id, shard_ids, connection)
+    get_metrics(bot).METRICS_FILE = cluster_path(bot, get_metrics(bot).METRICS_FILE)
+    try:
+        bot.run(token, log_handler=None)
+    finally:
+        log_listener.stop()    # flushes whatever is still in the queue
+
+
+
+if __name__ == '__main__':
+    '''
+    essentially a main.py file
+
+    Options:
+        -i <file>: login token file. defaults to login.token
+        -s <shards>: runs an AutoShardedBot with this many shards
+        -c <clusters>: splits the shards across this many processes, restarting any that crash. defaults to one shard per cluster
+    '''
+    # allow the user to input their own login file with cmdline
+    opts, _ = getopt.getopt(sys.argv[1:], "i:s:c:")
+    token_file = 'login.token'
+    shard_count = None
+    cluster_count = 1
+
+    for opt, arg in opts:
+        if opt == '-i':
+            token_file = arg
+        elif opt == '-s':
+            shard_count = int(arg)
+        elif opt == '-c':
+            cluster_count = int(arg)
+
     with open(token_file, 'r') as file:
         token = file.read()
-    bot.run(token, log_handler=None)
\ No newline at end of file
+
+    if cluster_count > 1:
+        # every cluster logs to its own file. the supervisor only logs starts and restarts
+        log_listener = setup_logging('supervisor.log')
+        try:
+            Supervisor(run_cluster, shard_count or cluster_count, cluster_count, args=(token,)).run()
+        finally:
+            log_listener.stop()
+    else:
+        log_listener = setup_logging()
+        if shard_count:
+            bot = create_bot(commands.AutoShardedBot, shard_count=shard_count)
+        else:
+            bot = create_bot()
+        try:
+            bot.run(token, log_handler=None)
+        finally:
+            log_listener.stop()    # flushes whatever is still in the queue
\ No newline at end of file